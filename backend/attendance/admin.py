@@ -4,7 +4,7 @@ Admin configuration for attendance app.
 from django.contrib import admin
 from .models import (
     AttendanceRecord, AttendanceSummary, AttendanceAlert, 
-    RFIDScan, FaceRecognitionModel, StudentFaceImage
+    RFIDScan, FaceRecognitionModel, StudentFaceImage, BackgroundJob
 )
 
 
@@ -35,9 +35,9 @@ class AttendanceAlertAdmin(admin.ModelAdmin):
 
 @admin.register(RFIDScan)
 class RFIDScanAdmin(admin.ModelAdmin):
-    list_display = ['card_id', 'student', 'scan_timestamp', 'is_processed']
+    list_display = ['card_id', 'student', 'scan_timestamp', 'device_id', 'is_processed']
     list_filter = ['is_processed', 'scan_timestamp']
-    search_fields = ['card_id', 'student__user__first_name', 'student__student_id']
+    search_fields = ['card_id', 'device_id', 'student__user__first_name', 'student__student_id']
     readonly_fields = ['scan_timestamp', 'processed_at']
 
 
@@ -53,6 +53,14 @@ class FaceRecognitionModelAdmin(admin.ModelAdmin):
 class StudentFaceImageAdmin(admin.ModelAdmin):
     list_display = ['student', 'uploaded_at', 'is_active']
     list_filter = ['is_active', 'uploaded_at']
-    search_fields = ['student__user__first_name', 'student__user__last_name', 'student__student_id']
-    readonly_fields = ['uploaded_at']
+    search_fields = ['student__user__first_name', 'student__user__last_name', 'student__student_id', 'content_hash']
+    readonly_fields = ['uploaded_at', 'content_hash', 'perceptual_hash']
     date_hierarchy = 'uploaded_at'
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'job_type', 'status', 'percent', 'attempts', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['job_type', 'status', 'created_at']
+    search_fields = ['task_id', 'message', 'error']
+    readonly_fields = ['created_at', 'started_at', 'finished_at', 'heartbeat_at', 'worker']
@@ -0,0 +1,109 @@
+"""
+Attendance statistics computed with conditional aggregation.
+
+Every helper answers its scope (a day, a date range, one student, a grade)
+in a single query: the per-status counts are `Count(..., filter=Q(status=...))`
+columns of one SELECT instead of one `.filter(status=...).count()` per
+status. Counting starts from Student and joins only the matching records
+(FilteredRelation), so the active-student denominator comes back in the
+same row as the counts.
+"""
+from django.db.models import Count, FilteredRelation, Q
+
+from users.models import Student
+from .models import AttendanceRecord
+
+STATUSES = [status for status, _ in AttendanceRecord.STATUS_CHOICES]
+
+# Statuses that count as attending
+ATTENDED_STATUSES = ('present', 'late', 'excused')
+
+
+def percentage(part, whole):
+    """part / whole as a percentage rounded to 2 places (0 when whole is 0)."""
+    return round(part / whole * 100, 2) if whole else 0
+
+
+def _status_counts(prefix=''):
+    """Aggregate expressions: one conditional count per status, plus the record total."""
+    counts = {status: Count(f'{prefix}id', filter=Q(**{f'{prefix}status': status})) for status in STATUSES}
+    counts['total_records'] = Count(f'{prefix}id')
+    return counts
+
+
+def _with_rates(row):
+    """Add attended total and percentages (per active student and per record) to a counts row."""
+    row['attended'] = sum(row[status] for status in ATTENDED_STATUSES)
+    row['student_percentage'] = percentage(row['attended'], row.get('total_students', 0))
+    row['record_percentage'] = percentage(row['attended'], row['total_records'])
+    return row
+
+
+def _scoped(students, record_filter):
+    """Students with their records matching record_filter joined as `scoped`."""
+    students = Student.objects.all() if students is None else students
+    condition = Q(**{f'attendance_records__{lookup}': value for lookup, value in record_filter.items()})
+    return students.annotate(scoped=FilteredRelation('attendance_records', condition=condition))
+
+
+def attendance_counts(students=None, **record_filter):
+    """
+    Status counts of a scope in one query.
+
+    Args:
+        students: Student queryset to restrict to (one student, a grade, ...); all by default
+        **record_filter: AttendanceRecord lookups selecting the records, e.g. date=...,
+            date__gte=..., date__lt=...
+
+    Returns:
+        Dict with a count per status, 'total_records', 'total_students' (active
+        students in scope), 'attended' (present + late + excused),
+        'student_percentage' (attended / total_students) and 'record_percentage'
+        (attended / total_records)
+    """
+    row = _scoped(students, record_filter).aggregate(
+        total_students=Count('id', filter=Q(is_active=True), distinct=True),
+        **_status_counts('scoped__')
+    )
+    return _with_rates(row)
+
+
+def attendance_counts_by(group_by, students=None, **record_filter):
+    """
+    Status counts per group (e.g. 'grade', or 'id' for per student) in one query.
+
+    Args:
+        group_by: Student field(s) to group by (string or list)
+        students: Student queryset to restrict to
+        **record_filter: AttendanceRecord lookups selecting the records
+
+    Returns:
+        List of dicts: the group_by values plus the keys of attendance_counts
+    """
+    group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+    rows = _scoped(students, record_filter).values(*group_by).annotate(
+        total_students=Count('id', filter=Q(is_active=True), distinct=True),
+        **_status_counts('scoped__')
+    ).order_by(*group_by)
+    return [_with_rates(row) for row in rows]
+
+
+def attendance_trend(records):
+    """
+    Daily status counts of a record queryset in one query.
+
+    Args:
+        records: AttendanceRecord queryset (already filtered to the scope)
+
+    Returns:
+        List of dicts ordered by date: 'date', a count per status, 'total_records',
+        'attended', 'record_percentage' and 'rate' (same as record_percentage)
+    """
+    rows = records.order_by().values('date').annotate(**_status_counts()).order_by('date')
+    trend = []
+    for row in rows:
+        row = _with_rates(row)
+        del row['student_percentage']
+        row['rate'] = row['record_percentage']
+        trend.append(row)
+    return trend
@@ -0,0 +1,74 @@
+"""
+Bulk insertion of attendance records for the batch endpoints.
+
+bulk_create(ignore_conflicts=True) lets the (student, date) unique constraint
+absorb a record that another request stored first, but it does not say which
+rows it skipped. insert_records() reads the inserted days back in one query
+and keeps only the rows that are ours, so callers report (and count) what was
+actually stored.
+
+A stored row is ours when its status, method and timestamp match the record
+we built. Timestamps are compared to the second: MySQL DATETIME columns
+without fractional precision drop the microseconds.
+"""
+import logging
+
+from .models import AttendanceRecord
+
+logger = logging.getLogger('attendance')
+
+# Rows per INSERT statement
+BULK_BATCH_SIZE = 500
+
+
+def stored_records(keys):
+    """
+    The attendance records stored for (student pk, date) keys, in one query.
+
+    Returns:
+        {(student pk, date): (status, timestamp, method)} for the keys that have a record
+    """
+    if not keys:
+        return {}
+    rows = AttendanceRecord.objects.filter(
+        student_id__in={student_pk for student_pk, _ in keys},
+        date__in={date for _, date in keys}
+    ).values_list('student_id', 'date', 'status', 'timestamp', 'method')
+    return {
+        (student_pk, date): (status, timestamp, method)
+        for student_pk, date, status, timestamp, method in rows if (student_pk, date) in keys
+    }
+
+
+def is_stored_record(record, stored):
+    """Whether a stored (status, timestamp, method) row is `record` as built (timestamps to the second)."""
+    if stored is None:
+        return False
+    status, timestamp, method = stored
+    return (
+        (status, method) == (record.status, record.method)
+        and timestamp.replace(microsecond=0) == record.timestamp.replace(microsecond=0)
+    )
+
+
+def insert_records(new_records):
+    """
+    Insert records, skipping days that already have one, and tell which were inserted.
+    Call inside transaction.atomic() so the read-back sees the same rows.
+
+    Args:
+        new_records: Unsaved AttendanceRecord instances with date and timestamp set
+
+    Returns:
+        Tuple of (inserted records, {(student pk, date): (status, timestamp, method)}
+        as stored for every day of new_records)
+    """
+    AttendanceRecord.objects.bulk_create(new_records, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+    stored = stored_records({(record.student_id, record.date) for record in new_records})
+    inserted = [
+        record for record in new_records
+        if is_stored_record(record, stored.get((record.student_id, record.date)))
+    ]
+    if len(inserted) < len(new_records):
+        logger.info(f"{len(new_records) - len(inserted)} attendance record(s) were already stored by another request")
+    return inserted, stored
@@ -0,0 +1,385 @@
+"""
+Background job handlers for face recognition dataset processing and training.
+Run by the job worker (see attendance.jobs); the views only enqueue them.
+"""
+import os
+import logging
+from datetime import datetime
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.base import ContentFile
+
+from users.models import Student
+from attendance.models import FaceRecognitionModel, StudentFaceImage
+from utils.face_recognition_utils import get_face_engine, FACE_RECOGNITION_AVAILABLE
+from utils.dataset_handler import DatasetHandler
+from .jobs import JobCancelled, JobFailed, register_job, will_retry
+
+logger = logging.getLogger(__name__)
+
+
+def _activate_model_version(face_engine, training_result, training_duration, notes):
+    """Record a newly trained model as the active FaceRecognitionModel version."""
+    model_version = f"v{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    FaceRecognitionModel.objects.filter(is_active=True).update(is_active=False)
+    model_record = FaceRecognitionModel.objects.create(
+        model_version=model_version,
+        model_path=face_engine.model_path,
+        dataset_size=training_result['processed'],
+        training_duration_seconds=training_duration,
+        is_active=True,
+        gallery_version=training_result['gallery_version'],
+        notes=notes
+    )
+    return model_record
+
+
+@register_job('dataset_upload')
+def process_dataset_upload(context, payload):
+    """
+    Stream an uploaded dataset ZIP, validate its images, store those of known students and auto-train.
+
+    Args:
+        context: JobContext for progress reporting
+        payload: {'zip_path': path of the saved upload}
+
+    Returns:
+        Upload summary (same shape the upload endpoint used to return)
+    """
+    zip_path = payload['zip_path']
+    if not os.path.exists(zip_path):
+        raise JobFailed(f"Uploaded dataset no longer exists: {os.path.basename(zip_path)}")
+
+    # The upload is kept while the job can still be retried, and removed after its last attempt
+    last_attempt = True
+    try:
+        return _import_dataset(context, zip_path)
+    except Exception as e:
+        last_attempt = not will_retry(context.job, e)
+        raise
+    except BaseException:
+        last_attempt = False  # interrupted: the stale job is re-queued
+        raise
+    finally:
+        if last_attempt and os.path.exists(zip_path):
+            os.remove(zip_path)
+
+
+def _import_dataset(context, zip_path):
+    """Body of process_dataset_upload: store the dataset's images and auto-train."""
+    students = {}
+
+    def find_student(student_id_str):
+        """Resolve a dataset student ID (case-insensitive, then without separators), cached per ID."""
+        if student_id_str not in students:
+            student = Student.objects.select_related('user').filter(student_id__iexact=student_id_str).first()
+            if student is None:
+                clean_id = student_id_str.replace('_', '').replace('-', '').strip()
+                student = Student.objects.select_related('user').filter(student_id__iexact=clean_id).first()
+            if student:
+                logger.info(f"Mapped student ID '{student_id_str}' to student: {student.user.get_full_name()}")
+            else:
+                logger.warning(f"Student ID '{student_id_str}' not found in database")
+            students[student_id_str] = student
+        return students[student_id_str]
+
+    # Images are content-addressed: bytes already stored (by any upload) are not validated,
+    # encoded or written again
+    known_hashes = set(StudentFaceImage.objects.exclude(content_hash=None).values_list('content_hash', flat=True))
+    handled_hashes = set()
+    near_duplicate_distance = getattr(settings, 'DATASET_NEAR_DUPLICATE_DISTANCE', 0)
+    face_hashes = {}
+
+    def is_near_duplicate(student, face_hash):
+        """Whether the student already has an image whose face crop dHash is within the configured distance."""
+        if not near_duplicate_distance or not face_hash:
+            return False
+        if student.id not in face_hashes:
+            face_hashes[student.id] = [
+                int(h, 16) for h in StudentFaceImage.objects.filter(student=student, is_active=True)
+                .exclude(perceptual_hash='').values_list('perceptual_hash', flat=True)
+            ]
+        value = int(face_hash, 16)
+        if any(bin(value ^ other).count('1') <= near_duplicate_distance for other in face_hashes[student.id]):
+            return True
+        face_hashes[student.id].append(value)
+        return False
+
+    def image_info(face_image):
+        return {
+            'id': face_image.id,
+            'path': face_image.image.name,
+            'url': face_image.image.url if hasattr(face_image.image, 'url') else None
+        }
+
+    # Stream the ZIP: images are validated and encoded from memory, and only accepted
+    # images of known students are written, once, to their final storage path
+    context.progress(15, "Reading and validating images...", force=True)
+    handler = DatasetHandler()
+    student_mappings = {}
+    unmapped = {}
+    invalid_images = []
+    total_images = 0
+    valid_images = 0
+    duplicate_images = 0
+
+    for entry in handler.iter_dataset(
+        zip_path,
+        accept_student=lambda student_id_str: find_student(student_id_str) is not None,
+        is_known=known_hashes.__contains__,
+        progress_callback=lambda done, total: context.progress(15 + int(done / total * 35), f"Processed {done}/{total} images...")
+    ):
+        total_images += 1
+        student_id_str = entry['student_id']
+        if entry['status'] == 'no_student_id':
+            invalid_images.append({'path': os.path.basename(entry['name']), 'error': 'Could not extract student ID'})
+            continue
+        if entry['status'] == 'invalid':
+            invalid_images.append({'path': os.path.basename(entry['name']), 'error': entry['error']})
+            continue
+        if entry['status'] == 'unmapped':
+            unmapped.setdefault(student_id_str, []).append(os.path.basename(entry['name']))
+            continue
+
+        student = find_student(student_id_str)
+        mapping = student_mappings.setdefault(student_id_str, {
+            'student_id': student.id,
+            'student_name': student.user.get_full_name(),
+            'images': []
+        })
+
+        if entry['status'] == 'duplicate':
+            duplicate_images += 1
+            if entry['content_hash'] in handled_hashes or entry['content_hash'] not in known_hashes:
+                continue  # repeated inside this archive; the first copy is handled
+            handled_hashes.add(entry['content_hash'])
+            existing = StudentFaceImage.objects.filter(content_hash=entry['content_hash']).select_related('student').first()
+            if existing is None:
+                continue
+            if existing.student_id != student.id:
+                invalid_images.append({
+                    'path': os.path.basename(entry['name']),
+                    'error': f"Same image is already enrolled for student {existing.student.student_id}"
+                })
+                continue
+            # Reuse the stored image and its cached encoding
+            if not existing.is_active:
+                existing.is_active = True
+                existing.save(update_fields=['is_active'])
+            mapping['images'].append(image_info(existing))
+            continue
+
+        if is_near_duplicate(student, entry['face_hash']):
+            duplicate_images += 1
+            logger.info(f"Skipping near-duplicate image {entry['name']} for student {student.student_id}")
+            continue
+
+        valid_images += 1
+        file_path = None
+        try:
+            filename = f"student_{student.student_id}_{entry['content_hash'][:16]}.jpg"
+            file_path = default_storage.save(f'student_faces/dataset/{filename}', ContentFile(entry['data']))
+
+            # Keep the encoding computed during validation so auto-training does not encode the image again
+            face_image = StudentFaceImage(
+                student=student,
+                image=file_path,
+                is_active=True,
+                face_location=entry['location'],
+                content_hash=entry['content_hash'],
+                perceptual_hash=entry['face_hash'] or ''
+            )
+            face_image.set_encoding(entry['encoding'])
+            with transaction.atomic():
+                face_image.save()
+            known_hashes.add(entry['content_hash'])
+            handled_hashes.add(entry['content_hash'])
+            mapping['images'].append(image_info(face_image))
+        except IntegrityError:
+            # Stored concurrently by another upload
+            default_storage.delete(file_path)
+            valid_images -= 1
+            duplicate_images += 1
+        except Exception as e:
+            logger.error(f"Error saving image {entry['name']}: {e}")
+
+    student_mappings = {k: mapping for k, mapping in student_mappings.items() if mapping['images']}
+    logger.info(
+        f"Dataset processed: {total_images} total images, {valid_images} new, "
+        f"{duplicate_images} duplicates, {len(student_mappings)} students mapped"
+    )
+
+    # Update student face enrollment status
+    with transaction.atomic():
+        for student_id_str in student_mappings:
+            student = students[student_id_str]
+            student.face_images_count = StudentFaceImage.objects.filter(
+                student=student, is_active=True
+            ).count()
+            if student.face_images_count > 0:
+                student.is_face_enrolled = True
+                if not student.face_enrolled_at:
+                    student.face_enrolled_at = timezone.now()
+            student.save()
+
+    unmapped_images = [
+        {'student_id': student_id_str, 'image_count': len(names), 'images': names[:5]}  # Show first 5 filenames
+        for student_id_str, names in unmapped.items()
+    ]
+    for item in unmapped_images:
+        logger.warning(f"Student ID '{item['student_id']}' not found in database. Images: {item['image_count']}")
+
+    # Auto-train model if we have mapped students
+    training_triggered = False
+    training_result = None
+    if len(student_mappings) > 0:
+        logger.info(f"🔄 [AUTO-TRAIN] Auto-training model after dataset upload with {len(student_mappings)} students...")
+        print(f"🔄 [AUTO-TRAIN] Auto-training model after dataset upload with {len(student_mappings)} students...")
+
+        context.progress(50, "Preparing to train model...", force=True)
+
+        try:
+            # Get training data
+            training_data = []
+            for student_id_str, mapping in student_mappings.items():
+                for img_info in mapping['images']:
+                    # Get full path
+                    img_path = os.path.join(settings.MEDIA_ROOT, img_info['path'])
+                    if os.path.exists(img_path):
+                        training_data.append({
+                            'image_path': img_path,
+                            'student_id': student_id_str,
+                            'face_image_id': img_info.get('id')
+                        })
+
+            if len(training_data) > 0:
+                logger.info(f"🔄 [AUTO-TRAIN] Preparing to train with {len(training_data)} images...")
+                context.progress(55, f"Starting training with {len(training_data)} images...", force=True)
+
+                face_engine = get_face_engine()
+                start_time = datetime.now()
+
+                # Define callback
+                def training_progress_callback(percent, msg):
+                    # Map 0-100 training percent to 55-95 overall percent
+                    overall = 55 + int(percent * 0.4)
+                    context.progress(overall, msg)
+
+                training_result = face_engine.train_model(training_data, progress_callback=training_progress_callback)
+                context.check_cancelled()
+
+                end_time = datetime.now()
+                training_duration = (end_time - start_time).total_seconds()
+
+                if training_result['success']:
+                    logger.info(f"✅ [AUTO-TRAIN] Training completed in {training_duration:.2f} seconds")
+                    context.progress(98, "Saving trained model...", force=True)
+                    print(f"✅ [AUTO-TRAIN] Training completed in {training_duration:.2f} seconds")
+
+                    # Save model version
+                    model_record = _activate_model_version(
+                        face_engine, training_result, training_duration,
+                        f"Auto-trained after dataset upload: {len(student_mappings)} students"
+                    )
+                    training_triggered = True
+                    logger.info(f"✅ [AUTO-TRAIN] Model saved and activated: {model_record.model_version}")
+                    print(f"✅ [AUTO-TRAIN] Model saved and activated: {model_record.model_version}")
+                else:
+                    logger.error(f"❌ [AUTO-TRAIN] Training failed: {training_result.get('error')}")
+                    print(f"❌ [AUTO-TRAIN] Training failed: {training_result.get('error')}")
+        except JobCancelled:
+            raise
+        except Exception as e:
+            logger.error(f"❌ [AUTO-TRAIN] Error during auto-training: {e}", exc_info=True)
+            print(f"❌ [AUTO-TRAIN] Error during auto-training: {e}")
+            # Don't fail the upload if training fails
+
+    return {
+        'success': True,
+        'message': "Dataset processed successfully",
+        'total_images': total_images,
+        'valid_images': valid_images,
+        'duplicate_images': duplicate_images,
+        'mapped_students': len(student_mappings),
+        'unmapped_students': len(unmapped_images),
+        'student_mappings': student_mappings,
+        'unmapped_images': unmapped_images,
+        'invalid_images': invalid_images[:10],  # Limit response size
+        'auto_training': {
+            'triggered': training_triggered,
+            'success': training_result['success'] if training_result else False,
+            'processed': training_result.get('processed', 0) if training_result else 0
+        }
+    }
+
+
+@register_job('train_model')
+def train_face_model(context, payload):
+    """
+    Retrain the face recognition model from all active student face images.
+
+    Args:
+        context: JobContext for progress reporting
+        payload: Unused
+
+    Returns:
+        Training summary (same shape the train endpoint used to return)
+    """
+    if not FACE_RECOGNITION_AVAILABLE:
+        raise JobFailed('Face recognition module is not installed on the server. Training skipped.')
+
+    # Get all active student face images
+    context.progress(0, "Collecting face images...", force=True)
+    face_images = StudentFaceImage.objects.filter(is_active=True).select_related('student')
+
+    # Prepare training data
+    training_data = []
+    for face_image in face_images:
+        image_path = face_image.image.path if hasattr(face_image.image, 'path') else None
+        if image_path and os.path.exists(image_path):
+            training_data.append({
+                'image_path': image_path,
+                'student_id': face_image.student.student_id,
+                'face_image_id': face_image.id
+            })
+
+    if len(training_data) == 0:
+        raise JobFailed('No valid image files found for training.')
+
+    # Train the model
+    logger.info(f"🎯 [TRAINING] Starting model training with {len(training_data)} images...")
+    print(f"🎯 [TRAINING] Starting model training with {len(training_data)} images...")
+
+    face_engine = get_face_engine()
+    start_time = datetime.now()
+    training_result = face_engine.train_model(
+        training_data, progress_callback=lambda percent, msg: context.progress(percent * 0.95, msg)
+    )
+    context.check_cancelled()
+    end_time = datetime.now()
+    training_duration = (end_time - start_time).total_seconds()
+
+    logger.info(f"⏱️ [TRAINING] Training completed in {training_duration:.2f} seconds")
+    print(f"⏱️ [TRAINING] Training completed in {training_duration:.2f} seconds")
+
+    if not training_result['success']:
+        raise RuntimeError(training_result.get('error', 'Training failed'))
+
+    # Save model version to database
+    model_record = _activate_model_version(
+        face_engine, training_result, training_duration,
+        f"Auto-trained from {training_result['unique_students']} students"
+    )
+
+    return {
+        'success': True,
+        'message': 'Model trained successfully',
+        'model_version': model_record.model_version,
+        'model_id': model_record.id,
+        'dataset_size': training_result['processed'],
+        'unique_students': training_result['unique_students'],
+        'training_duration_seconds': training_duration,
+        'errors': training_result.get('errors', [])[:10]  # Limit errors in response
+    }
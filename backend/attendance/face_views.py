@@ -2,45 +2,47 @@
 Face Recognition API views for attendance system.
 """
 import os
+import uuid
 import logging
+import zipfile
 from datetime import datetime
 from django.db import transaction
 from django.utils import timezone
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
-from django.core.cache import cache
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from users.models import Student
-from attendance.models import AttendanceRecord, FaceRecognitionModel, StudentFaceImage
+from attendance.models import AttendanceRecord, BackgroundJob, FaceRecognitionModel, StudentFaceImage
+from .bulk_records import insert_records
 from .serializers import AttendanceRecordSerializer
+from .summaries import count_records
+from .recognition_sessions import RecognitionSession
 from utils.face_recognition_utils import get_face_engine, FACE_RECOGNITION_AVAILABLE
-from utils.dataset_handler import DatasetHandler
+from utils.recognition_cache import face_hash
+from . import jobs
 
 logger = logging.getLogger(__name__)
 
+BATCH_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def upload_dataset(request):
     """
-    Upload and process a ZIP file containing student face images.
+    Upload a ZIP file containing student face images and queue it for processing.
     Expected format: ZIP file with images named like student_id.jpg, STU001.jpg, etc.
+    Extraction, validation, student mapping and auto-training run in a background
+    job; poll get_upload_progress with the returned job_id/task_id.
     """
     try:
-        task_id = request.data.get('task_id')
-        
-        def update_progress(percent, msg):
-            if task_id:
-                cache.set(f'dataset_progress_{task_id}', {
-                    'percent': percent, 
-                    'status': 'processing', 
-                    'message': msg
-                }, timeout=300)
+        task_id = request.data.get('task_id') or ''
 
         if 'dataset' not in request.FILES:
             return Response(
@@ -48,7 +50,6 @@ def upload_dataset(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        update_progress(5, "Validating file...")
         zip_file = request.FILES['dataset']
         
         # Validate file type
@@ -58,209 +59,21 @@ def upload_dataset(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Save uploaded file temporarily
+        # Save uploaded file under a unique name so concurrent uploads don't collide
         upload_dir = os.path.join(settings.MEDIA_ROOT, 'dataset_uploads')
         os.makedirs(upload_dir, exist_ok=True)
         
-        update_progress(10, "Saving uploaded file...")
-        zip_path = os.path.join(upload_dir, zip_file.name)
+        zip_path = os.path.join(upload_dir, f"{uuid.uuid4().hex}_{os.path.basename(zip_file.name)}")
         with open(zip_path, 'wb+') as destination:
             for chunk in zip_file.chunks():
                 destination.write(chunk)
         
-        # Process the dataset
-        update_progress(15, "Extracting and validating images...")
-        handler = DatasetHandler()
-        result = handler.process_dataset(zip_path)
-        
-        if not result['success']:
-            return Response(
-                {'error': result.get('error', 'Failed to process dataset')},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        logger.info(f"Dataset processed: {result['total_images']} total images, {len(result['valid_images'])} valid, {len(result['student_images'])} student groups")
-        
-        # Map images to students in database
-        student_mappings = {}
-        unmapped_images = []
-        
-        update_progress(20, "Mapping students to database...")
-        total_students_to_map = len(result['student_images'])
-        
-        with transaction.atomic():
-            for idx, (student_id_str, image_paths) in enumerate(result['student_images'].items()):
-                # Update progress
-                if total_students_to_map > 0:
-                    current_percent = 20 + int((idx / total_students_to_map) * 30)
-                    update_progress(current_percent, f"Mapping student {student_id_str}...")
-                
-                try:
-                    # Try to find student by student_id (case-insensitive)
-                    # First try exact match
-                    student = None
-                    try:
-                        student = Student.objects.get(student_id__iexact=student_id_str)
-                    except Student.DoesNotExist:
-                        # Try with variations (remove underscores, etc.)
-                        clean_id = student_id_str.replace('_', '').replace('-', '').strip()
-                        students = Student.objects.filter(student_id__iexact=clean_id)
-                        if students.exists():
-                            student = students.first()
-                    
-                    if student:
-                        logger.info(f"Mapped student ID '{student_id_str}' to student: {student.user.get_full_name()}")
-                        student_mappings[student_id_str] = {
-                            'student_id': student.id,
-                            'student_name': student.user.get_full_name(),
-                            'images': []
-                        }
-                        
-                        # Save images to StudentFaceImage model
-                        for img_idx, img_path in enumerate(image_paths):
-                            try:
-                                # Copy image to media directory
-                                with open(img_path, 'rb') as f:
-                                    file_content = f.read()
-                                
-                                # Create filename based on student_id
-                                filename = f"student_{student.student_id}_{img_idx}.jpg"
-                                file_path = default_storage.save(
-                                    f'student_faces/dataset/{filename}',
-                                    ContentFile(file_content)
-                                )
-                                
-                                # Create StudentFaceImage record
-                                face_image = StudentFaceImage.objects.create(
-                                    student=student,
-                                    image=file_path,
-                                    is_active=True
-                                )
-                                
-                                student_mappings[student_id_str]['images'].append({
-                                    'id': face_image.id,
-                                    'path': file_path,
-                                    'url': face_image.image.url if hasattr(face_image.image, 'url') else None
-                                })
-                            except Exception as e:
-                                logger.error(f"Error saving image {img_path}: {e}")
-                        
-                        # Update student face enrollment status
-                        student.face_images_count = StudentFaceImage.objects.filter(
-                            student=student, is_active=True
-                        ).count()
-                        if student.face_images_count > 0:
-                            student.is_face_enrolled = True
-                            if not student.face_enrolled_at:
-                                student.face_enrolled_at = timezone.now()
-                        student.save()
-                    else:
-                        # Student not found
-                        unmapped_images.append({
-                            'student_id': student_id_str,
-                            'image_count': len(image_paths),
-                            'images': [os.path.basename(p) for p in image_paths[:5]]  # Show first 5 filenames
-                        })
-                        logger.warning(f"Student ID '{student_id_str}' not found in database. Images: {len(image_paths)}")
-                    
-                except Exception as e:
-                    logger.error(f"Error processing student_id '{student_id_str}': {e}")
-                    unmapped_images.append({
-                        'student_id': student_id_str,
-                        'image_count': len(image_paths),
-                        'error': str(e)
-                    })
-        
-        # Auto-train model if we have mapped students
-        training_triggered = False
-        training_result = None
-        if len(student_mappings) > 0:
-            logger.info(f"🔄 [AUTO-TRAIN] Auto-training model after dataset upload with {len(student_mappings)} students...")
-            print(f"🔄 [AUTO-TRAIN] Auto-training model after dataset upload with {len(student_mappings)} students...")
-            
-            update_progress(50, "Preparing to train model...")
-            
-            try:
-                # Get training data
-                training_data = []
-                for student_id_str, mapping in student_mappings.items():
-                    for img_info in mapping['images']:
-                        # Get full path
-                        img_path = os.path.join(settings.MEDIA_ROOT, img_info['path'])
-                        if os.path.exists(img_path):
-                            training_data.append({
-                                'image_path': img_path,
-                                'student_id': student_id_str,
-                                'face_image_id': img_info.get('id')
-                            })
-                
-                if len(training_data) > 0:
-                    logger.info(f"🔄 [AUTO-TRAIN] Preparing to train with {len(training_data)} images...")
-                    update_progress(55, f"Starting training with {len(training_data)} images...")
-                    
-                    face_engine = get_face_engine()
-                    start_time = datetime.now()
-                    
-                    # Define callback
-                    def training_progress_callback(percent, msg):
-                        # Map 0-100 training percent to 55-95 overall percent
-                        overall = 55 + int(percent * 0.4)
-                        update_progress(overall, msg)
-                        
-                    training_result = face_engine.train_model(training_data, progress_callback=training_progress_callback)
-                    
-                    end_time = datetime.now()
-                    training_duration = (end_time - start_time).total_seconds()
-                    
-                    if training_result['success']:
-                        logger.info(f"✅ [AUTO-TRAIN] Training completed in {training_duration:.2f} seconds")
-                        update_progress(98, "Saving trained model...")
-                        print(f"✅ [AUTO-TRAIN] Training completed in {training_duration:.2f} seconds")
-                        # Reload the model to ensure it's in memory
-                        face_engine.load_model()
-                        
-                        # Save model version
-                        model_version = f"v{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                        FaceRecognitionModel.objects.filter(is_active=True).update(is_active=False)
-                        FaceRecognitionModel.objects.create(
-                            model_version=model_version,
-                            model_path=face_engine.model_path,
-                            dataset_size=training_result['processed'],
-                            training_duration_seconds=training_duration,
-                            is_active=True,
-                            notes=f"Auto-trained after dataset upload: {len(student_mappings)} students"
-                        )
-                        training_triggered = True
-                        logger.info(f"✅ [AUTO-TRAIN] Model saved and activated: {model_version}")
-                        print(f"✅ [AUTO-TRAIN] Model saved and activated: {model_version}")
-                    else:
-                        logger.error(f"❌ [AUTO-TRAIN] Training failed: {training_result.get('error')}")
-                        print(f"❌ [AUTO-TRAIN] Training failed: {training_result.get('error')}")
-            except Exception as e:
-                logger.error(f"❌ [AUTO-TRAIN] Error during auto-training: {e}", exc_info=True)
-                print(f"❌ [AUTO-TRAIN] Error during auto-training: {e}")
-                # Don't fail the upload if training fails
-        
-        # Return response
-        update_progress(100, "Processing complete!")
-        response_data = {
+        job = jobs.enqueue('dataset_upload', {'zip_path': zip_path}, user=request.user, task_id=task_id)
+        return Response({
             'success': True,
-            'message': f"Dataset processed successfully",
-            'total_images': result['total_images'],
-            'valid_images': len(result['valid_images']),
-            'mapped_students': len(student_mappings),
-            'unmapped_students': len(unmapped_images),
-            'student_mappings': student_mappings,
-            'unmapped_images': unmapped_images,
-            'invalid_images': result.get('invalid_images', [])[:10],  # Limit response size
-            'auto_training': {
-                'triggered': training_triggered,
-                'success': training_result['success'] if training_result else False,
-                'processed': training_result.get('processed', 0) if training_result else 0
-            }
-        }
-        
-        return Response(response_data, status=status.HTTP_201_CREATED)
+            'message': 'Dataset uploaded and queued for processing',
+            **job.to_progress()
+        }, status=status.HTTP_202_ACCEPTED)
         
     except Exception as e:
         logger.error(f"Error uploading dataset: {e}", exc_info=True)
@@ -274,33 +87,14 @@ def upload_dataset(request):
 @permission_classes([IsAuthenticated])
 def train_model(request):
     """
-    Train/retrain the face recognition model using all enrolled student face images.
+    Queue a retrain of the face recognition model using all enrolled student face images.
     """
     try:
-        # Get all active student face images
-        face_images = StudentFaceImage.objects.filter(is_active=True).select_related('student')
-        
-        if face_images.count() == 0:
+        if not StudentFaceImage.objects.filter(is_active=True).exists():
             return Response(
                 {'error': 'No face images found. Please upload a dataset first.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        # Prepare training data
-        training_data = []
-        for face_image in face_images:
-            image_path = face_image.image.path if hasattr(face_image.image, 'path') else None
-            if image_path and os.path.exists(image_path):
-                training_data.append({
-                    'image_path': image_path,
-                    'student_id': face_image.student.student_id
-                })
-        
-        if len(training_data) == 0:
-            return Response(
-                {'error': 'No valid image files found for training.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
             
         # Check if face recognition is available
         if not FACE_RECOGNITION_AVAILABLE:
@@ -313,55 +107,16 @@ def train_model(request):
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
         
-        # Train the model
-        logger.info(f"🎯 [TRAINING] Starting model training with {len(training_data)} images...")
-        print(f"🎯 [TRAINING] Starting model training with {len(training_data)} images...")
-        
-        face_engine = get_face_engine()
-        start_time = datetime.now()
-        training_result = face_engine.train_model(training_data)
-        end_time = datetime.now()
-        training_duration = (end_time - start_time).total_seconds()
-        
-        logger.info(f"⏱️ [TRAINING] Training completed in {training_duration:.2f} seconds")
-        print(f"⏱️ [TRAINING] Training completed in {training_duration:.2f} seconds")
-        
-        if not training_result['success']:
-            return Response(
-                {'error': training_result.get('error', 'Training failed')},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Reload the model to ensure it's in memory
-        face_engine.load_model()
-        
-        # Save model version to database
-        model_version = f"v{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        model_path = face_engine.model_path
-        
-        # Deactivate previous models
-        FaceRecognitionModel.objects.filter(is_active=True).update(is_active=False)
-        
-        # Create new model record
-        model_record = FaceRecognitionModel.objects.create(
-            model_version=model_version,
-            model_path=model_path,
-            dataset_size=training_result['processed'],
-            training_duration_seconds=training_duration,
-            is_active=True,
-            notes=f"Auto-trained from {training_result['unique_students']} students"
-        )
+        # Only one training job at a time: return the one already queued/running
+        job = BackgroundJob.objects.filter(job_type='train_model', status__in=['queued', 'running']).first()
+        if job is None:
+            job = jobs.enqueue('train_model', user=request.user, task_id=request.data.get('task_id') or '')
         
         return Response({
             'success': True,
-            'message': 'Model trained successfully',
-            'model_version': model_version,
-            'model_id': model_record.id,
-            'dataset_size': training_result['processed'],
-            'unique_students': training_result['unique_students'],
-            'training_duration_seconds': training_duration,
-            'errors': training_result.get('errors', [])[:10]  # Limit errors in response
-        }, status=status.HTTP_201_CREATED)
+            'message': 'Model training queued',
+            **job.to_progress()
+        }, status=status.HTTP_202_ACCEPTED)
         
     except Exception as e:
         logger.error(f"Error training model: {e}", exc_info=True)
@@ -371,6 +126,40 @@ def train_model(request):
         )
 
 
+def _save_unrecognized_capture(image_bytes, source):
+    """
+    Keep an unrecognized frame for review, at most one per camera device or user every
+    FACE_UNRECOGNIZED_CAPTURE_INTERVAL seconds (0 = never): a camera loop facing an
+    unknown face would otherwise write a file for every frame.
+
+    Returns:
+        Storage path of the capture, or None if throttled
+    """
+    interval = getattr(settings, 'FACE_UNRECOGNIZED_CAPTURE_INTERVAL', 60)
+    if interval <= 0 or not cache.add(f'face-capture:{source}', True, timeout=interval):
+        return None
+    return default_storage.save(
+        f'attendance_captures/unrecognized_{datetime.now().strftime("%Y%m%d_%H%M%S")}.jpg',
+        ContentFile(image_bytes)
+    )
+
+
+def _resolve_track(session, track, signature, student, record):
+    """Answer later frames of a recognition-session track's face with this student's record."""
+    if session is None or track is None:
+        return
+    session.resolve(track, {
+        'success': True,
+        'message': f'Attendance already recorded for {student.user.get_full_name()}',
+        'student_name': student.user.get_full_name(),
+        'student_id': student.student_id,
+        'status': record.status,
+        'timestamp': record.timestamp,
+        'already_recorded': True
+    }, signature)
+    session.save()
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def mark_attendance_face(request):
@@ -386,27 +175,48 @@ def mark_attendance_face(request):
         
         image_file = request.FILES['image']
         
-        # Save uploaded image temporarily
-        upload_dir = os.path.join(settings.MEDIA_ROOT, 'attendance_temp')
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        temp_path = os.path.join(upload_dir, f"temp_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg")
-        with open(temp_path, 'wb+') as destination:
-            for chunk in image_file.chunks():
-                destination.write(chunk)
-        
-        # Recognize face
+        # Decode and recognize in memory; the bytes are reused for the capture
+        image_bytes = image_file.read()
         face_engine = get_face_engine()
-        recognition_result = face_engine.recognize_face(temp_path)
+        
+        # Camera loops send a device_id: frames of a face already identified in this
+        # session are answered without encoding, matching or database lookups
+        session = RecognitionSession.for_device(request.data.get('device_id') or request.headers.get('X-Device-ID'))
+        track = signature = None
+        if session is None:
+            # Without a device, repeated frames are cached per user
+            recognition_result = face_engine.recognize_face_from_bytes(image_bytes, scope=f'user-{request.user.pk}')
+        else:
+            rgb_image, location = face_engine.locate_face_from_bytes(image_bytes)
+            recognition_result = None
+            if location is None:
+                session.face_left()
+            else:
+                # Hashed before recognition, which enhances the face region in place
+                signature = face_hash(rgb_image, location)
+                track = session.track_for(location, signature)
+                if track['resolved']:
+                    session.save()
+                    return Response({**track['resolved'], 'suppressed': True, 'track_id': track['id']}, status=status.HTTP_200_OK)
+                recognition_result = face_engine.recognize_located_face(rgb_image, location, scope=session.device_id)
+                winner = session.vote(track, recognition_result)
+                if recognition_result and recognition_result.get('matched'):
+                    if winner is None:
+                        session.save()
+                        return Response({
+                            'success': False,
+                            'pending': True,
+                            'message': 'Confirming identity, keep looking at the camera...',
+                            'track_id': track['id'],
+                            'votes': track['votes'].get(recognition_result['student_id'], 0),
+                            'votes_required': getattr(settings, 'FACE_SESSION_MIN_VOTES', 2),
+                        }, status=status.HTTP_202_ACCEPTED)
+                    recognition_result = dict(recognition_result, student_id=winner, confidence=track['best_confidence'][winner])
+            session.save()
         
         if not recognition_result or not recognition_result.get('matched'):
-            # Save captured image for review
-            captured_image_path = default_storage.save(
-                f'attendance_captures/unrecognized_{datetime.now().strftime("%Y%m%d_%H%M%S")}.jpg',
-                ContentFile(open(temp_path, 'rb').read())
-            )
-            os.remove(temp_path)
-            
+            _save_unrecognized_capture(image_bytes, session.device_id if session else f'user-{request.user.pk}')
+
             return Response({
                 'success': False,
                 'error': 'Face not recognized',
@@ -418,20 +228,19 @@ def mark_attendance_face(request):
         try:
             student = Student.objects.get(student_id=recognition_result['student_id'])
         except Student.DoesNotExist:
-            os.remove(temp_path)
             return Response(
                 {'error': f"Student {recognition_result['student_id']} not found in database"},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         # Check if attendance already recorded for today
-        today = timezone.now().date()
+        today = timezone.localdate()
         existing_record = AttendanceRecord.objects.filter(
             student=student, date=today
         ).first()
         
         if existing_record:
-            os.remove(temp_path)
+            _resolve_track(session, track, signature, student, existing_record)
             return Response({
                 'success': True,
                 'message': f'Attendance already recorded for {student.user.get_full_name()}',
@@ -443,14 +252,10 @@ def mark_attendance_face(request):
             }, status=status.HTTP_200_OK)
         
         # Save captured image
-        with open(temp_path, 'rb') as f:
-            captured_image_content = f.read()
-        
         captured_image_path = default_storage.save(
             f'attendance_captures/{student.student_id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.jpg',
-            ContentFile(captured_image_content)
+            ContentFile(image_bytes)
         )
-        os.remove(temp_path)
         
         # Create attendance record
         with transaction.atomic():
@@ -464,10 +269,7 @@ def mark_attendance_face(request):
                 confidence_score=recognition_result['confidence'],
                 face_match_student_id=recognition_result['student_id']
             )
-            
-            # Update daily summary
-            from .views import update_daily_summary
-            update_daily_summary(today)
+        _resolve_track(session, track, signature, student, attendance_record)
         
         # Return success response
         serializer = AttendanceRecordSerializer(attendance_record, context={'request': request})
@@ -491,6 +293,256 @@ def mark_attendance_face(request):
         )
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def mark_attendance_group(request):
+    """
+    Mark attendance for every recognized face in one group (classroom) photo.
+    Each student is matched to at most one face, and all new records are
+    created in a single transaction.
+    """
+    try:
+        if 'image' not in request.FILES:
+            return Response(
+                {'error': 'No image file provided'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        image_bytes = request.FILES['image'].read()
+        face_engine = get_face_engine()
+        faces = face_engine.recognize_faces_from_bytes(image_bytes)
+
+        if faces is None:
+            return Response(
+                {'error': 'Could not process image. Check that the face recognition model is trained.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(faces) == 0:
+            return Response({
+                'success': False,
+                'error': 'No faces detected',
+                'message': 'No faces found in the photo. Please try again with the class facing the camera.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        matched_ids = [face['student_id'] for face in faces if face['matched']]
+        students = Student.objects.select_related('user').in_bulk(matched_ids, field_name='student_id')
+        today = timezone.localdate()
+        already_recorded = set(
+            AttendanceRecord.objects.filter(date=today, student__in=students.values())
+            .values_list('student__student_id', flat=True)
+        )
+
+        results = []
+        new_records = []
+        for face in faces:
+            entry = {
+                'location': face['location'],
+                'confidence': face['confidence'],
+                'student_id': None,
+                'student_name': None,
+                'status': 'unrecognized',
+            }
+            student = students.get(face['student_id']) if face['matched'] else None
+            if student is not None:
+                entry.update(student_id=student.student_id, student_name=student.user.get_full_name(), grade=student.grade)
+                if student.student_id in already_recorded:
+                    entry['status'] = 'already_recorded'
+                else:
+                    entry['status'] = 'recorded'
+                    new_records.append(AttendanceRecord(
+                        student=student,
+                        date=today,
+                        status='present',
+                        method='face',
+                        recorded_by=request.user,
+                        confidence_score=face['confidence'],
+                        face_match_student_id=student.student_id
+                    ))
+            elif face['matched']:
+                entry['status'] = 'unknown_student'
+                entry['student_id'] = face['student_id']
+            results.append(entry)
+
+        if new_records or any(entry['status'] != 'already_recorded' for entry in results):
+            # One capture shared by every new record, kept for review of unrecognized faces
+            captured_image_path = default_storage.save(
+                f'attendance_captures/group_{datetime.now().strftime("%Y%m%d_%H%M%S")}.jpg',
+                ContentFile(image_bytes)
+            )
+            for record in new_records:
+                record.captured_image = captured_image_path
+
+        with transaction.atomic():
+            # A concurrent scan of the same student keeps its record; ours is skipped
+            inserted, _ = insert_records(new_records)
+            count_records(inserted)
+
+        inserted_ids = {record.face_match_student_id for record in inserted}
+        for entry in results:
+            if entry['status'] == 'recorded' and entry['student_id'] not in inserted_ids:
+                entry['status'] = 'already_recorded'
+        recorded = len(inserted)
+        already = sum(1 for entry in results if entry['status'] == 'already_recorded')
+        return Response({
+            'success': True,
+            'message': f'Attendance recorded for {recorded} student(s)',
+            'faces_detected': len(faces),
+            'recorded_count': recorded,
+            'already_recorded_count': already,
+            'unrecognized_count': len(faces) - recorded - already,
+            'faces': results
+        }, status=status.HTTP_201_CREATED if recorded else status.HTTP_200_OK)
+
+    except Exception as e:
+        logger.error(f"Error marking group attendance with face recognition: {e}", exc_info=True)
+        return Response(
+            {'error': f'Error processing attendance: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+def _read_batch_images(request):
+    """
+    Collect the frames of a batch request: an 'images' multipart list or an 'archive' ZIP.
+
+    Returns:
+        List of (name, image bytes)
+
+    Raises:
+        ValueError: No frames, too many frames, an oversized frame or a bad ZIP
+    """
+    max_images = getattr(settings, 'FACE_BATCH_MAX_IMAGES', 50)
+    max_bytes = getattr(settings, 'FACE_BATCH_MAX_IMAGE_BYTES', 10 * 1024 * 1024)
+    frames = []
+    if 'archive' in request.FILES:
+        try:
+            with zipfile.ZipFile(request.FILES['archive']) as archive:
+                members = [m for m in archive.infolist()
+                           if not m.is_dir() and m.filename.lower().endswith(BATCH_IMAGE_EXTENSIONS)]
+                if len(members) > max_images:
+                    raise ValueError(f'Too many images in archive ({len(members)} > {max_images})')
+                for member in sorted(members, key=lambda m: m.filename):
+                    if member.file_size > max_bytes:
+                        raise ValueError(f'{member.filename} is larger than {max_bytes} bytes')
+                    frames.append((member.filename, archive.read(member)))
+        except zipfile.BadZipFile:
+            raise ValueError('Invalid ZIP archive')
+    else:
+        files = request.FILES.getlist('images')
+        if len(files) > max_images:
+            raise ValueError(f'Too many images ({len(files)} > {max_images})')
+        for image_file in files:
+            if image_file.size > max_bytes:
+                raise ValueError(f'{image_file.name} is larger than {max_bytes} bytes')
+            frames.append((image_file.name, image_file.read()))
+    if not frames:
+        raise ValueError("No images provided. Send an 'images' list or an 'archive' ZIP.")
+    return frames
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def mark_attendance_batch(request):
+    """
+    Mark attendance from many frames in one request (e.g. frames a kiosk buffered offline).
+    Accepts an 'images' multipart list or an 'archive' ZIP of images. Each
+    recognized student is recorded once, from their best frame.
+    """
+    try:
+        try:
+            frames = _read_batch_images(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        face_engine = get_face_engine()
+        frame_results = face_engine.recognize_faces_batch([image_bytes for _, image_bytes in frames])
+        if frame_results is None:
+            return Response(
+                {'error': 'Could not process images. Check that the face recognition model is trained.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        matched_ids = {result['student_id'] for result in frame_results if result['matched']}
+        students = Student.objects.select_related('user').in_bulk(matched_ids, field_name='student_id')
+        today = timezone.localdate()
+        already_recorded = set(
+            AttendanceRecord.objects.filter(date=today, student__in=students.values())
+            .values_list('student__student_id', flat=True)
+        )
+
+        # Best frame per student not yet recorded today
+        best_frames = {}
+        for index, result in enumerate(frame_results):
+            student_id = result['student_id']
+            if student_id in students and student_id not in already_recorded:
+                if student_id not in best_frames or result['confidence'] > frame_results[best_frames[student_id]]['confidence']:
+                    best_frames[student_id] = index
+
+        new_records = []
+        for student_id, index in best_frames.items():
+            captured_image_path = default_storage.save(
+                f'attendance_captures/{student_id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.jpg',
+                ContentFile(frames[index][1])
+            )
+            new_records.append(AttendanceRecord(
+                student=students[student_id],
+                date=today,
+                status='present',
+                method='face',
+                recorded_by=request.user,
+                captured_image=captured_image_path,
+                confidence_score=frame_results[index]['confidence'],
+                face_match_student_id=student_id
+            ))
+
+        with transaction.atomic():
+            # A concurrent scan of the same student keeps its record; ours is skipped
+            inserted, _ = insert_records(new_records)
+            count_records(inserted)
+
+        recorded_frames = {best_frames[record.face_match_student_id] for record in inserted}
+        results = []
+        for index, ((name, _), result) in enumerate(zip(frames, frame_results)):
+            student = students.get(result['student_id']) if result['matched'] else None
+            if not result['face_detected']:
+                frame_status = 'no_face' if result['error'] == 'No face detected' else 'error'
+            elif not result['matched']:
+                frame_status = 'unrecognized'
+            elif student is None:
+                frame_status = 'unknown_student'
+            elif index in recorded_frames:
+                frame_status = 'recorded'
+            else:
+                frame_status = 'already_recorded'
+            results.append({
+                'index': index,
+                'name': name,
+                'status': frame_status,
+                'student_id': result['student_id'],
+                'student_name': student.user.get_full_name() if student else None,
+                'confidence': result['confidence'],
+                'distance': result['distance'],
+                'location': result['location'],
+                'error': result['error'],
+            })
+
+        return Response({
+            'success': True,
+            'message': f'Attendance recorded for {len(inserted)} student(s) from {len(frames)} frame(s)',
+            'frame_count': len(frames),
+            'recognized_count': sum(1 for result in frame_results if result['matched']),
+            'recorded_count': len(inserted),
+            'results': results
+        }, status=status.HTTP_201_CREATED if inserted else status.HTTP_200_OK)
+
+    except Exception as e:
+        logger.error(f"Error marking batch attendance with face recognition: {e}", exc_info=True)
+        return Response(
+            {'error': f'Error processing attendance: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def model_status(request):
@@ -514,6 +566,8 @@ def model_status(request):
             'unique_students_in_model': model_info.get('unique_students', 0),
             'model_path': model_info.get('model_path'),
             'model_exists': model_info.get('model_exists', False),
+            'serving_gallery_version': face_engine.model_version_key(),
+            'recognition_cache': face_engine.result_cache.stats(),
             'enrolled_students': enrolled_students,
             'total_face_images': total_face_images,
         }
@@ -524,7 +578,8 @@ def model_status(request):
                 'training_date': latest_model.training_date,
                 'dataset_size': latest_model.dataset_size,
                 'accuracy': latest_model.accuracy,
-                'training_duration_seconds': latest_model.training_duration_seconds
+                'training_duration_seconds': latest_model.training_duration_seconds,
+                'gallery_version': latest_model.gallery_version,
             }
         
         return Response(response_data, status=status.HTTP_200_OK)
@@ -580,20 +635,55 @@ def enrolled_students(request):
 @permission_classes([IsAuthenticated])
 def get_upload_progress(request):
     """
-    Get progress of a dataset upload/processing task.
-    Expecting 'task_id' query param.
+    Get progress of a dataset upload/training job.
+    Expecting 'job_id' or 'task_id' query param.
     """
+    job_id = request.query_params.get('job_id')
     task_id = request.query_params.get('task_id')
-    if not task_id:
-        return Response({'error': 'task_id required'}, status=status.HTTP_400_BAD_REQUEST)
+    if not job_id and not task_id:
+        return Response({'error': 'job_id or task_id required'}, status=status.HTTP_400_BAD_REQUEST)
     
-    progress_data = cache.get(f'dataset_progress_{task_id}')
-    if progress_data:
-        return Response(progress_data)
+    job = jobs.find_job(job_id=job_id, task_id=task_id)
+    if job:
+        return Response(job.to_progress())
     else:
         return Response({'percent': 0, 'status': 'unknown', 'message': 'Initializing...'})
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def cancel_job(request, job_id):
+    """
+    Cancel a queued or running background job.
+    """
+    job = jobs.find_job(job_id=job_id)
+    if job is None:
+        return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+    if not jobs.cancel_job(job):
+        return Response(
+            {'error': f'Job already {job.status}', **job.to_progress()},
+            status=status.HTTP_409_CONFLICT
+        )
+    return Response(job.to_progress())
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def retry_job(request, job_id):
+    """
+    Re-queue a failed or cancelled background job.
+    """
+    job = jobs.find_job(job_id=job_id)
+    if job is None:
+        return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+    if not jobs.retry_job(job):
+        return Response(
+            {'error': f'Only failed or cancelled jobs can be retried (job is {job.status})', **job.to_progress()},
+            status=status.HTTP_409_CONFLICT
+        )
+    return Response(job.to_progress(), status=status.HTTP_202_ACCEPTED)
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def register_student_with_face(request):
@@ -610,6 +700,19 @@ def register_student_with_face(request):
         existing_student_id = request.data.get('student_id')
         existing_student = None
         
+        # Images are content-addressed: the same bytes are never stored or encoded twice
+        image_data = request.FILES['image'].read() if 'image' in request.FILES else None
+        content_hash = StudentFaceImage.hash_content(image_data) if image_data is not None else None
+        known_image = (
+            StudentFaceImage.objects.filter(content_hash=content_hash).select_related('student').first()
+            if content_hash else None
+        )
+        if known_image and known_image.student.student_id != existing_student_id:
+            return Response(
+                {'error': f'This image is already enrolled for student {known_image.student.student_id}'},
+                status=status.HTTP_409_CONFLICT
+            )
+        
         if existing_student_id:
             try:
                 existing_student = Student.objects.get(student_id=existing_student_id)
@@ -656,58 +759,64 @@ def register_student_with_face(request):
             # If it's a new transaction block for existing student (nested atomic is fine)
             
             # Save Face Image uses 'student' variable which is set above
-            if 'image' in request.FILES:
-                image_file = request.FILES['image']
-                
-                # Save to media
-                filename = f"student_{student.student_id}_registration.jpg"
-                file_path = default_storage.save(
-                    f'student_faces/dataset/{filename}',
-                    ContentFile(image_file.read())
-                )
-                
-                # Create StudentFaceImage
-                StudentFaceImage.objects.create(
-                    student=student,
-                    image=file_path,
-                    is_active=True
-                )
+            if image_data is not None:
+                if known_image is not None:
+                    # Same image re-submitted: reuse the stored file and its cached encoding
+                    face_image = known_image
+                    if not face_image.is_active:
+                        face_image.is_active = True
+                        face_image.save(update_fields=['is_active'])
+                    encoding = face_image.get_encoding()
+                else:
+                    # Save to media
+                    filename = f"student_{student.student_id}_{content_hash[:16]}.jpg"
+                    file_path = default_storage.save(
+                        f'student_faces/dataset/{filename}',
+                        ContentFile(image_data)
+                    )
+                    
+                    # Create StudentFaceImage
+                    face_image = StudentFaceImage.objects.create(
+                        student=student,
+                        image=file_path,
+                        is_active=True,
+                        content_hash=content_hash
+                    )
+                    encoding = None
                 
                 # Update student
                 student.is_face_enrolled = True
                 student.face_enrolled_at = timezone.now()
                 student.save()
                 
-                # Train Model (Fast Retrain using Cache)
+                # Incremental model update: encode only this image and append it to the gallery
                 face_engine = get_face_engine()
-                
-                # Build training data
-                all_images = StudentFaceImage.objects.filter(is_active=True).select_related('student')
-                train_data = []
-                for img in all_images:
-                     if hasattr(img.image, 'path') and os.path.exists(img.image.path):
-                         train_data.append({
-                             'image_path': img.image.path,
-                             'student_id': img.student.student_id,
-                             'face_image_id': img.id
-                         })
-                         
-                if len(train_data) > 0:
-                     training_result = face_engine.train_model(train_data)
-                     if training_result['success']:
-                         face_engine.load_model()
-                         
-                         # Save model version
-                         model_version = f"v{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                         FaceRecognitionModel.objects.filter(is_active=True).update(is_active=False)
-                         FaceRecognitionModel.objects.create(
-                             model_version=model_version,
-                             model_path=face_engine.model_path,
-                             dataset_size=training_result['processed'],
-                             training_duration_seconds=0, # approximate
-                             is_active=True,
-                             notes=f"Auto-trained after new student registration: {student.student_id}"
-                         )
+                if encoding is None:
+                    encoding = face_engine.encode_face(face_image.image.path, use_hog_for_training=True)
+                    if encoding is not None:
+                        face_image.set_encoding(encoding)
+                        face_image.save(update_fields=['encoding_data', 'encoding_cached'])
+                # Ask the gallery itself: a known image may never have been trained, or been retrained away
+                if encoding is not None and face_engine.has_encoding(student.student_id, encoding):
+                    logger.info(f"Registration image for {student.student_id} is already enrolled; model not updated")
+                elif encoding is not None:
+                    if face_engine.add_encodings(student.student_id, [encoding]):
+                        # The update was published as a new engine
+                        face_engine = get_face_engine()
+                        # Save model version
+                        model_version = f"v{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                        FaceRecognitionModel.objects.filter(is_active=True).update(is_active=False)
+                        FaceRecognitionModel.objects.create(
+                            model_version=model_version,
+                            model_path=face_engine.model_path,
+                            dataset_size=face_engine.get_model_info().get('encoding_count', 0),
+                            training_duration_seconds=0, # incremental update
+                            is_active=True,
+                            gallery_version=face_engine.model_version_key(),
+                            notes=f"Incremental update after new student registration: {student.student_id}"
+                        )
+                else:
+                    logger.warning(f"Could not encode registration image for {student.student_id}; model not updated")
 
         return Response({
             'success': True,
@@ -0,0 +1,369 @@
+"""
+Database-backed background job queue for EDURFID.
+
+Views enqueue a BackgroundJob row and return immediately; the job is run by a
+separate worker process (`python manage.py run_jobs`, JOB_RUNNER=worker) or,
+when no worker is deployed, by a poller thread in every web process
+(JOB_RUNNER=thread, the default). Either way the handler registered for the
+job_type runs it. Progress, results, cancellation and retries all
+live on the row, so any web worker can answer a progress poll, and a job
+left behind by a restarted process is picked up by the next poll.
+"""
+import os
+import socket
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import BackgroundJob
+
+logger = logging.getLogger('attendance')
+
+# Minimum seconds between progress writes / cancellation checks for one job
+PROGRESS_WRITE_INTERVAL = 1.0
+
+# Seconds between heartbeats while a handler runs (keeps long silent stages from looking stale)
+HEARTBEAT_INTERVAL = 30
+
+_handlers = {}
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler when the job has been cancelled."""
+
+
+class JobFailed(Exception):
+    """Raised by a handler for a failure that retrying cannot fix (the job fails without further attempts)."""
+
+
+def register_job(job_type):
+    """Decorator registering `func(context, payload) -> dict` as the handler for a job type."""
+    def decorator(func):
+        _handlers[job_type] = func
+        return func
+    return decorator
+
+
+def get_handler(job_type):
+    """Look up the handler for a job type (handlers register on import)."""
+    from . import face_tasks, summaries  # noqa: F401
+    return _handlers.get(job_type)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobContext:
+    """Handed to job handlers for progress reporting and cancellation checks."""
+
+    def __init__(self, job):
+        self.job = job
+        self._last_write = 0.0
+
+    def progress(self, percent, message='', force=False):
+        """
+        Persist progress (throttled) and raise JobCancelled if a cancel was requested.
+
+        Args:
+            percent: 0-100
+            message: Status message for the UI
+            force: Write even if the last write was less than PROGRESS_WRITE_INTERVAL ago
+        """
+        now = timezone.now()
+        if not force and now.timestamp() - self._last_write < PROGRESS_WRITE_INTERVAL:
+            return
+        self._last_write = now.timestamp()
+        self.job.percent = max(0, min(100, int(percent)))
+        self.job.message = str(message)[:255]
+        BackgroundJob.objects.filter(pk=self.job.pk).update(
+            percent=self.job.percent, message=self.job.message, heartbeat_at=now
+        )
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        """Raise JobCancelled if the job has been cancelled."""
+        if BackgroundJob.objects.filter(pk=self.job.pk, cancel_requested=True).exists():
+            raise JobCancelled()
+
+
+def enqueue(job_type, payload=None, user=None, task_id='', max_attempts=None):
+    """
+    Create a queued job.
+
+    Args:
+        job_type: One of BackgroundJob.JOB_TYPE_CHOICES
+        payload: JSON-serialisable handler arguments
+        user: User who requested the job
+        task_id: Optional client-supplied id for progress polling
+        max_attempts: Automatic attempts before giving up (default JOB_MAX_ATTEMPTS)
+
+    Returns:
+        The BackgroundJob
+    """
+    job = BackgroundJob.objects.create(
+        job_type=job_type,
+        payload=payload or {},
+        task_id=task_id or '',
+        created_by=user if user is not None and user.is_authenticated else None,
+        max_attempts=max_attempts or getattr(settings, 'JOB_MAX_ATTEMPTS', 3),
+        message='Queued',
+    )
+    logger.info(f"Queued {job}")
+    if getattr(settings, 'JOB_RUNNER', 'thread') == 'thread':
+        # No separate worker process (e.g. local development): poll now instead of at the next interval
+        transaction.on_commit(wake_job_poller)
+    return job
+
+
+_poller = None
+_poller_pid = None
+_poller_lock = threading.Lock()
+_poller_wakeup = threading.Event()
+
+
+def start_job_poller(**kwargs):
+    """
+    Start this process's queue poller (JOB_RUNNER=thread; a no-op otherwise).
+    Connected to request_started in wsgi.py, so every process serving requests
+    (each forked web worker, but not a preloading master) runs one.
+    """
+    global _poller, _poller_pid
+    if getattr(settings, 'JOB_RUNNER', 'thread') != 'thread' or _poller_pid == os.getpid():
+        return
+    with _poller_lock:
+        if _poller_pid == os.getpid():
+            return
+        _poller_pid = os.getpid()
+        _poller = threading.Thread(target=_poll_jobs, name='job-poller', daemon=True)
+        _poller.start()
+
+
+def wake_job_poller():
+    """Make the poller check the queue now (starting it if needed)."""
+    start_job_poller()
+    _poller_wakeup.set()
+
+
+def poll_jobs_once():
+    """
+    One pass of queue upkeep: recover stale jobs, queue summary reconciliation
+    when it is due, then claim and run the oldest due job.
+
+    Returns:
+        The job that was run, or None if none was due
+    """
+    from .summaries import enqueue_due_reconciliation  # summaries registers its job handler here
+    requeue_stale_jobs()
+    enqueue_due_reconciliation()
+    job = claim_next_job()
+    if job is not None:
+        run_job(job)
+    return job
+
+
+def _poll_jobs():
+    """Poller thread: run due jobs one at a time, sleeping JOB_POLL_INTERVAL when the queue is idle."""
+    while True:
+        try:
+            close_old_connections()
+            job = poll_jobs_once()
+        except Exception as e:
+            logger.error(f"Job poller error: {e}", exc_info=True)
+            job = None
+        if job is None:
+            _poller_wakeup.wait(getattr(settings, 'JOB_POLL_INTERVAL', 2.0))
+            _poller_wakeup.clear()
+
+
+def find_job(job_id=None, task_id=None):
+    """Look up a job by primary key or (most recent) client task id."""
+    if job_id:
+        return BackgroundJob.objects.filter(pk=job_id).first()
+    if task_id:
+        return BackgroundJob.objects.filter(task_id=task_id).order_by('-created_at').first()
+    return None
+
+
+def claim_job(job_id):
+    """
+    Atomically move one queued job to running.
+    The conditional UPDATE means only one worker can win, on any database backend.
+
+    Returns:
+        The claimed job, or None if another worker got it first
+    """
+    now = timezone.now()
+    claimed = BackgroundJob.objects.filter(pk=job_id, status='queued', cancel_requested=False).filter(
+        Q(run_after__isnull=True) | Q(run_after__lte=now)
+    ).update(
+        status='running', started_at=now, heartbeat_at=now, worker=worker_name(), error='',
+        attempts=F('attempts') + 1, run_after=None
+    )
+    if not claimed:
+        return None
+    return BackgroundJob.objects.get(pk=job_id)
+
+
+def claim_next_job():
+    """Claim the oldest queued job that is due, or return None if none is."""
+    due = BackgroundJob.objects.filter(status='queued', cancel_requested=False).filter(
+        Q(run_after__isnull=True) | Q(run_after__lte=timezone.now())
+    )
+    for job_id in due.order_by('created_at').values_list('pk', flat=True)[:10]:
+        job = claim_job(job_id)
+        if job:
+            return job
+    return None
+
+
+def _finish(job, status, **fields):
+    now = timezone.now()
+    fields.update(status=status, finished_at=now, heartbeat_at=now)
+    BackgroundJob.objects.filter(pk=job.pk).update(**fields)
+    for name, value in fields.items():
+        setattr(job, name, value)
+
+
+def will_retry(job, error):
+    """Whether run_job re-queues a job whose handler raised `error`."""
+    return not isinstance(error, (JobFailed, JobCancelled)) and job.attempts < job.max_attempts
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next attempt: JOB_RETRY_BACKOFF doubled for each failed attempt."""
+    return getattr(settings, 'JOB_RETRY_BACKOFF', 30) * 2 ** max(0, attempts - 1)
+
+
+def _schedule_retry(job, error):
+    """
+    Put a failed attempt back in the queue; it is claimable again once run_after passes.
+
+    Returns:
+        True if the job was re-queued, False if it was cancelled meanwhile
+    """
+    delay = retry_delay(job.attempts)
+    fields = dict(
+        status='queued', run_after=timezone.now() + timedelta(seconds=delay), error=error, worker='',
+        message=f"Attempt {job.attempts}/{job.max_attempts} failed, retrying in {delay:g}s"
+    )
+    if not BackgroundJob.objects.filter(pk=job.pk, status='running', cancel_requested=False).update(**fields):
+        return False
+    for name, value in fields.items():
+        setattr(job, name, value)
+    return True
+
+
+def run_job(job):
+    """
+    Run a claimed job to completion, recording the outcome on the row.
+    A handler exception re-queues the job with backoff until max_attempts is
+    reached (JobFailed fails it at once).
+
+    Args:
+        job: A job in 'running' state (from claim_job / claim_next_job)
+    """
+    handler = get_handler(job.job_type)
+    if handler is None:
+        _finish(job, 'failed', error=f"No handler registered for job type '{job.job_type}'")
+        return job
+
+    context = JobContext(job)
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job.pk, stop_heartbeat), daemon=True)
+    heartbeat.start()
+    logger.info(f"Running {job} (attempt {job.attempts}/{job.max_attempts})")
+    try:
+        result = handler(context, job.payload)
+        if BackgroundJob.objects.filter(pk=job.pk, cancel_requested=True).exists():
+            raise JobCancelled()
+    except JobCancelled:
+        logger.info(f"{job} cancelled")
+        _finish(job, 'cancelled', message='Cancelled')
+    except Exception as e:
+        if will_retry(job, e) and _schedule_retry(job, str(e)):
+            logger.warning(f"{job} failed, re-queued: {job.message}: {e}", exc_info=True)
+        elif BackgroundJob.objects.filter(pk=job.pk, cancel_requested=True).exists():
+            _finish(job, 'cancelled', message='Cancelled')
+        else:
+            logger.error(f"{job} failed: {e}", exc_info=True)
+            _finish(job, 'failed', error=str(e), message='Failed')
+    else:
+        _finish(job, 'succeeded', result=result, percent=100, message=(result or {}).get('message', 'Complete'))
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+    return job
+
+
+def _heartbeat(job_id, stop):
+    try:
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            BackgroundJob.objects.filter(pk=job_id, status='running').update(heartbeat_at=timezone.now())
+    finally:
+        connection.close()
+
+
+def cancel_job(job):
+    """
+    Cancel a job: queued jobs stop immediately, running jobs at their next progress update.
+
+    Returns:
+        True if the job was (or will be) cancelled, False if it had already finished
+    """
+    if job.is_finished:
+        return False
+    BackgroundJob.objects.filter(pk=job.pk, status='queued').update(
+        status='cancelled', cancel_requested=True, finished_at=timezone.now(), message='Cancelled'
+    )
+    BackgroundJob.objects.filter(pk=job.pk, status='running').update(cancel_requested=True, message='Cancelling...')
+    job.refresh_from_db()
+    return True
+
+
+def retry_job(job):
+    """
+    Re-queue a failed or cancelled job with its original payload.
+
+    Returns:
+        True if the job was re-queued
+    """
+    updated = BackgroundJob.objects.filter(pk=job.pk, status__in=['failed', 'cancelled']).update(
+        status='queued', cancel_requested=False, percent=0, message='Queued for retry', error='',
+        result=None, started_at=None, finished_at=None, attempts=0, run_after=None
+    )
+    job.refresh_from_db()
+    if updated and getattr(settings, 'JOB_RUNNER', 'thread') == 'thread':
+        transaction.on_commit(wake_job_poller)
+    return bool(updated)
+
+
+def requeue_stale_jobs():
+    """
+    Recover jobs whose worker died: running jobs without a heartbeat for
+    JOB_STALE_SECONDS are re-queued, or failed once max_attempts is reached.
+
+    Returns:
+        Number of jobs recovered
+    """
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'JOB_STALE_SECONDS', 600))
+    stale = BackgroundJob.objects.filter(status='running', heartbeat_at__lt=cutoff)
+    recovered = 0
+    for job in stale:
+        if job.attempts >= job.max_attempts or job.cancel_requested:
+            recovered += BackgroundJob.objects.filter(pk=job.pk, status='running').update(
+                status='failed' if not job.cancel_requested else 'cancelled',
+                finished_at=timezone.now(), error='Worker stopped responding'
+            )
+        else:
+            recovered += BackgroundJob.objects.filter(pk=job.pk, status='running').update(
+                status='queued', message='Re-queued after worker stopped responding'
+            )
+    if recovered:
+        logger.warning(f"Recovered {recovered} stale background jobs")
+    return recovered
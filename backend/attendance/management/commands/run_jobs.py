@@ -0,0 +1,48 @@
+"""
+Background job worker: python manage.py run_jobs
+"""
+import time
+import signal
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from attendance.jobs import poll_jobs_once, worker_name
+
+logger = logging.getLogger('attendance')
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (dataset processing, model training, summary reconciliation)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run until the queue is empty, then exit')
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help='Seconds to sleep when the queue is empty (default JOB_POLL_INTERVAL)')
+
+    def handle(self, *args, **options):
+        poll_interval = options['poll_interval'] or getattr(settings, 'JOB_POLL_INTERVAL', 2.0)
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        self.stdout.write(f"Job worker {worker_name()} started")
+        while not self._stopping:
+            close_old_connections()
+            job = poll_jobs_once()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(poll_interval)
+                continue
+            self.stdout.write(f"{job}: {job.status}")
+        self.stdout.write(f"Job worker {worker_name()} stopped")
+
+    def _stop(self, signum, frame):
+        # First signal: finish the current job, then exit. Second signal: exit now
+        # (the interrupted job is re-queued once it goes stale).
+        if self._stopping:
+            raise SystemExit(1)
+        self._stopping = True
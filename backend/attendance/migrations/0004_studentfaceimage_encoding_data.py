@@ -0,0 +1,93 @@
+# Generated by Django 4.2.7 on 2026-10-17 09:00
+
+import json
+
+import numpy as np
+from django.conf import settings
+from django.db import migrations, models
+
+# Frozen copy of utils.encoding_codec as of this migration, so later codec
+# changes cannot alter what the migration writes or reads. Formats are told
+# apart by blob length: float32 (512 bytes), float16 (256), int8 (4-byte
+# float32 scale + 128 int8 values).
+ENCODING_DIM = 128
+
+
+def pack_encoding(encoding, fmt='float32'):
+    vector = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+    if fmt == 'float16':
+        return vector.astype('<f2').tobytes()
+    if fmt == 'int8':
+        scale = float(np.abs(vector).max()) / 127.0 or 1.0
+        quantized = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return np.float32(scale).astype('<f4').tobytes() + quantized.tobytes()
+    return vector.astype('<f4').tobytes()
+
+
+def unpack_encoding(blob):
+    if not blob:
+        return None
+    blob = bytes(blob)
+    if len(blob) == ENCODING_DIM * 4:
+        return np.frombuffer(blob, dtype='<f4').astype(np.float32)
+    if len(blob) == ENCODING_DIM * 2:
+        return np.frombuffer(blob, dtype='<f2').astype(np.float32)
+    if len(blob) == ENCODING_DIM + 4:
+        scale = np.frombuffer(blob, dtype='<f4', count=1)[0]
+        return np.frombuffer(blob, dtype=np.int8, offset=4).astype(np.float32) * scale
+    return None
+
+BATCH_SIZE = 500
+
+
+def json_to_binary(apps, schema_editor):
+    StudentFaceImage = apps.get_model('attendance', 'StudentFaceImage')
+    storage = getattr(settings, 'FACE_ENCODING_STORAGE', 'float32')
+    batch = []
+    # Load every field bulk_update writes: a deferred field is fetched with one query per row
+    for face_image in StudentFaceImage.objects.exclude(encoding__isnull=True).exclude(encoding='').only('id', 'encoding', 'encoding_cached').iterator():
+        try:
+            face_image.encoding_data = pack_encoding(json.loads(face_image.encoding), storage)
+        except (ValueError, TypeError):
+            face_image.encoding_data = None
+            face_image.encoding_cached = False
+        batch.append(face_image)
+        if len(batch) >= BATCH_SIZE:
+            StudentFaceImage.objects.bulk_update(batch, ['encoding_data', 'encoding_cached'])
+            batch = []
+    if batch:
+        StudentFaceImage.objects.bulk_update(batch, ['encoding_data', 'encoding_cached'])
+
+
+def binary_to_json(apps, schema_editor):
+    StudentFaceImage = apps.get_model('attendance', 'StudentFaceImage')
+    batch = []
+    for face_image in StudentFaceImage.objects.exclude(encoding_data__isnull=True).only('id', 'encoding_data').iterator():
+        encoding = unpack_encoding(face_image.encoding_data)
+        face_image.encoding = json.dumps(encoding.tolist()) if encoding is not None else None
+        batch.append(face_image)
+        if len(batch) >= BATCH_SIZE:
+            StudentFaceImage.objects.bulk_update(batch, ['encoding'])
+            batch = []
+    if batch:
+        StudentFaceImage.objects.bulk_update(batch, ['encoding'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0003_studentfaceimage_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentfaceimage',
+            name='encoding_data',
+            field=models.BinaryField(blank=True, help_text='Packed 128-d face encoding (see utils.encoding_codec)', null=True),
+        ),
+        migrations.RunPython(json_to_binary, binary_to_json),
+        migrations.RemoveField(
+            model_name='studentfaceimage',
+            name='encoding',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0005_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facerecognitionmodel',
+            name='gallery_version',
+            field=models.CharField(blank=True, help_text='Gallery generation:revision published for this version', max_length=80),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0006_facerecognitionmodel_gallery_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentfaceimage',
+            name='face_location',
+            field=models.JSONField(blank=True, help_text='Detected face box [top, right, bottom, left] in the preprocessed image', null=True),
+        ),
+    ]
@@ -0,0 +1,52 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_content_hashes(apps, schema_editor):
+    """
+    Hash the stored file of every face image. The oldest row of each distinct
+    image keeps the hash; later copies are deactivated (and left unhashed) so
+    the unique index of the next migration can be added and the gallery stops
+    counting them twice.
+    """
+    StudentFaceImage = apps.get_model('attendance', 'StudentFaceImage')
+    seen = set()
+    updated = []
+    for face_image in StudentFaceImage.objects.order_by('uploaded_at', 'id').iterator():
+        storage = face_image.image.storage
+        if not face_image.image.name or not storage.exists(face_image.image.name):
+            continue
+        digest = hashlib.sha256()
+        with storage.open(face_image.image.name, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        if content_hash in seen:
+            face_image.is_active = False
+        else:
+            seen.add(content_hash)
+            face_image.content_hash = content_hash
+        updated.append(face_image)
+    StudentFaceImage.objects.bulk_update(updated, ['content_hash', 'is_active'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0007_studentfaceimage_face_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentfaceimage',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text='SHA-256 of the image bytes; one row per distinct image', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='studentfaceimage',
+            name='perceptual_hash',
+            field=models.CharField(blank=True, help_text='dHash of the face crop (hex), for near-duplicate detection', max_length=16),
+        ),
+        migrations.RunPython(backfill_content_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0008_studentfaceimage_content_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='studentfaceimage',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text='SHA-256 of the image bytes; one row per distinct image', max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0009_studentfaceimage_content_hash_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='job_type',
+            field=models.CharField(choices=[('dataset_upload', 'Dataset Upload'), ('train_model', 'Train Model'), ('reconcile_summaries', 'Reconcile Attendance Summaries')], max_length=30),
+        ),
+    ]
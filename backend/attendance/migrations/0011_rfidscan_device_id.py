@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:36
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0010_alter_backgroundjob_job_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rfidscan',
+            name='device_id',
+            field=models.CharField(blank=True, help_text='Reader that sent the scan (batched scans)', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='attendancerecord',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='rfidscan',
+            name='scan_timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='When the card was read (set by the reader for batched scans)'),
+        ),
+        migrations.AddConstraint(
+            model_name='rfidscan',
+            constraint=models.UniqueConstraint(fields=('card_id', 'device_id', 'scan_timestamp'), name='unique_rfid_scan_per_device'),
+        ),
+    ]
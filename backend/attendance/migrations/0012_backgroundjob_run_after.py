@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0011_rfidscan_device_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backgroundjob',
+            name='run_after',
+            field=models.DateTimeField(blank=True, help_text='Earliest time a retried job may be claimed again', null=True),
+        ),
+    ]
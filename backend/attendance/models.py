@@ -1,10 +1,14 @@
 """
 Attendance models for EDURFID system.
 """
+import hashlib
+
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 from users.models import Student
+from utils.encoding_codec import pack_encoding, unpack_encoding
 
 
 class AttendanceRecord(models.Model):
@@ -24,7 +28,8 @@ class AttendanceRecord(models.Model):
     
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='attendance_records')
     date = models.DateField(default=timezone.now)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Defaults to now; batch RFID ingestion sets the original scan time
+    timestamp = models.DateTimeField(default=timezone.now)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='present')
     method = models.CharField(max_length=10, choices=METHOD_CHOICES, default='manual', help_text="Method used to record attendance")
     notes = models.TextField(blank=True)
@@ -128,7 +133,8 @@ class RFIDScan(models.Model):
     """Model for tracking RFID scans."""
     card_id = models.CharField(max_length=50)
     student = models.ForeignKey(Student, on_delete=models.CASCADE, null=True, blank=True)
-    scan_timestamp = models.DateTimeField(auto_now_add=True)
+    scan_timestamp = models.DateTimeField(default=timezone.now, help_text="When the card was read (set by the reader for batched scans)")
+    device_id = models.CharField(max_length=64, blank=True, help_text="Reader that sent the scan (batched scans)")
     is_processed = models.BooleanField(default=False)
     processed_at = models.DateTimeField(null=True, blank=True)
     error_message = models.TextField(blank=True)
@@ -136,6 +142,10 @@ class RFIDScan(models.Model):
     class Meta:
         db_table = 'rfid_scans'
         ordering = ['-scan_timestamp']
+        constraints = [
+            # A reader re-sending a batch after a timeout does not log its scans twice
+            models.UniqueConstraint(fields=['card_id', 'device_id', 'scan_timestamp'], name='unique_rfid_scan_per_device'),
+        ]
 
     def __str__(self):
         return f"RFID Scan - {self.card_id} at {self.scan_timestamp}"
@@ -156,6 +166,7 @@ class FaceRecognitionModel(models.Model):
     accuracy = models.FloatField(null=True, blank=True, help_text="Model accuracy (0-1)")
     is_active = models.BooleanField(default=True, help_text="Whether this model version is currently active")
     training_duration_seconds = models.FloatField(null=True, blank=True, help_text="Time taken to train the model")
+    gallery_version = models.CharField(max_length=80, blank=True, help_text="Gallery generation:revision published for this version")
     notes = models.TextField(blank=True)
 
     class Meta:
@@ -172,8 +183,11 @@ class StudentFaceImage(models.Model):
     image = models.ImageField(upload_to='student_faces/dataset/', help_text="Face image for training")
     uploaded_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True, help_text="Whether this image is used for training")
-    encoding = models.TextField(blank=True, null=True, help_text="JSON representation of 128-d face encoding vector")
+    encoding_data = models.BinaryField(blank=True, null=True, help_text="Packed 128-d face encoding (see utils.encoding_codec)")
     encoding_cached = models.BooleanField(default=False, help_text="Whether face encoding is cached")
+    face_location = models.JSONField(null=True, blank=True, help_text="Detected face box [top, right, bottom, left] in the preprocessed image")
+    content_hash = models.CharField(max_length=64, unique=True, null=True, blank=True, help_text="SHA-256 of the image bytes; one row per distinct image")
+    perceptual_hash = models.CharField(max_length=16, blank=True, help_text="dHash of the face crop (hex), for near-duplicate detection")
 
     class Meta:
         db_table = 'student_face_images'
@@ -181,3 +195,85 @@ class StudentFaceImage(models.Model):
 
     def __str__(self):
         return f"Face Image for {self.student.user.get_full_name()} - {self.uploaded_at.strftime('%Y-%m-%d')}"
+
+    def get_encoding(self):
+        """Decode the cached encoding (float32 array) or return None."""
+        return unpack_encoding(self.encoding_data)
+
+    def set_encoding(self, encoding):
+        """Pack and cache a face encoding (does not save)."""
+        self.encoding_data = pack_encoding(encoding, getattr(settings, 'FACE_ENCODING_STORAGE', 'float32'))
+        self.encoding_cached = True
+
+    @staticmethod
+    def hash_content(data: bytes) -> str:
+        """SHA-256 hex digest used as content_hash."""
+        return hashlib.sha256(data).hexdigest()
+
+
+class BackgroundJob(models.Model):
+    """Persisted queue entry for long-running work (dataset processing, model training)."""
+    JOB_TYPE_CHOICES = [
+        ('dataset_upload', 'Dataset Upload'),
+        ('train_model', 'Train Model'),
+        ('reconcile_summaries', 'Reconcile Attendance Summaries'),
+    ]
+
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+    FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+    job_type = models.CharField(max_length=30, choices=JOB_TYPE_CHOICES)
+    task_id = models.CharField(max_length=64, blank=True, db_index=True, help_text="Client-supplied id used for progress polling")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued', db_index=True)
+    payload = models.JSONField(default=dict, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    percent = models.PositiveSmallIntegerField(default=0)
+    message = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    cancel_requested = models.BooleanField(default=False)
+    worker = models.CharField(max_length=100, blank=True, help_text="host:pid of the worker running the job")
+    created_by = models.ForeignKey('users.User', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    run_after = models.DateTimeField(null=True, blank=True, help_text="Earliest time a retried job may be claimed again")
+
+    class Meta:
+        db_table = 'background_jobs'
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.get_job_type_display()} #{self.pk} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in self.FINISHED_STATUSES
+
+    def to_progress(self):
+        """Progress payload returned by the polling endpoints."""
+        return {
+            'job_id': self.pk,
+            'task_id': self.task_id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'percent': self.percent,
+            'message': self.message,
+            'error': self.error,
+            'attempts': self.attempts,
+            'cancel_requested': self.cancel_requested,
+            'result': self.result,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'run_after': self.run_after,
+        }
@@ -0,0 +1,180 @@
+"""
+Short-lived face recognition sessions for camera kiosks.
+
+A camera loop re-submits frames of the same person every second or so. A
+session, keyed by device, follows the face across consecutive frames (by box
+overlap) and collects one vote per recognized frame. Once a student has
+FACE_SESSION_MIN_VOTES votes on a track, the track is resolved and later
+frames of that track skip encoding, matching and the database lookup.
+A result answered from the recognition cache repeats a frame that already
+voted, so it adds no vote of its own.
+
+A resolved track is bound to the face it was resolved on: every frame's
+face crop is hashed (dHash, see utils.recognition_cache) and the track is
+only continued while the hash stays within FACE_SESSION_MAX_HASH_DISTANCE
+bits of the resolving crop, and for at most FACE_SESSION_RESOLVED_TTL
+seconds. A frame without a face, or whose box does not overlap the track,
+ends the track. A new track is recognized (and voted on) from scratch.
+
+Sessions live in the Django cache and expire FACE_SESSION_TTL seconds after
+the device's last frame. With a per-process cache (the default LocMemCache)
+each web worker keeps its own sessions, which only costs extra recognitions.
+"""
+import re
+import time
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger('attendance')
+
+CACHE_KEY_PREFIX = 'face_session:'
+
+
+def box_iou(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]) -> float:
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    intersection = max(0, bottom - top) * max(0, right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+class RecognitionSession:
+    """Face tracks and recognition votes for one camera device."""
+
+    def __init__(self, device_id: str, tracks: list = None, next_track_id: int = 1):
+        self.device_id = device_id
+        self.tracks = tracks or []
+        self.next_track_id = next_track_id
+
+    @staticmethod
+    def _cache_key(device_id: str) -> str:
+        return CACHE_KEY_PREFIX + device_id
+
+    @classmethod
+    def for_device(cls, device_id: str) -> Optional['RecognitionSession']:
+        """
+        Load (or start) the session of a device.
+
+        Args:
+            device_id: Client-chosen device identifier
+
+        Returns:
+            The session, or None if device_id is empty
+        """
+        device_id = re.sub(r'[^A-Za-z0-9_.-]', '', str(device_id or ''))[:64]
+        if not device_id:
+            return None
+        state = cache.get(cls._cache_key(device_id)) or {}
+        return cls(device_id, state.get('tracks'), state.get('next_track_id', 1))
+
+    def save(self):
+        """Persist the session, extending its lifetime."""
+        cache.set(
+            self._cache_key(self.device_id),
+            {'tracks': self.tracks, 'next_track_id': self.next_track_id},
+            getattr(settings, 'FACE_SESSION_TTL', 60)
+        )
+
+    def track_for(self, location: Tuple[int, int, int, int], signature: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Find the track a face box continues, or start a new one.
+        One face is followed per device: a track the frame does not continue
+        (box overlap below FACE_SESSION_IOU, or idle for FACE_SESSION_TRACK_TTL
+        seconds) is dropped, and so is a resolved track whose resolution no
+        longer holds for this face (see _still_resolved).
+
+        Args:
+            location: (top, right, bottom, left) face box of the current frame
+            signature: face_hash() of the frame's face crop (None if unavailable)
+
+        Returns:
+            The track dict (box and last_seen already updated)
+        """
+        now = time.time()
+        track_ttl = getattr(settings, 'FACE_SESSION_TRACK_TTL', 10)
+
+        best, best_iou = None, getattr(settings, 'FACE_SESSION_IOU', 0.3)
+        for track in self.tracks:
+            if now - track['last_seen'] > track_ttl:
+                continue
+            iou = box_iou(track['box'], location)
+            if iou >= best_iou:
+                best, best_iou = track, iou
+        if best is not None and best['resolved'] and not self._still_resolved(best, signature, now):
+            logger.debug(f"Face session {self.device_id}: track {best['id']} no longer matches its face, restarting")
+            best = None
+        if best is None:
+            best = {'id': self.next_track_id, 'votes': {}, 'best_confidence': {}, 'resolved': None}
+            self.next_track_id += 1
+        self.tracks = [best]
+        best['box'] = list(location)
+        best['last_seen'] = now
+        return best
+
+    @staticmethod
+    def _still_resolved(track: Dict[str, Any], signature: Optional[int], now: float) -> bool:
+        """
+        Whether a resolved track may keep answering: resolved less than
+        FACE_SESSION_RESOLVED_TTL seconds ago (however often it was seen since)
+        and the frame's face crop hashes within FACE_SESSION_MAX_HASH_DISTANCE
+        bits of the crop that resolved it.
+        """
+        if now - track.get('resolved_at', 0) > getattr(settings, 'FACE_SESSION_RESOLVED_TTL', 30):
+            return False
+        if signature is None or track.get('signature') is None:
+            return False
+        return bin(signature ^ track['signature']).count('1') <= getattr(settings, 'FACE_SESSION_MAX_HASH_DISTANCE', 8)
+
+    def face_left(self):
+        """End tracking after a frame without a face."""
+        self.tracks = []
+
+    def vote(self, track: Dict[str, Any], result: Optional[Dict[str, Any]]) -> Optional[str]:
+        """
+        Add one frame's recognition result to a track.
+
+        Args:
+            track: Track from track_for
+            result: Engine match dict (or None if the face could not be encoded);
+                a cached result ('cached': True) is not counted again
+
+        Returns:
+            The winning student_id once it has FACE_SESSION_MIN_VOTES votes and a
+            majority of the track's votes, else None
+        """
+        if not (result and result.get('cached')):
+            if result and result.get('matched'):
+                student_id = result['student_id']
+                track['votes'][student_id] = track['votes'].get(student_id, 0) + 1
+                track['best_confidence'][student_id] = max(track['best_confidence'].get(student_id, 0.0), result['confidence'])
+            else:
+                track['votes'][''] = track['votes'].get('', 0) + 1
+
+        candidates = {sid: count for sid, count in track['votes'].items() if sid}
+        if not candidates:
+            return None
+        winner = max(candidates, key=candidates.get)
+        votes = candidates[winner]
+        if votes >= getattr(settings, 'FACE_SESSION_MIN_VOTES', 2) and votes * 2 > sum(track['votes'].values()):
+            return winner
+        return None
+
+    def resolve(self, track: Dict[str, Any], outcome: Dict[str, Any], signature: Optional[int]):
+        """
+        Record the final outcome of a track; later frames of the same face are answered from this.
+
+        Args:
+            track: Track from track_for
+            outcome: Response returned for later frames
+            signature: face_hash() of the resolving frame's face crop (None never suppresses)
+        """
+        track['resolved'] = outcome
+        track['resolved_at'] = time.time()
+        track['signature'] = signature
+        logger.debug(f"Face session {self.device_id}: track {track['id']} resolved to {outcome.get('student_id')}")
@@ -0,0 +1,173 @@
+"""
+In-process cache for the RFID scan hot path.
+
+Card lookups (card_id -> student pk, name and grade) are kept for
+RFID_CARD_CACHE_TTL seconds, including misses for unknown or inactive cards.
+A per-day map of students already marked lets a repeat tap be answered
+without touching the database. Signals on RFIDCard, Student, User and
+AttendanceRecord (attendance.signals) invalidate the affected entries.
+
+The cache is per process: a change made through another web worker is only
+seen here after the TTL, which bounds how long a deactivated card keeps
+working or a deleted record keeps answering "already recorded".
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+
+from users.models import RFIDCard
+
+# Marker for a cached miss (no active card with this id)
+UNKNOWN_CARD = None
+
+
+class RFIDCardCache:
+    """Thread-safe TTL/LRU cache of active cards plus the students marked today."""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 60.0):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Cards kept before the least recently used is evicted (0 disables the cache)
+            ttl: Seconds a card entry or marked student stays valid
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._cards = OrderedDict()  # card_id -> (stored_at, entry or UNKNOWN_CARD)
+        self._marked_date = None
+        self._marked = {}  # student pk -> (stored_at, status, timestamp)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get_card(self, card_id: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """
+        Look up a card.
+
+        Returns:
+            (found, entry): found is False on a miss; entry is None for a cached
+            unknown card, else a dict with 'student_pk', 'user_pk', 'card_pk',
+            'student_id', 'name' and 'grade'
+        """
+        if not self.enabled:
+            return False, None
+        with self._lock:
+            cached = self._cards.get(card_id)
+            if cached is None:
+                return False, None
+            if time.monotonic() - cached[0] > self.ttl:
+                del self._cards[card_id]
+                return False, None
+            self._cards.move_to_end(card_id)
+            return True, cached[1]
+
+    def put_card(self, card_id: str, entry: Optional[Dict[str, Any]]):
+        """Store a card entry (or UNKNOWN_CARD), evicting the least recently used if full."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._cards[card_id] = (time.monotonic(), entry)
+            self._cards.move_to_end(card_id)
+            while len(self._cards) > self.max_entries:
+                self._cards.popitem(last=False)
+
+    def invalidate(self, card_id: str = None, student_pk: int = None, user_pk: int = None):
+        """Drop a card and every card of a student or user."""
+        with self._lock:
+            if card_id is not None:
+                self._cards.pop(card_id, None)
+            if student_pk is not None or user_pk is not None:
+                stale = [
+                    key for key, (_, entry) in self._cards.items()
+                    if entry is not None and (entry['student_pk'] == student_pk or entry['user_pk'] == user_pk)
+                ]
+                for key in stale:
+                    del self._cards[key]
+
+    def get_marked(self, date, student_pk: int) -> Optional[Tuple[str, Any]]:
+        """(status, timestamp) of the student's record for date if known to be marked, else None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if date != self._marked_date:
+                return None
+            marked = self._marked.get(student_pk)
+            if marked is None:
+                return None
+            if time.monotonic() - marked[0] > self.ttl:
+                del self._marked[student_pk]
+                return None
+            return marked[1], marked[2]
+
+    def mark(self, date, student_pk: int, status: str, timestamp):
+        """Remember that a student has a record for date (a new date starts a new set)."""
+        if not self.enabled or date is None:
+            return
+        with self._lock:
+            if date != self._marked_date:
+                if self._marked_date is not None and date < self._marked_date:
+                    return  # a past day's record; only the current day is kept
+                self._marked_date = date
+                self._marked = {}
+            self._marked[student_pk] = (time.monotonic(), status, timestamp)
+
+    def unmark(self, date, student_pk: int):
+        with self._lock:
+            if date == self._marked_date:
+                self._marked.pop(student_pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._cards.clear()
+            self._marked = {}
+            self._marked_date = None
+
+
+_card_cache = None
+_card_cache_lock = threading.Lock()
+
+
+def get_card_cache() -> RFIDCardCache:
+    """Process-wide card cache configured from RFID_CARD_CACHE_SIZE / RFID_CARD_CACHE_TTL."""
+    global _card_cache
+    if _card_cache is None:
+        with _card_cache_lock:
+            if _card_cache is None:
+                _card_cache = RFIDCardCache(
+                    max_entries=getattr(settings, 'RFID_CARD_CACHE_SIZE', 10000),
+                    ttl=getattr(settings, 'RFID_CARD_CACHE_TTL', 60),
+                )
+    return _card_cache
+
+
+def lookup_card(card_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Resolve an active card from the cache, or with one query on a miss.
+
+    Returns:
+        The card entry (see RFIDCardCache.get_card), or None if no active card has this id
+    """
+    cache = get_card_cache()
+    found, entry = cache.get_card(card_id)
+    if found:
+        return entry
+    card = RFIDCard.objects.select_related('student__user').filter(card_id=card_id, status='active').first()
+    if card is None:
+        entry = UNKNOWN_CARD
+    else:
+        entry = {
+            'card_pk': card.pk,
+            'student_pk': card.student_id,
+            'user_pk': card.student.user_id,
+            'student_id': card.student.student_id,
+            'name': card.student.user.get_full_name(),
+            'grade': card.student.grade,
+        }
+    cache.put_card(card_id, entry)
+    return entry
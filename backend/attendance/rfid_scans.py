@@ -0,0 +1,225 @@
+"""
+Batch ingestion of RFID scans.
+
+Readers that lost their connection flush a backlog of scans in one request
+instead of one POST per tap. A batch costs a fixed number of queries however
+many scans it holds: one IN query resolves every card, one query finds the
+records that already exist, and the RFIDScan and AttendanceRecord rows are
+written with bulk_create(ignore_conflicts=True), so the (student, date)
+unique constraint absorbs duplicates instead of a per-scan existence check.
+The inserted days are read back once (attendance.bulk_records), so a record
+another request stored first is reported (and cached) as it is stored, not
+as ours.
+
+The original scan time, not the time the batch arrives, sets each record's
+date (the local school day), timestamp and lateness (ATTENDANCE_LATE_AFTER).
+"""
+import logging
+from datetime import time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DateTimeField, F, Q, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from users.models import RFIDCard
+from .bulk_records import BULK_BATCH_SIZE, insert_records, stored_records
+from .models import AttendanceRecord, RFIDScan
+from .rfid_cache import get_card_cache
+from .summaries import count_records
+
+logger = logging.getLogger('attendance')
+
+# Reader clocks drifting slightly ahead of the server are tolerated
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+
+def late_after():
+    """The ATTENDANCE_LATE_AFTER cutoff as a time, or None if lateness is not tracked."""
+    value = getattr(settings, 'ATTENDANCE_LATE_AFTER', '')
+    if not value:
+        return None
+    try:
+        return time.fromisoformat(value)
+    except ValueError:
+        logger.error(f"Invalid ATTENDANCE_LATE_AFTER {value!r}; expected HH:MM")
+        return None
+
+
+def scan_status(scanned_at, cutoff=None):
+    """
+    Attendance status for a scan: 'late' after the cutoff (school local time), else 'present'.
+
+    Args:
+        scanned_at: Aware datetime the card was read
+        cutoff: Late cutoff; read from ATTENDANCE_LATE_AFTER when not given
+    """
+    cutoff = cutoff if cutoff is not None else late_after()
+    if cutoff is not None and timezone.localtime(scanned_at).time() > cutoff:
+        return 'late'
+    return 'present'
+
+
+def _parse_scan(item, received_at):
+    """Validate one batch item; returns (card_id, scanned_at, device_id) or raises ValueError."""
+    if not isinstance(item, dict):
+        raise ValueError('Scan must be an object with card_id and scanned_at')
+    card_id = str(item.get('card_id') or '').strip()
+    if not card_id:
+        raise ValueError('card_id is required')
+    if len(card_id) > RFIDScan._meta.get_field('card_id').max_length:
+        raise ValueError('card_id is too long')
+
+    raw = item.get('scanned_at')
+    if not raw:
+        raise ValueError('scanned_at is required')
+    scanned_at = parse_datetime(str(raw))
+    if scanned_at is None:
+        raise ValueError(f'Invalid scanned_at: {raw}')
+    if timezone.is_naive(scanned_at):
+        # Readers without an offset log school local time
+        scanned_at = timezone.make_aware(scanned_at)
+    if scanned_at > received_at + MAX_CLOCK_SKEW:
+        raise ValueError('scanned_at is in the future')
+
+    device_id = str(item.get('device_id') or '')[:RFIDScan._meta.get_field('device_id').max_length]
+    return card_id, scanned_at, device_id
+
+
+def touch_cards(last_used):
+    """Move each card's last_used forward to its latest scan (one UPDATE per chunk)."""
+    cards = list(last_used.items())
+    for start in range(0, len(cards), BULK_BATCH_SIZE):
+        chunk = cards[start:start + BULK_BATCH_SIZE]
+        RFIDCard.objects.filter(pk__in=[pk for pk, _ in chunk]).update(last_used=Case(
+            *[
+                When(Q(pk=pk) & (Q(last_used__isnull=True) | Q(last_used__lt=scanned_at)), then=Value(scanned_at))
+                for pk, scanned_at in chunk
+            ],
+            default=F('last_used'),
+            output_field=DateTimeField()
+        ))
+
+
+def ingest_scans(items, recorded_by=None):
+    """
+    Record attendance for a batch of scans.
+
+    Each student gets at most one record per day, taken from their earliest scan
+    of the day in the batch; a day that already has a record keeps it.
+
+    Args:
+        items: List of {'card_id', 'scanned_at' (ISO 8601), 'device_id'} dicts
+        recorded_by: User recorded on the created attendance records
+
+    Returns:
+        Dict with 'received', a count per outcome and 'results': one entry per item
+        (in input order) with 'index', 'card_id' and 'status', one of 'recorded',
+        'already_recorded' (the day already had a record), 'duplicate' (an earlier
+        scan in the batch recorded the day), 'unknown_card' or 'invalid' (see 'error')
+    """
+    received_at = timezone.now()
+    cutoff = late_after()
+    results = [None] * len(items)
+    scans = []
+
+    for index, item in enumerate(items):
+        try:
+            card_id, scanned_at, device_id = _parse_scan(item, received_at)
+        except (TypeError, ValueError, OverflowError) as e:
+            card_id = item.get('card_id') if isinstance(item, dict) else None
+            results[index] = {'index': index, 'card_id': card_id, 'status': 'invalid', 'error': str(e)}
+            continue
+        scans.append({'index': index, 'card_id': card_id, 'scanned_at': scanned_at, 'device_id': device_id})
+
+    # Every card of the batch in one IN query
+    cards = {
+        card_id: {'card_pk': card_pk, 'student_pk': student_pk, 'student_id': student_id}
+        for card_id, card_pk, student_pk, student_id in RFIDCard.objects.filter(
+            card_id__in={scan['card_id'] for scan in scans}, status='active'
+        ).values_list('card_id', 'pk', 'student_id', 'student__student_id')
+    } if scans else {}
+
+    # Earliest scan per student and school day
+    first_scans = {}
+    for scan in sorted(scans, key=lambda scan: scan['scanned_at']):
+        card = cards.get(scan['card_id'])
+        if card is None:
+            continue
+        scan['card'] = card
+        scan['date'] = timezone.localdate(scan['scanned_at'])
+        first_scans.setdefault((card['student_pk'], scan['date']), scan)
+
+    existing = stored_records(first_scans)
+
+    new_records = []
+    for key, scan in first_scans.items():
+        if key not in existing:
+            new_records.append(AttendanceRecord(
+                student_id=key[0],
+                date=key[1],
+                timestamp=scan['scanned_at'],
+                status=scan_status(scan['scanned_at'], cutoff),
+                method='rfid',
+                recorded_by=recorded_by
+            ))
+
+    scan_rows = []
+    last_used = {}
+    for scan in scans:
+        card = scan.get('card')
+        if card is not None and last_used.get(card['card_pk'], scan['scanned_at']) <= scan['scanned_at']:
+            last_used[card['card_pk']] = scan['scanned_at']
+        scan_rows.append(RFIDScan(
+            card_id=scan['card_id'],
+            student_id=card['student_pk'] if card else None,
+            scan_timestamp=scan['scanned_at'],
+            device_id=scan['device_id'],
+            is_processed=True,
+            processed_at=received_at,
+            error_message='' if card else f"No active RFID card found with ID: {scan['card_id']}"
+        ))
+
+    with transaction.atomic():
+        # A record inserted concurrently for the same (student, date) wins; ours is skipped
+        inserted, stored = insert_records(new_records)
+        recorded = {(record.student_id, record.date) for record in inserted}
+        existing.update({key: row for key, row in stored.items() if key not in recorded})
+        # A re-sent batch hits the (card_id, device_id, scan_timestamp) constraint instead of logging twice
+        RFIDScan.objects.bulk_create(scan_rows, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+        # bulk_create sends no signals: count the inserted records into their days' summaries
+        count_records(inserted)
+        touch_cards(last_used)
+
+    for scan in scans:
+        card = scan.get('card')
+        outcome = {'index': scan['index'], 'card_id': scan['card_id']}
+        if card is None:
+            outcome['status'] = 'unknown_card'
+        else:
+            key = (card['student_pk'], scan['date'])
+            row = existing.get(key) or stored.get(key)
+            outcome.update(student_id=card['student_id'], date=scan['date'],
+                           attendance_status=row[0] if row else None)
+            if key in existing:
+                outcome['status'] = 'already_recorded'
+            elif key in recorded and first_scans[key] is scan:
+                outcome['status'] = 'recorded'
+            else:
+                # Not stored by us and not readable (e.g. deleted meanwhile): nothing was recorded
+                outcome['status'] = 'duplicate'
+        results[scan['index']] = outcome
+
+    def remember_marked():
+        # Every day read above has a record, ours or not: cache it as stored
+        cache = get_card_cache()
+        for (student_pk, date), (status, timestamp, _) in {**stored, **existing}.items():
+            cache.mark(date, student_pk, status, timestamp)
+    transaction.on_commit(remember_marked)
+
+    summary = {'received': len(items)}
+    for outcome in ('recorded', 'already_recorded', 'duplicate', 'unknown_card', 'invalid'):
+        summary[outcome] = sum(1 for result in results if result['status'] == outcome)
+    summary['results'] = results
+    return summary
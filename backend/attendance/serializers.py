@@ -71,7 +71,7 @@ class RFIDScanSerializer(serializers.ModelSerializer):
         model = RFIDScan
         fields = [
             'id', 'card_id', 'student', 'student_name', 'student_id',
-            'scan_timestamp', 'is_processed', 'processed_at', 'error_message'
+            'scan_timestamp', 'device_id', 'is_processed', 'processed_at', 'error_message'
         ]
         read_only_fields = ['id', 'scan_timestamp', 'processed_at']
 
@@ -0,0 +1,80 @@
+"""
+Model signals keeping AttendanceSummary counters in step with AttendanceRecord
+(inline, or through the write-behind buffer for RFID taps), and the in-process
+RFID card cache in step with cards, students and users.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from users.models import RFIDCard, Student, User
+from .models import AttendanceRecord
+from .rfid_cache import get_card_cache
+from .summaries import as_date, record_changed
+from .write_behind import get_write_behind, summaries_deferred
+
+
+def _summary_key(instance):
+    # Read from __dict__ so deferred fields are never fetched just to remember them
+    return as_date(instance.__dict__.get('date')), instance.__dict__.get('status')
+
+
+@receiver(post_init, sender=AttendanceRecord)
+def remember_summary_key(sender, instance, **kwargs):
+    instance._summary_key = _summary_key(instance)
+
+
+@receiver(post_save, sender=AttendanceRecord)
+def count_saved_record(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_key, new_key = instance._summary_key, _summary_key(instance)
+    instance._summary_key = new_key
+    if not created and old_key == new_key:
+        return
+    if summaries_deferred():
+        # RFID taps: the write-behind buffer applies the deltas once the record is committed
+        changes = [(*new_key, 1)] if created else [(*old_key, -1), (*new_key, 1)]
+
+        def queue_summary_deltas():
+            for date, status, delta in changes:
+                get_write_behind().count_record(date, status, delta)
+        transaction.on_commit(queue_summary_deltas)
+    elif created:
+        record_changed(*new_key, 1)
+    else:
+        # Status (or date) changed: move the record from its old counter to the new one
+        record_changed(*old_key, -1)
+        record_changed(*new_key, 1)
+
+    student_pk, timestamp = instance.student_id, instance.timestamp
+
+    def remember_marked():
+        cache = get_card_cache()
+        if not created and old_key[0] != new_key[0]:
+            cache.unmark(old_key[0], student_pk)
+        cache.mark(new_key[0], student_pk, new_key[1], timestamp)
+    transaction.on_commit(remember_marked)
+
+
+@receiver(post_delete, sender=AttendanceRecord)
+def count_deleted_record(sender, instance, **kwargs):
+    record_changed(*instance._summary_key, -1)
+    get_card_cache().unmark(instance._summary_key[0], instance.student_id)
+
+
+@receiver([post_save, post_delete], sender=RFIDCard)
+def invalidate_card(sender, instance, **kwargs):
+    get_card_cache().invalidate(card_id=instance.card_id, student_pk=instance.student_id)
+
+
+@receiver([post_save, post_delete], sender=Student)
+def invalidate_student_cards(sender, instance, **kwargs):
+    get_card_cache().invalidate(student_pk=instance.pk)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_cards(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return  # logins do not change what a card resolves to
+    get_card_cache().invalidate(user_pk=instance.pk)
@@ -0,0 +1,199 @@
+"""
+Incremental maintenance of daily AttendanceSummary rows.
+
+Creating, re-statusing or deleting an AttendanceRecord applies +1/-1 deltas
+to the day's summary counters in a single UPDATE with F() expressions (see
+attendance.signals), so marking attendance costs one query regardless of
+school size. Bulk inserts (count_records) and the write-behind buffer apply
+their deltas aggregated per day, one UPDATE per day. The first record of a
+day creates the row from full counts.
+
+Paths that bypass these (QuerySet.update) or races on row creation can leave
+counters off; the 'reconcile_summaries' job, queued every
+SUMMARY_RECONCILE_INTERVAL seconds by whichever process polls the job queue
+(see attendance.jobs), recounts recent days and fixes any drift. The
+total_students denominator is taken when the row is created and kept
+afterwards: recounts correct the status counters only, so past days keep the
+enrolment they were taken with.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast, Greatest
+from django.utils import timezone
+
+from users.models import Student
+from .aggregates import attendance_counts, attendance_trend
+from .jobs import enqueue, register_job
+from .models import AttendanceRecord, AttendanceSummary, BackgroundJob
+
+logger = logging.getLogger('attendance')
+
+# AttendanceRecord.status -> AttendanceSummary counter
+STATUS_FIELDS = {
+    'present': 'present_count',
+    'absent': 'absent_count',
+    'late': 'late_count',
+    'excused': 'excused_count',
+}
+
+# Statuses counted as attending in attendance_percentage
+ATTENDING_FIELDS = ('present_count', 'late_count', 'excused_count')
+
+
+def as_date(value):
+    """Normalize a record's date the way the DateField stores it (its default, timezone.now, is a datetime)."""
+    return AttendanceRecord._meta.get_field('date').to_python(value)
+
+
+def apply_deltas(date, deltas):
+    """
+    Add per-status deltas to a day's summary in one UPDATE.
+
+    Args:
+        date: Summary date
+        deltas: {status: +n/-n}; unknown statuses are ignored
+
+    Returns:
+        True if the summary row existed and was updated
+    """
+    counts = {STATUS_FIELDS[s]: d for s, d in deltas.items() if s in STATUS_FIELDS and d}
+    if not counts:
+        return True
+
+    # The percentage is computed from the old counters plus the deltas, and is listed
+    # first so it reads pre-update values on every backend
+    attending = sum((F(field) + counts.get(field, 0) for field in ATTENDING_FIELDS), Value(0))
+    updates = {
+        'attendance_percentage': Case(
+            When(total_students__gt=0, then=Cast(attending, FloatField()) * 100.0 / F('total_students')),
+            default=Value(0.0),
+            output_field=FloatField()
+        )
+    }
+    # Counters are unsigned: a decrement on a drifted counter stops at zero (reconciliation fixes it)
+    updates.update({
+        field: F(field) + delta if delta > 0 else Greatest(F(field) + delta, Value(0))
+        for field, delta in counts.items()
+    })
+    updates['updated_at'] = timezone.now()
+    return AttendanceSummary.objects.filter(date=date).update(**updates) > 0
+
+
+def rebuild_summary(date):
+    """Recount a day's status counters from its attendance records (creates the row if missing)."""
+    aggregate = attendance_counts(date=date)
+    values = {field: aggregate[status] for status, field in STATUS_FIELDS.items()}
+    summary, created = AttendanceSummary.objects.get_or_create(
+        date=date, defaults={'total_students': aggregate['total_students'], **values}
+    )
+    if not created:
+        for field, value in values.items():
+            setattr(summary, field, value)
+        summary.save()
+    return summary
+
+
+def record_changed(date, status, delta):
+    """
+    Count one record in (delta=1) or out of (delta=-1) a day's summary.
+    Falls back to a full rebuild when the day has no summary row yet.
+    """
+    date = as_date(date)
+    if date is None or status not in STATUS_FIELDS:
+        return
+    if not apply_deltas(date, {status: delta}):
+        rebuild_summary(date)
+
+
+def apply_day_deltas(deltas_by_date):
+    """
+    Apply per-status deltas to several days' summaries, one UPDATE per day.
+    A day without a summary row is rebuilt from full counts instead.
+
+    Args:
+        deltas_by_date: {date: {status: +n/-n}}
+    """
+    for date in sorted(deltas_by_date):
+        if not apply_deltas(date, deltas_by_date[date]):
+            rebuild_summary(date)
+
+
+def count_records(records):
+    """
+    Count newly inserted records into their days' summaries (bulk_create sends no signals).
+
+    Args:
+        records: Inserted AttendanceRecord instances
+    """
+    deltas_by_date = {}
+    for record in records:
+        deltas = deltas_by_date.setdefault(as_date(record.date), {})
+        deltas[record.status] = deltas.get(record.status, 0) + 1
+    apply_day_deltas(deltas_by_date)
+
+
+def reconcile_summaries(days=None):
+    """
+    Recount the summaries of the last `days` days (SUMMARY_RECONCILE_DAYS) and fix drift.
+    Existing rows keep their total_students; missing rows are created with the current count.
+
+    Returns:
+        Dict with the number of days checked and rows corrected
+    """
+    days = days or getattr(settings, 'SUMMARY_RECONCILE_DAYS', 7)
+    start = timezone.localdate() - timedelta(days=days - 1)
+    total_students = Student.objects.filter(is_active=True).count()
+
+    actual = {day['date']: day for day in attendance_trend(AttendanceRecord.objects.filter(date__gte=start))}
+    summaries = {summary.date: summary for summary in AttendanceSummary.objects.filter(date__gte=start)}
+
+    corrected = 0
+    for date in sorted(set(actual) | set(summaries)):
+        counts = {field: actual.get(date, {}).get(status, 0) for status, field in STATUS_FIELDS.items()}
+        summary = summaries.get(date)
+        if summary is None:
+            AttendanceSummary.objects.create(date=date, total_students=total_students, **counts)
+            corrected += 1
+            continue
+        if any(getattr(summary, field) != value for field, value in counts.items()):
+            logger.warning(
+                f"Attendance summary drift on {date}: "
+                + ", ".join(f"{field} {getattr(summary, field)} -> {value}" for field, value in counts.items()
+                            if getattr(summary, field) != value)
+            )
+            for field, value in counts.items():
+                setattr(summary, field, value)
+            summary.save()
+            corrected += 1
+
+    return {'days_checked': days, 'corrected': corrected}
+
+
+@register_job('reconcile_summaries')
+def reconcile_summaries_job(context, payload):
+    """Job handler: recount recent attendance summaries."""
+    context.progress(0, "Reconciling attendance summaries...", force=True)
+    return reconcile_summaries(payload.get('days'))
+
+
+def enqueue_due_reconciliation():
+    """
+    Queue a reconciliation job if none is pending and none was queued in the last
+    SUMMARY_RECONCILE_INTERVAL seconds (0 disables). Called on every poll of the job
+    queue (poll_jobs_once), by the run_jobs worker or the in-process poller.
+
+    Returns:
+        The queued BackgroundJob, or None
+    """
+    interval = getattr(settings, 'SUMMARY_RECONCILE_INTERVAL', 3600)
+    if not interval:
+        return None
+    jobs = BackgroundJob.objects.filter(job_type='reconcile_summaries')
+    if jobs.exclude(status__in=BackgroundJob.FINISHED_STATUSES).exists():
+        return None
+    if jobs.filter(created_at__gte=timezone.now() - timedelta(seconds=interval)).exists():
+        return None
+    return enqueue('reconcile_summaries')
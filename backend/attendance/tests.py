@@ -0,0 +1,1077 @@
+import io
+import os
+import pickle
+import tempfile
+import zipfile
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from users.models import RFIDCard, Student, User
+from utils.dataset_handler import DatasetError, DatasetHandler
+from utils.encoding_codec import FORMAT_SIZES, pack_encoding, unpack_encoding, unpack_many
+from utils.face_index import FlatIndex, IVFIndex, load_index, measure_recall, save_index
+from utils.face_model_store import (
+    append_rows, convert_pickle_model, read_gallery, read_header, remove_stale_generations, write_gallery
+)
+from utils.face_recognition_utils import FaceRecognitionEngine
+from utils.image_preprocessing import ImagePreprocessor
+from utils.recognition_cache import RecognitionCache
+from .aggregates import attendance_counts, attendance_counts_by, attendance_trend
+from .jobs import (
+    JobFailed, cancel_job, claim_job, claim_next_job, enqueue, poll_jobs_once, register_job, retry_job, run_job
+)
+from .models import AttendanceRecord, AttendanceSummary, BackgroundJob, RFIDScan
+from . import face_views, rfid_scans
+from .bulk_records import insert_records, is_stored_record
+from .recognition_sessions import RecognitionSession
+from .rfid_cache import get_card_cache, lookup_card
+from .summaries import apply_deltas, count_records, reconcile_summaries
+from .write_behind import WriteBehindBuffer, get_write_behind
+
+
+class AttendanceAggregatesTests(TestCase):
+    """Status counts come back in one query per scope."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.localdate()
+        cls.yesterday = cls.today - timedelta(days=1)
+        cls.students = []
+        for i, (grade, status) in enumerate([('5', 'present'), ('5', 'late'), ('6', 'absent'), ('6', None)]):
+            user = User.objects.create_user(f'student{i}', f'student{i}@example.com', 'pw')
+            student = Student.objects.create(user=user, student_id=f'S{i}', grade=grade)
+            cls.students.append(student)
+            if status:
+                AttendanceRecord.objects.create(student=student, date=cls.today, status=status)
+            AttendanceRecord.objects.create(student=student, date=cls.yesterday, status='present')
+        inactive = Student.objects.create(
+            user=User.objects.create_user('inactive', 'inactive@example.com', 'pw'),
+            student_id='S9', grade='6', is_active=False
+        )
+        AttendanceRecord.objects.create(student=inactive, date=cls.today, status='excused')
+
+    def test_day_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            counts = attendance_counts(date=self.today)
+        self.assertEqual(counts['total_students'], 4)
+        self.assertEqual(
+            [counts[s] for s in ('present', 'absent', 'late', 'excused')], [1, 1, 1, 1]
+        )
+        self.assertEqual(counts['total_records'], 4)
+        self.assertEqual(counts['attended'], 3)
+        self.assertEqual(counts['student_percentage'], 75.0)
+
+    def test_range_counts_do_not_multiply_students(self):
+        with self.assertNumQueries(1):
+            counts = attendance_counts(date__gte=self.yesterday)
+        self.assertEqual(counts['total_students'], 4)
+        self.assertEqual(counts['total_records'], 8)
+        self.assertEqual(counts['present'], 5)
+
+    def test_student_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            counts = attendance_counts(Student.objects.filter(pk=self.students[1].pk))
+        self.assertEqual(counts['total_records'], 2)
+        self.assertEqual(counts['late'], 1)
+        self.assertEqual(counts['record_percentage'], 100.0)
+
+    def test_grade_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = attendance_counts_by('grade', date=self.today)
+        by_grade = {row['grade']: row for row in rows}
+        self.assertEqual(by_grade['5']['attended'], 2)
+        self.assertEqual(by_grade['6']['total_students'], 2)
+        self.assertEqual(by_grade['6']['absent'], 1)
+
+    def test_trend_in_one_query(self):
+        with self.assertNumQueries(1):
+            trend = attendance_trend(AttendanceRecord.objects.filter(student=self.students[2]))
+        self.assertEqual([day['date'] for day in trend], [self.yesterday, self.today])
+        self.assertEqual([day['rate'] for day in trend], [100.0, 0])
+
+
+class AttendanceStatsViewQueryTests(TestCase):
+    """The stats endpoints no longer issue one count per status."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', 'pw', role='admin')
+        cls.student = Student.objects.create(
+            user=User.objects.create_user('student', 'student@example.com', 'pw'),
+            student_id='S1', grade='5'
+        )
+        AttendanceRecord.objects.create(student=cls.student, date=timezone.localdate(), status='present')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_daily_attendance_queries(self):
+        # Counts + records (with student, user and recorder joined)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/attendance/daily/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['present_count'], 1)
+        self.assertEqual(response.data['attendance_percentage'], 100.0)
+
+    def test_attendance_stats_queries(self):
+        # Daily summaries + range counts
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/attendance/stats/', {'period': 'week'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_present'], 1)
+        self.assertEqual(response.data['total_days'], 1)
+
+    def test_student_history_counts(self):
+        response = self.client.get(f'/api/attendance/students/{self.student.pk}/history/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_days'], 1)
+        self.assertEqual(response.data['attendance_percentage'], 100.0)
+
+
+@override_settings(WRITE_BEHIND_INTERVAL=0)
+class RFIDScanCacheTests(TestCase):
+    """Repeat taps are answered from the in-process card cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', 'pw', role='admin')
+        cls.student = Student.objects.create(
+            user=User.objects.create_user('student', 'student@example.com', 'pw', first_name='Ana', last_name='Quispe'),
+            student_id='S1', grade='5'
+        )
+        cls.card = RFIDCard.objects.create(card_id='CARD1', student=cls.student)
+
+    def setUp(self):
+        get_card_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def tap(self, card_id='CARD1'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/attendance/record/', {'card_id': card_id}, format='json')
+
+    def test_repeat_tap_skips_database(self):
+        self.assertEqual(self.tap().status_code, 201)
+        with self.assertNumQueries(0):
+            response = self.client.post('/api/attendance/record/', {'card_id': 'CARD1'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['student'], 'Ana Quispe')
+        self.assertEqual(AttendanceRecord.objects.count(), 1)
+        self.assertEqual(RFIDScan.objects.filter(is_processed=True, student=self.student).count(), 1)
+        self.card.refresh_from_db()
+        self.assertIsNotNone(self.card.last_used)
+
+    def test_existing_record_is_reported(self):
+        AttendanceRecord.objects.create(student=self.student, date=timezone.localdate(), status='late')
+        # Not in the marked set yet: the (student, date) unique constraint reports it
+        response = self.tap()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'late')
+
+    def test_deactivated_card_is_invalidated(self):
+        self.assertEqual(self.tap().status_code, 201)
+        self.card.status = 'lost'
+        self.card.save()
+        self.assertEqual(self.tap().status_code, 404)
+
+
+@override_settings(ATTENDANCE_LATE_AFTER='08:00')
+class RFIDBatchScanTests(TestCase):
+    """A reader's backlog is recorded in a fixed number of queries, dated by scan time."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', 'pw', role='admin')
+        cls.cards = []
+        for i in range(3):
+            student = Student.objects.create(
+                user=User.objects.create_user(f'student{i}', f'student{i}@example.com', 'pw'),
+                student_id=f'S{i}', grade='5'
+            )
+            cls.cards.append(RFIDCard.objects.create(card_id=f'CARD{i}', student=student))
+        cls.yesterday = timezone.localdate() - timedelta(days=1)
+        AttendanceRecord.objects.create(student=cls.cards[2].student, date=cls.yesterday, status='absent')
+
+    def setUp(self):
+        get_card_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def at(self, hour, minute=0):
+        return f'{self.yesterday.isoformat()}T{hour:02d}:{minute:02d}:00'
+
+    def post(self, scans):
+        return self.client.post('/api/attendance/record/batch/', {'scans': scans}, format='json')
+
+    def test_backlog_outcomes(self):
+        scans = [
+            {'card_id': 'CARD0', 'scanned_at': self.at(7, 45), 'device_id': 'pi-1'},
+            {'card_id': 'CARD1', 'scanned_at': self.at(8, 10), 'device_id': 'pi-1'},
+            {'card_id': 'CARD0', 'scanned_at': self.at(12), 'device_id': 'pi-1'},
+            {'card_id': 'CARD2', 'scanned_at': self.at(7, 50), 'device_id': 'pi-1'},
+            {'card_id': 'NOPE', 'scanned_at': self.at(7, 55), 'device_id': 'pi-1'},
+            {'card_id': 'CARD1', 'scanned_at': 'yesterday'},
+        ]
+        response = self.post(scans)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['recorded', 'recorded', 'duplicate', 'already_recorded', 'unknown_card', 'invalid']
+        )
+
+        # The scan time, not the receive time, sets the date and lateness
+        records = {r.student_id: r for r in AttendanceRecord.objects.filter(date=self.yesterday)}
+        self.assertEqual(records[self.cards[0].student_id].status, 'present')
+        self.assertEqual(records[self.cards[1].student_id].status, 'late')
+        self.assertEqual(records[self.cards[2].student_id].status, 'absent')
+        self.assertEqual(timezone.localtime(records[self.cards[1].student_id].timestamp).hour, 8)
+        self.assertEqual(AttendanceSummary.objects.get(date=self.yesterday).late_count, 1)
+        self.assertEqual(RFIDScan.objects.count(), 5)
+        self.cards[0].refresh_from_db()
+        self.assertEqual(timezone.localtime(self.cards[0].last_used).hour, 12)
+
+        # Re-sending the batch records and logs nothing new
+        response = self.post(scans)
+        self.assertEqual(response.data['recorded'], 0)
+        self.assertEqual(response.data['already_recorded'], 4)
+        self.assertEqual(RFIDScan.objects.count(), 5)
+
+    def test_query_count_does_not_grow_with_batch(self):
+        scans = [
+            {'card_id': f'CARD{i % 3}', 'scanned_at': self.at(7, i), 'device_id': 'pi-1'} for i in range(30)
+        ]
+        # Cards, existing records, savepoint, records, read-back, scans, summary delta, cards update
+        with self.assertNumQueries(9):
+            response = self.post(scans)
+        self.assertEqual(response.data['recorded'], 2)
+        self.assertEqual(response.data['already_recorded'], 10)
+        self.assertEqual(response.data['duplicate'], 18)
+
+    def test_record_inserted_concurrently_is_reported_as_stored(self):
+        # The pre-read misses CARD2's record, as if another request inserted it just after
+        scans = [
+            {'card_id': 'CARD0', 'scanned_at': self.at(7, 45), 'device_id': 'pi-1'},
+            {'card_id': 'CARD2', 'scanned_at': self.at(7, 50), 'device_id': 'pi-1'},
+            {'card_id': 'CARD2', 'scanned_at': self.at(7, 55), 'device_id': 'pi-1'},
+        ]
+        with mock.patch.object(rfid_scans, 'stored_records', return_value={}), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.post(scans)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['recorded', 'already_recorded', 'already_recorded'])
+        self.assertEqual(results[1]['attendance_status'], 'absent')
+        self.assertEqual(AttendanceSummary.objects.get(date=self.yesterday).present_count, 1)
+        self.assertEqual(get_card_cache().get_marked(self.yesterday, self.cards[2].student_id)[0], 'absent')
+
+    def test_record_missing_after_insert_is_not_reported_as_recorded(self):
+        # Skipped as a conflict, then deleted before the read-back
+        with mock.patch.object(rfid_scans, 'insert_records', return_value=([], {})):
+            response = self.post([{'card_id': 'CARD0', 'scanned_at': self.at(7, 45), 'device_id': 'pi-1'}])
+        result = response.data['results'][0]
+        self.assertEqual((result['status'], result['attendance_status']), ('duplicate', None))
+        self.assertEqual(response.data['recorded'], 0)
+
+    def test_stored_timestamp_is_compared_to_the_second(self):
+        scanned_at = timezone.now().replace(microsecond=123456)
+        record = AttendanceRecord(date=self.yesterday, timestamp=scanned_at, status='present', method='rfid')
+        # A backend that drops microseconds still returns our row
+        self.assertTrue(is_stored_record(record, ('present', scanned_at.replace(microsecond=0), 'rfid')))
+        self.assertFalse(is_stored_record(record, ('present', scanned_at - timedelta(seconds=1), 'rfid')))
+        self.assertFalse(is_stored_record(record, ('late', scanned_at, 'rfid')))
+        self.assertFalse(is_stored_record(record, None))
+
+
+class FaceGroupAttendanceTests(TestCase):
+    """Group photos report only the records that were actually stored."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', 'pw', role='admin')
+        cls.students = [
+            Student.objects.create(
+                user=User.objects.create_user(f'group{i}', f'group{i}@example.com', 'pw'), student_id=f'G{i}'
+            )
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        engine = mock.Mock()
+        engine.recognize_faces_from_bytes.return_value = [
+            {'student_id': student.student_id, 'matched': True, 'confidence': 0.8, 'distance': 0.3,
+             'location': (0, 10, 10, 0)}
+            for student in self.students
+        ]
+        engine_patch = mock.patch.object(face_views, 'get_face_engine', return_value=engine)
+        engine_patch.start()
+        self.addCleanup(engine_patch.stop)
+
+    def test_record_stored_concurrently_is_not_counted(self):
+        def racing_insert(new_records):
+            # Another request records G1 between the pre-read and our insert
+            AttendanceRecord.objects.create(student=self.students[1], date=timezone.localdate(), status='late')
+            return insert_records(new_records)
+
+        with mock.patch.object(face_views, 'insert_records', racing_insert):
+            response = self.client.post('/api/attendance/face/record/group/', {
+                'image': SimpleUploadedFile('class.jpg', b'jpeg', content_type='image/jpeg')
+            })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['recorded_count'], response.data['already_recorded_count']), (1, 1))
+        self.assertEqual([face['status'] for face in response.data['faces']], ['recorded', 'already_recorded'])
+        self.assertEqual(AttendanceRecord.objects.get(student=self.students[1]).status, 'late')
+
+
+class UnrecognizedCaptureTests(TestCase):
+    """Frames nobody matches are kept for review, throttled per device or user."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('admin', 'admin@example.com', 'pw', role='admin'))
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.captures = os.path.join(media_root.name, 'attendance_captures')
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        engine = mock.Mock()
+        engine.recognize_face_from_bytes.return_value = {'matched': False, 'student_id': None, 'confidence': 0.0}
+        engine_patch = mock.patch.object(face_views, 'get_face_engine', return_value=engine)
+        engine_patch.start()
+        self.addCleanup(engine_patch.stop)
+
+    def post_frame(self):
+        return self.client.post('/api/attendance/face/record/', {
+            'image': SimpleUploadedFile('frame.jpg', b'jpeg', content_type='image/jpeg')
+        })
+
+    def test_one_capture_per_interval(self):
+        for _ in range(3):
+            self.assertEqual(self.post_frame().status_code, 400)
+        self.assertEqual(len(os.listdir(self.captures)), 1)
+
+    @override_settings(FACE_UNRECOGNIZED_CAPTURE_INTERVAL=0)
+    def test_captures_can_be_turned_off(self):
+        self.post_frame()
+        self.assertFalse(os.path.exists(self.captures))
+
+
+@override_settings(WRITE_BEHIND_INTERVAL=3600)
+class WriteBehindTests(TestCase):
+    """Tap bookkeeping is queued and written in coalesced batches."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', 'pw', role='admin')
+        cls.cards = [
+            RFIDCard.objects.create(card_id=f'CARD{i}', student=Student.objects.create(
+                user=User.objects.create_user(f'student{i}', f'student{i}@example.com', 'pw'),
+                student_id=f'S{i}', grade='5'
+            ))
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        get_card_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def tearDown(self):
+        # Nothing queued may outlive the test database
+        get_write_behind().flush()
+
+    def tap(self, card_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/attendance/record/', {'card_id': card_id}, format='json')
+
+    def test_tap_waits_only_for_the_record_insert(self):
+        self.tap('CARD1')
+        get_write_behind().flush()
+        lookup_card('CARD0')
+
+        # Savepoint, record insert, release: scan log, last_used and summary are queued
+        with self.assertNumQueries(3):
+            response = self.tap('CARD0')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(RFIDScan.objects.filter(card_id='CARD0').exists())
+        self.assertEqual(AttendanceSummary.objects.get(date=timezone.localdate()).present_count, 1)
+
+        get_write_behind().flush()
+        self.assertTrue(RFIDScan.objects.filter(card_id='CARD0', is_processed=True).exists())
+        self.assertEqual(AttendanceSummary.objects.get(date=timezone.localdate()).present_count, 2)
+        self.cards[0].refresh_from_db()
+        self.assertIsNotNone(self.cards[0].last_used)
+
+    def test_flush_coalesces_writes(self):
+        buffer = WriteBehindBuffer()
+        now = timezone.now()
+        for minutes in (3, 1, 2):
+            buffer.touch_card(self.cards[0].pk, now - timedelta(minutes=minutes))
+            buffer.log_scan(card_id='CARD0', scan_timestamp=now - timedelta(minutes=minutes), is_processed=True)
+        AttendanceRecord.objects.create(student=self.cards[1].student, date=timezone.localdate(), status='present')
+        buffer.count_record(timezone.localdate(), 'present', 1)
+        buffer.count_record(timezone.localdate(), 'present', -1)
+        buffer.count_record(timezone.localdate(), 'late', 1)
+        buffer.count_record(timezone.localdate(), 'late', 1)
+
+        # One scan insert, one last_used update and one summary UPDATE however many
+        # writes were queued, inside a savepoint
+        with self.assertNumQueries(5):
+            self.assertEqual(buffer.flush(), 3 + 1 + 1)
+        self.assertEqual(RFIDScan.objects.count(), 3)
+        self.cards[0].refresh_from_db()
+        self.assertEqual(self.cards[0].last_used, now - timedelta(minutes=1))
+        summary = AttendanceSummary.objects.get(date=timezone.localdate())
+        self.assertEqual((summary.present_count, summary.late_count), (1, 2))
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_failed_flush_requeues_the_deltas(self):
+        buffer = WriteBehindBuffer()
+        AttendanceRecord.objects.create(student=self.cards[0].student, date=timezone.localdate(), status='present')
+        buffer.count_record(timezone.localdate(), 'present', 1)
+        with mock.patch('attendance.write_behind.apply_day_deltas', side_effect=RuntimeError('database gone')):
+            self.assertEqual(buffer.flush(), 0)
+        buffer.count_record(timezone.localdate(), 'present', 1)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(AttendanceSummary.objects.get(date=timezone.localdate()).present_count, 3)
+
+
+_flaky_calls = []
+
+
+@register_job('test_flaky')
+def _flaky_handler(context, payload):
+    _flaky_calls.append(payload)
+    if len(_flaky_calls) < payload.get('succeed_on', 99):
+        raise RuntimeError('transient failure')
+    return {'message': 'done'}
+
+
+@register_job('test_broken')
+def _broken_handler(context, payload):
+    raise JobFailed('bad input')
+
+
+@override_settings(JOB_RUNNER='worker', JOB_RETRY_BACKOFF=10)
+class JobRetryTests(TestCase):
+    """A failing handler is re-queued with backoff until max_attempts is used up."""
+
+    def setUp(self):
+        _flaky_calls.clear()
+
+    def run_next(self, backoff_elapsed=False):
+        """Claim and run the next due job, optionally as if every retry backoff had elapsed."""
+        if backoff_elapsed:
+            BackgroundJob.objects.filter(run_after__isnull=False).update(run_after=timezone.now())
+        job = claim_next_job()
+        return run_job(job) if job else None
+
+    def test_retried_with_backoff_until_success(self):
+        job = enqueue('test_flaky', {'succeed_on': 2}, max_attempts=3)
+        self.run_next()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), ('queued', 1, 'transient failure'))
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=9))
+        # Not due yet
+        self.assertIsNone(claim_next_job())
+
+        self.run_next(backoff_elapsed=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.result), ('succeeded', 2, {'message': 'done'}))
+        self.assertIsNone(job.run_after)
+
+    def test_fails_after_max_attempts(self):
+        job = enqueue('test_flaky', max_attempts=2)
+        self.run_next()
+        self.run_next(backoff_elapsed=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertEqual(len(_flaky_calls), 2)
+
+    def test_job_failed_is_not_retried(self):
+        job = enqueue('test_broken', max_attempts=3)
+        self.run_next()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), ('failed', 1, 'bad input'))
+
+
+@override_settings(JOB_RUNNER='worker', SUMMARY_RECONCILE_INTERVAL=0)
+class JobQueueTests(TestCase):
+    """Jobs are claimed by one worker only, and can be cancelled and re-queued."""
+
+    def setUp(self):
+        _flaky_calls.clear()
+
+    def test_only_one_claim_wins(self):
+        job = enqueue('test_flaky', {'succeed_on': 1})
+        claimed = claim_job(job.pk)
+        self.assertEqual((claimed.status, claimed.attempts), ('running', 1))
+        self.assertIsNone(claim_job(job.pk))
+        self.assertIsNone(claim_next_job())
+
+    def test_cancel_queued_job(self):
+        job = enqueue('test_flaky', {'succeed_on': 1})
+        self.assertTrue(cancel_job(job))
+        self.assertEqual(job.status, 'cancelled')
+        self.assertIsNone(claim_job(job.pk))
+        self.assertFalse(cancel_job(job))
+
+    def test_cancel_running_job(self):
+        job = claim_job(enqueue('test_flaky', {'succeed_on': 1}).pk)
+        self.assertTrue(cancel_job(job))
+        self.assertEqual((job.status, job.cancel_requested), ('running', True))
+        # The handler completes, but the outcome is recorded as cancelled
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'cancelled')
+
+    def test_retry_failed_job(self):
+        job = enqueue('test_broken')
+        run_job(claim_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+        self.assertTrue(retry_job(job))
+        self.assertEqual((job.status, job.attempts, job.error), ('queued', 0, ''))
+        self.assertEqual(claim_next_job().pk, job.pk)
+        # Only failed or cancelled jobs can be retried
+        self.assertFalse(retry_job(job))
+
+    @override_settings(JOB_STALE_SECONDS=60)
+    def test_poll_recovers_a_stale_job_and_runs_it(self):
+        job = claim_job(enqueue('test_flaky', {'succeed_on': 1}).pk)
+        # Its process was restarted mid-run: the job stopped heartbeating
+        BackgroundJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(poll_jobs_once().pk, job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('succeeded', 2))
+        self.assertIsNone(poll_jobs_once())
+
+    @override_settings(SUMMARY_RECONCILE_INTERVAL=3600)
+    def test_poll_queues_reconciliation_when_due(self):
+        job = poll_jobs_once()
+        self.assertEqual((job.job_type, job.status), ('reconcile_summaries', 'succeeded'))
+        # Not again until the interval has passed
+        self.assertIsNone(poll_jobs_once())
+        BackgroundJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(poll_jobs_once().job_type, 'reconcile_summaries')
+
+    @override_settings(JOB_RETRY_BACKOFF=10)
+    def test_dataset_upload_is_kept_until_the_last_attempt(self):
+        with tempfile.TemporaryDirectory() as upload_dir:
+            zip_path = os.path.join(upload_dir, 'dataset.zip')
+            with open(zip_path, 'wb') as f:
+                f.write(b'not a zip')
+            job = enqueue('dataset_upload', {'zip_path': zip_path}, max_attempts=2)
+
+            poll_jobs_once()
+            job.refresh_from_db()
+            self.assertEqual(job.status, 'queued')
+            self.assertTrue(os.path.exists(zip_path))
+
+            BackgroundJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            poll_jobs_once()
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.error), ('failed', 'Invalid ZIP file format'))
+            self.assertFalse(os.path.exists(zip_path))
+
+
+class RecognitionSessionTests(TestCase):
+    """Resolved tracks only answer frames of the face they were resolved on."""
+
+    BOX = (100, 200, 200, 100)
+    FACE = 0x0F0F0F0F0F0F0F0F
+
+    def setUp(self):
+        self.session = RecognitionSession('kiosk-1')
+
+    def resolved_track(self):
+        track = self.session.track_for(self.BOX, self.FACE)
+        self.session.vote(track, {'matched': True, 'student_id': 'S1', 'confidence': 0.8})
+        self.assertEqual(self.session.vote(track, {'matched': True, 'student_id': 'S1', 'confidence': 0.9}), 'S1')
+        self.session.resolve(track, {'student_id': 'S1'}, self.FACE)
+        return track
+
+    def test_votes_need_a_majority(self):
+        track = self.session.track_for(self.BOX, self.FACE)
+        self.assertIsNone(self.session.vote(track, {'matched': True, 'student_id': 'S1', 'confidence': 0.8}))
+        self.assertIsNone(self.session.vote(track, {'matched': False}))
+        self.assertIsNone(self.session.vote(track, None))
+        # Two votes out of four frames are not a majority yet
+        self.assertIsNone(self.session.vote(track, {'matched': True, 'student_id': 'S1', 'confidence': 0.7}))
+        self.assertEqual(self.session.vote(track, {'matched': True, 'student_id': 'S1', 'confidence': 0.9}), 'S1')
+        self.assertEqual(track['best_confidence']['S1'], 0.9)
+
+    def test_cached_results_add_no_vote(self):
+        track = self.session.track_for(self.BOX, self.FACE)
+        result = {'matched': True, 'student_id': 'S1', 'confidence': 0.8}
+        self.assertIsNone(self.session.vote(track, result))
+        # The same frame answered again from the recognition cache is not a second observation
+        self.assertIsNone(self.session.vote(track, dict(result, cached=True)))
+        self.assertEqual(track['votes'], {'S1': 1})
+        self.assertEqual(self.session.vote(track, result), 'S1')
+
+    def test_same_face_keeps_the_resolution(self):
+        track = self.resolved_track()
+        # A slightly shifted box with a crop differing in a few bits
+        again = self.session.track_for((105, 205, 205, 105), self.FACE ^ 0b111)
+        self.assertIs(again, track)
+        self.assertEqual(again['resolved'], {'student_id': 'S1'})
+
+    def test_different_face_in_the_same_box_starts_a_new_track(self):
+        track = self.resolved_track()
+        other = self.session.track_for(self.BOX, ~self.FACE & (2 ** 64 - 1))
+        self.assertNotEqual(other['id'], track['id'])
+        self.assertIsNone(other['resolved'])
+        self.assertEqual(self.session.tracks, [other])
+
+    def test_box_jump_or_empty_frame_ends_the_track(self):
+        track = self.resolved_track()
+        jumped = self.session.track_for((300, 400, 400, 300), self.FACE)
+        self.assertNotEqual(jumped['id'], track['id'])
+
+        self.session = RecognitionSession('kiosk-2')
+        track = self.resolved_track()
+        self.session.face_left()
+        self.assertIsNone(self.session.track_for(self.BOX, self.FACE)['resolved'])
+
+    @override_settings(FACE_SESSION_RESOLVED_TTL=30)
+    def test_resolution_lifetime_is_capped(self):
+        track = self.resolved_track()
+        # Seen every frame since, but resolved too long ago
+        track['resolved_at'] -= 31
+        again = self.session.track_for(self.BOX, self.FACE)
+        self.assertIsNone(again['resolved'])
+
+    def test_session_round_trips_through_the_cache(self):
+        track = self.resolved_track()
+        self.session.save()
+        loaded = RecognitionSession.for_device('kiosk-1')
+        self.assertEqual(loaded.track_for(self.BOX, self.FACE)['id'], track['id'])
+
+
+class RecognitionCacheTests(TestCase):
+    """Cached match results are only returned for the same face crop on the same device."""
+
+    FACE_A = 0x0123456789ABCDEF
+    FACE_B = FACE_A ^ 0b1011  # a different face whose crop hashes 3 bits away
+
+    def result(self, student_id):
+        return {'student_id': student_id, 'distance': 0.3, 'confidence': 0.4, 'matched': True}
+
+    def test_different_faces_do_not_collide(self):
+        cache = RecognitionCache()
+        cache.put(self.FACE_A, 0.45, 'v1', self.result('S1'), scope='kiosk-1')
+        self.assertIsNone(cache.get(self.FACE_B, 0.45, 'v1', scope='kiosk-1'))
+        self.assertEqual(cache.get(self.FACE_A, 0.45, 'v1', scope='kiosk-1')['student_id'], 'S1')
+
+    def test_entries_are_scoped_per_device(self):
+        cache = RecognitionCache()
+        cache.put(self.FACE_A, 0.45, 'v1', self.result('S1'), scope='kiosk-1')
+        self.assertIsNone(cache.get(self.FACE_A, 0.45, 'v1', scope='kiosk-2'))
+
+    def test_nearest_entry_wins(self):
+        cache = RecognitionCache(max_distance=4)
+        cache.put(self.FACE_A, 0.45, 'v1', self.result('S1'), scope='kiosk-1')
+        cache.put(self.FACE_B, 0.45, 'v1', self.result('S2'), scope='kiosk-1')
+        # One bit from B, four bits from A
+        self.assertEqual(cache.get(self.FACE_B ^ 0b10000, 0.45, 'v1', scope='kiosk-1')['student_id'], 'S2')
+
+    def test_gallery_version_change_invalidates(self):
+        cache = RecognitionCache()
+        cache.put(self.FACE_A, 0.45, 'v1', self.result('S1'), scope='kiosk-1')
+        self.assertIsNone(cache.get(self.FACE_A, 0.45, 'v2', scope='kiosk-1'))
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+
+class SummaryReconcileTests(TestCase):
+    """Reconciliation fixes status counters without rewriting past enrolment."""
+
+    def test_past_day_keeps_its_total_students(self):
+        day = timezone.localdate() - timedelta(days=2)
+        for i in range(2):
+            user = User.objects.create_user(f'recon{i}', f'recon{i}@example.com', 'pw')
+            student = Student.objects.create(user=user, student_id=f'R{i}')
+            AttendanceRecord.objects.create(student=student, date=day, status='present')
+        # The day was taken with 5 students enrolled; its present counter drifted
+        AttendanceSummary.objects.filter(date=day).update(total_students=5, present_count=7)
+
+        self.assertEqual(reconcile_summaries(days=3)['corrected'], 1)
+        summary = AttendanceSummary.objects.get(date=day)
+        self.assertEqual((summary.total_students, summary.present_count), (5, 2))
+        self.assertEqual(summary.attendance_percentage, 40.0)
+        self.assertEqual(reconcile_summaries(days=3)['corrected'], 0)
+
+
+class SummaryDeltaTests(TestCase):
+    """Saving and deleting records moves the day's counters in step."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.day = timezone.localdate()
+        cls.students = [
+            Student.objects.create(
+                user=User.objects.create_user(f'delta{i}', f'delta{i}@example.com', 'pw'), student_id=f'D{i}'
+            )
+            for i in range(4)
+        ]
+
+    def counters(self):
+        summary = AttendanceSummary.objects.get(date=self.day)
+        return (summary.present_count, summary.late_count, summary.attendance_percentage)
+
+    def test_status_change_moves_the_record(self):
+        record = AttendanceRecord.objects.create(student=self.students[0], date=self.day, status='present')
+        AttendanceRecord.objects.create(student=self.students[1], date=self.day, status='absent')
+        self.assertEqual(self.counters(), (1, 0, 25.0))
+
+        record.status = 'late'
+        with self.assertNumQueries(3):  # the save and one UPDATE per counter
+            record.save()
+        self.assertEqual(self.counters(), (0, 1, 25.0))
+
+    def test_delete_counts_the_record_out(self):
+        record = AttendanceRecord.objects.create(student=self.students[0], date=self.day, status='present')
+        AttendanceRecord.objects.create(student=self.students[1], date=self.day, status='present')
+        record.delete()
+        self.assertEqual(self.counters(), (1, 0, 25.0))
+
+    def test_deltas_need_an_existing_row_and_stop_at_zero(self):
+        self.assertFalse(apply_deltas(self.day, {'present': 1}))
+        AttendanceRecord.objects.create(student=self.students[0], date=self.day, status='late')
+        self.assertTrue(apply_deltas(self.day, {'late': 1, 'unknown': 1}))
+        self.assertEqual(self.counters(), (0, 2, 50.0))
+        # A drifted counter is not decremented below zero
+        self.assertTrue(apply_deltas(self.day, {'present': -1}))
+        self.assertEqual(self.counters()[:2], (0, 2))
+
+    def test_bulk_inserted_records_are_counted_per_day(self):
+        yesterday = self.day - timedelta(days=1)
+        AttendanceRecord.objects.create(student=self.students[0], date=self.day, status='present')
+        records = AttendanceRecord.objects.bulk_create([
+            AttendanceRecord(student=self.students[1], date=self.day, status='present'),
+            AttendanceRecord(student=self.students[2], date=self.day, status='late'),
+            AttendanceRecord(student=self.students[0], date=yesterday, status='present'),
+        ])
+        # One UPDATE for today's records
+        with self.assertNumQueries(1):
+            count_records(records[:2])
+        # Yesterday has no summary row yet: it is built from full counts
+        count_records(records[2:])
+        self.assertEqual(self.counters(), (2, 1, 75.0))
+        self.assertEqual(AttendanceSummary.objects.get(date=yesterday).present_count, 1)
+
+
+def _clustered_gallery(clusters=8, per_cluster=25, seed=0):
+    """Unit-norm encodings grouped around `clusters` random centres."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, 128))
+    gallery = np.repeat(centres, per_cluster, axis=0) + rng.normal(scale=0.05, size=(clusters * per_cluster, 128))
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+    return gallery.astype(np.float32)
+
+
+class FaceIndexTests(TestCase):
+    """Flat and IVF searches agree with a brute-force scan, and indexes survive a save/load."""
+
+    def setUp(self):
+        self.gallery = _clustered_gallery()
+        self.probe = self.gallery[17] + np.float32(0.01)
+
+    def exact(self, k):
+        distances = np.linalg.norm(self.gallery - self.probe, axis=1)
+        return np.argsort(distances)[:k], np.sort(distances)[:k]
+
+    def test_flat_top_k_is_exact(self):
+        index = FlatIndex()
+        index.build(self.gallery)
+        indices, distances = index.search(self.probe, k=5)
+        expected_indices, expected_distances = self.exact(5)
+        np.testing.assert_array_equal(indices, expected_indices)
+        np.testing.assert_allclose(distances, expected_distances, atol=1e-4)
+        self.assertEqual(measure_recall(index, k=5), 1.0)
+
+    def test_ivf_top_k(self):
+        index = IVFIndex(nlist=8, nprobe=2)
+        index.build(self.gallery)
+        self.assertEqual(len(index.centroids), 8)
+        indices, _ = index.search(self.probe, k=5)
+        self.assertEqual(set(indices), set(self.exact(5)[0]))
+        self.assertGreaterEqual(measure_recall(index, sample_size=50, k=5), 0.9)
+
+        # Probing every cell is an exact scan
+        index.nprobe = 8
+        self.assertEqual(measure_recall(index, sample_size=50, k=5), 1.0)
+
+    def test_save_load_round_trip(self):
+        index = IVFIndex(nlist=8, nprobe=2)
+        index.build(self.gallery)
+        index.recall = 0.97
+        with tempfile.TemporaryDirectory() as model_dir:
+            path = os.path.join(model_dir, 'index.npz')
+            save_index(index, path, generation='g1')
+            sq_norms = index.sq_norms
+
+            loaded = load_index(path, self.gallery, sq_norms, 'ivf', generation='g1', nprobe=2)
+            np.testing.assert_array_equal(loaded.list_members, index.list_members)
+            np.testing.assert_array_equal(loaded.search(self.probe, k=5)[0], index.search(self.probe, k=5)[0])
+            self.assertEqual(loaded.recall, 0.97)
+
+            self.assertIsNone(load_index(path, self.gallery, sq_norms, 'ivf', generation='g2'))
+            self.assertIsNone(load_index(path, self.gallery, sq_norms, 'flat', generation='g1'))
+            self.assertIsNone(load_index(path, self.gallery[:10], sq_norms[:10], 'ivf', generation='g1'))
+            self.assertIsNone(load_index(os.path.join(model_dir, 'missing.npz'), self.gallery, sq_norms, 'ivf'))
+
+            # Rows appended to the same generation are filed without rebuilding
+            grown = np.concatenate([self.gallery, self.gallery[:1] + np.float32(0.001)])
+            extended = load_index(path, grown, np.einsum('ij,ij->i', grown, grown), 'ivf', generation='g1', nprobe=2)
+            self.assertEqual(len(extended), len(grown))
+            self.assertIn(len(grown) - 1, extended.search(grown[-1], k=2)[0])
+
+
+class FaceModelStoreTests(TestCase):
+    """Gallery generations round-trip through the header and data files."""
+
+    def setUp(self):
+        self.model_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.model_dir.cleanup)
+        self.header_path = os.path.join(self.model_dir.name, 'model.json')
+        self.gallery = _clustered_gallery(clusters=2, per_cluster=3)
+
+    def data_files(self):
+        return sorted(name for name in os.listdir(self.model_dir.name) if name.endswith('.npy'))
+
+    def test_write_append_read(self):
+        header = write_gallery(self.header_path, self.gallery[:4], np.array([0, 0, 1, 1]), ['S1', 'S2'])
+        self.assertEqual((header['count'], header['capacity'], header['revision']), (4, 68, 0))
+        self.assertEqual(read_header(self.header_path), header)
+
+        header = append_rows(self.header_path, header, self.gallery[4:], np.array([2, 2]), ['S1', 'S2', 'S3'])
+        self.assertEqual((header['count'], header['revision'], header['student_ids']), (6, 1, ['S1', 'S2', 'S3']))
+
+        read_back, gallery, row_labels = read_gallery(self.header_path)
+        self.assertEqual(read_back, header)
+        np.testing.assert_array_equal(gallery, self.gallery)
+        np.testing.assert_array_equal(row_labels, [0, 0, 1, 1, 2, 2])
+
+        # No room left in the generation: the caller must write a new one
+        full = dict(header, capacity=header['count'])
+        self.assertIsNone(append_rows(self.header_path, full, self.gallery[:1], np.array([0]), ['S1']))
+
+    def test_new_generation_removes_the_old_files(self):
+        first = write_gallery(self.header_path, self.gallery, np.zeros(6), ['S1'])
+        second = write_gallery(self.header_path, self.gallery[:2], np.zeros(2), ['S1'])
+        self.assertEqual(self.data_files(), sorted([second['gallery_file'], second['rows_file']]))
+        self.assertNotIn(first['gallery_file'], self.data_files())
+
+        stray = os.path.join(self.model_dir.name, 'model_old.npy')
+        np.save(stray, np.zeros(1))
+        remove_stale_generations(self.header_path, keep=second['generation'])
+        self.assertFalse(os.path.exists(stray))
+        self.assertEqual(len(self.data_files()), 2)
+
+    def test_convert_pickle_model(self):
+        pickle_path = os.path.join(self.model_dir.name, 'model.pkl')
+        with open(pickle_path, 'wb') as f:
+            pickle.dump({'encodings': list(self.gallery[:3]), 'student_ids': [7, 3, 7]}, f)
+
+        header = convert_pickle_model(pickle_path, self.header_path)
+        self.assertEqual((header['count'], header['student_ids']), (3, ['3', '7']))
+        _, gallery, row_labels = read_gallery(self.header_path, mmap=False)
+        np.testing.assert_array_equal(gallery, self.gallery[:3])
+        self.assertEqual([header['student_ids'][i] for i in row_labels], ['7', '3', '7'])
+
+        with open(pickle_path, 'wb') as f:
+            pickle.dump({'encodings': list(self.gallery[:2]), 'student_ids': [1]}, f)
+        with self.assertRaises(ValueError):
+            convert_pickle_model(pickle_path, self.header_path)
+
+
+class EncodingCodecTests(TestCase):
+    """Packed encodings decode back within each format's precision."""
+
+    def setUp(self):
+        self.encoding = _clustered_gallery(clusters=1, per_cluster=1)[0]
+
+    def test_round_trip(self):
+        for fmt, tolerance in (('float32', 0), ('float16', 1e-3), ('int8', np.abs(self.encoding).max() / 254)):
+            with self.subTest(fmt=fmt):
+                blob = pack_encoding(self.encoding, fmt)
+                self.assertEqual(len(blob), FORMAT_SIZES[fmt])
+                np.testing.assert_allclose(unpack_encoding(blob), self.encoding, rtol=0, atol=tolerance + 1e-7)
+
+    def test_unpack_many(self):
+        encodings = _clustered_gallery(clusters=3, per_cluster=1)
+        uniform = unpack_many(pack_encoding(e, 'float32') for e in encodings)
+        np.testing.assert_array_equal(uniform, encodings)
+        mixed = unpack_many(pack_encoding(e, fmt) for e, fmt in zip(encodings, ('float32', 'float16', 'int8')))
+        np.testing.assert_allclose(mixed, encodings, atol=1e-2)
+
+    def test_invalid_blobs(self):
+        self.assertIsNone(unpack_encoding(b''))
+        self.assertIsNone(unpack_encoding(b'\x00' * 100))
+        with self.assertRaises(ValueError):
+            pack_encoding(self.encoding, 'float64')
+        with self.assertRaises(ValueError):
+            unpack_many([b'\x00' * 100, b'\x00' * 100])
+
+
+class AssignEncodingsTests(TestCase):
+    """Faces of one photo are matched one-to-one against the gallery."""
+
+    def test_student_is_assigned_to_one_face_only(self):
+        base = _clustered_gallery(clusters=3, per_cluster=1, seed=1)
+        with tempfile.TemporaryDirectory() as model_dir:
+            engine = FaceRecognitionEngine(model_dir)
+            engine._set_gallery(np.concatenate([base, base + np.float32(0.01)]), ['A', 'B', 'C'] * 2)
+            probes = np.stack([base[0] + np.float32(0.03), base[0] + np.float32(0.01), base[1]])
+            results = engine._assign_encodings(probes, tolerance=0.45)
+
+        # Both of the first two faces resemble A: only the closer one gets it
+        self.assertEqual([r['student_id'] for r in results], [None, 'A', 'B'])
+        self.assertFalse(results[0]['matched'])
+        self.assertTrue(all(r['matched'] for r in results[1:]))
+
+
+
+class GalleryAppendTests(TestCase):
+    """Enrolling a face updates only that student's row group, centroids and index entries."""
+
+    @override_settings(FACE_PREFILTER_TOP_K=2, FACE_INDEX_TYPE='ivf', FACE_INDEX_NLIST=4)
+    def test_append_matches_a_full_rebuild(self):
+        gallery = _clustered_gallery(clusters=4, per_cluster=5, seed=3)
+        new_b, new_e = gallery[5:7] + np.float32(0.01), gallery[:1] + np.float32(0.02)
+        with tempfile.TemporaryDirectory() as model_dir:
+            engine = FaceRecognitionEngine(model_dir)._save_gallery(gallery, [s for s in 'ABCD' for _ in range(5)])
+            updated = engine._apply_update(lambda e: e._append_rows('B', new_b), 'appending')
+            updated = updated._apply_update(lambda e: e._append_rows('E', new_e), 'appending')
+
+            reference = FaceRecognitionEngine(model_dir)
+            self.assertTrue(reference.load_model())
+            reference._build_centroids()
+            # Appends leave the saved index alone; loading files the new rows into it
+            with np.load(reference.index_path) as saved:
+                self.assertEqual(int(saved['size']), 20)
+
+        for ours, theirs in zip(updated._row_groups, reference._row_groups):
+            np.testing.assert_array_equal(ours, theirs)
+        for field in ('owners', 'row_offsets', 'row_members'):
+            np.testing.assert_array_equal(getattr(updated.centroids, field), getattr(reference.centroids, field))
+        np.testing.assert_allclose(updated.centroids.centroids, reference.centroids.centroids, atol=1e-6)
+        np.testing.assert_array_equal(updated.index.list_offsets, reference.index.list_offsets)
+        np.testing.assert_array_equal(updated.index.list_members, reference.index.list_members)
+        # The published engine that was built on is untouched
+        self.assertEqual((len(engine._row_groups[0]), engine.centroids.student_count, len(engine.index)), (20, 4, 20))
+
+        self.assertTrue(updated.has_encoding('B', new_b[1]))
+        self.assertFalse(updated.has_encoding('A', new_b[1]))
+        self.assertFalse(engine.has_encoding('E', new_e[0]))
+
+
+class ImagePreprocessorTests(TestCase):
+    """A misconfigured preprocessor degrades to the default instead of failing."""
+
+    def test_unknown_clahe_mode_falls_back_to_full(self):
+        with self.assertLogs('attendance', 'WARNING'):
+            preprocessor = ImagePreprocessor(clahe_mode='faces')
+        self.assertEqual(preprocessor.clahe_mode, 'full')
+
+
+class MatchConfidenceTests(TestCase):
+    """Every matching path scores a match the same way."""
+
+    def test_single_batch_and_group_paths_agree(self):
+        gallery = _clustered_gallery(clusters=4, per_cluster=5, seed=2)
+        probe = gallery[0] + np.float32(0.01)
+        with tempfile.TemporaryDirectory() as model_dir:
+            engine = FaceRecognitionEngine(model_dir)
+            engine._set_gallery(gallery, [student for student in 'ABCD' for _ in range(5)])
+            results = [engine._match_encodings(probe[None], 0.45)[0], engine._assign_encodings(probe[None], 0.45)[0]]
+            for top_k in (0, 2):
+                with override_settings(FACE_PREFILTER_TOP_K=top_k):
+                    results.append(engine._match_encoding(probe, 0.45))
+
+        self.assertEqual({r['student_id'] for r in results}, {'A'})
+        for result in results[1:]:
+            self.assertAlmostEqual(result['confidence'], results[0]['confidence'], places=5)
+            self.assertAlmostEqual(result['distance'], results[0]['distance'], places=5)
+        # The score averages the student's closest encodings, not only the best one
+        self.assertLess(results[0]['confidence'], 1.0 - results[0]['distance'] / 0.45)
+
+
+class DatasetZipLimitTests(TestCase):
+    """Dataset ZIPs are checked against the limits before anything is decompressed."""
+
+    def archive(self, members):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name, size in members:
+                archive.writestr(name, b'x' * size)
+        buffer.seek(0)
+        return zipfile.ZipFile(buffer)
+
+    def test_only_image_members_are_counted(self):
+        handler = DatasetHandler()
+        archive = self.archive([
+            ('S1/a.jpg', 10), ('S1/notes.txt', 10), ('__MACOSX/S1/._a.jpg', 10), ('S2/b.PNG', 10)
+        ])
+        self.assertEqual([m.filename for m in handler.list_image_members(archive)], ['S1/a.jpg', 'S2/b.PNG'])
+
+    @override_settings(DATASET_MAX_MEMBERS=2)
+    def test_too_many_images(self):
+        archive = self.archive([(f'S{i}/a.jpg', 1) for i in range(3)])
+        with self.assertRaisesMessage(DatasetError, 'the limit is 2'):
+            DatasetHandler().list_image_members(archive)
+
+    @override_settings(DATASET_MAX_UNCOMPRESSED_BYTES=100)
+    def test_too_large_when_expanded(self):
+        archive = self.archive([('S1/a.jpg', 60), ('S2/b.jpg', 60)])
+        with self.assertRaisesMessage(DatasetError, 'the limit is 100'):
+            DatasetHandler().list_image_members(archive)
+
+    @override_settings(DATASET_MAX_IMAGE_BYTES=50)
+    def test_oversized_image_is_not_read(self):
+        handler = DatasetHandler()
+        archive = self.archive([('S1/a.jpg', 50), ('S1/b.jpg', 51)])
+        small, large = handler.list_image_members(archive)
+        self.assertEqual(len(handler.read_member(archive, small)), 50)
+        self.assertIsNone(handler.read_member(archive, large))
+
+
+class DatasetStudentPathTests(TestCase):
+    """A folder wrapping the whole dataset is not taken for a student ID."""
+
+    def student_ids(self, names, accept_student):
+        with tempfile.TemporaryDirectory() as upload_dir:
+            zip_path = os.path.join(upload_dir, 'dataset.zip')
+            with zipfile.ZipFile(zip_path, 'w') as archive:
+                for name in names:
+                    archive.writestr(name, b'x')
+            # Rejected students are reported without reading or inspecting the image
+            return [entry['student_id'] for entry in DatasetHandler().iter_dataset(zip_path, accept_student)]
+
+    def test_wrapping_folder_is_skipped(self):
+        names = ['dataset/STU001/a.jpg', 'dataset/STU002/b.jpg', 'dataset/STU003_1.jpg']
+        self.assertEqual(self.student_ids(names, lambda student_id: False), ['STU001', 'STU002', 'STU003'])
+
+    def test_single_student_folder_is_kept(self):
+        members = [zipfile.ZipInfo(name) for name in ('STU001/front/a.jpg', 'STU001/side/b.jpg')]
+        handler = DatasetHandler()
+        self.assertEqual(handler._student_paths(members, lambda student_id: student_id == 'STU001'),
+                         ['STU001/front/a.jpg', 'STU001/side/b.jpg'])
+        self.assertEqual(handler._student_paths([zipfile.ZipInfo('STU001/photo.jpg')]), ['STU001/photo.jpg'])
@@ -12,12 +12,17 @@ urlpatterns = [
     
     # RFID endpoints
     path('record/', views.record_attendance_from_rfid, name='record_attendance_from_rfid'),
+    path('record/batch/', views.record_attendance_batch_from_rfid, name='record_attendance_batch_from_rfid'),
     path('rfid-scans/', views.RFIDScanListView.as_view(), name='rfid_scan_list'),
     
     # Face Recognition endpoints
     path('face/record/', face_views.mark_attendance_face, name='mark_attendance_face'),
+    path('face/record/group/', face_views.mark_attendance_group, name='mark_attendance_group'),
+    path('face/record/batch/', face_views.mark_attendance_batch, name='mark_attendance_batch'),
     path('face/dataset/upload/', face_views.upload_dataset, name='upload_dataset'),
     path('face/dataset/progress/', face_views.get_upload_progress, name='get_upload_progress'),
+    path('face/jobs/<int:job_id>/cancel/', face_views.cancel_job, name='cancel_face_job'),
+    path('face/jobs/<int:job_id>/retry/', face_views.retry_job, name='retry_face_job'),
     path('face/student/register/', face_views.register_student_with_face, name='register_student_with_face'),
     path('face/model/train/', face_views.train_model, name='train_model'),
     path('face/model/status/', face_views.model_status, name='model_status'),
@@ -5,17 +5,22 @@ from rest_framework import status, generics, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
 from django.utils import timezone
-from django.db.models import Count, Q, Avg, Case, When, Value, FloatField
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from datetime import datetime, timedelta
 from .models import AttendanceRecord, AttendanceSummary, AttendanceAlert, RFIDScan
+from .aggregates import attendance_counts, attendance_trend, percentage
+from .rfid_cache import get_card_cache, lookup_card
+from .rfid_scans import ingest_scans
+from .write_behind import defer_summaries, get_write_behind
+from .summaries import rebuild_summary
 from .serializers import (
     AttendanceRecordSerializer, AttendanceSummarySerializer, 
     AttendanceAlertSerializer, RFIDScanSerializer, DailyAttendanceSerializer,
     AttendanceStatsSerializer, StudentAttendanceHistorySerializer
 )
-from users.models import Student, RFIDCard
+from users.models import Student
 
 
 class AttendanceRecordListCreateView(generics.ListCreateAPIView):
@@ -82,71 +87,113 @@ class RFIDScanListView(generics.ListCreateAPIView):
     ordering = ['-scan_timestamp']
 
 
+def _log_rfid_scan(card_id, card, scanned_at):
+    """Bookkeeping of an accepted scan, queued on the write-behind buffer: the scan log row and the card's last use."""
+    buffer = get_write_behind()
+    buffer.log_scan(
+        card_id=card_id, student_id=card['student_pk'], scan_timestamp=scanned_at,
+        is_processed=True, processed_at=scanned_at
+    )
+    # Written with QuerySet.update, which sends no signals, so the card stays cached
+    buffer.touch_card(card['card_pk'], scanned_at)
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def record_attendance_from_rfid(request):
-    """Record attendance from RFID scan."""
+    """
+    Record attendance from RFID scan.
+    Cards and today's marked students are cached in process (attendance.rfid_cache),
+    so a repeat tap is answered without a query and a first tap costs one insert;
+    the scan log, last_used and summary writes go through attendance.write_behind.
+    """
     try:
         card_id = request.data.get('card_id')
         if not card_id:
             return Response({'error': 'Card ID is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Create RFID scan record
-        rfid_scan = RFIDScan.objects.create(card_id=card_id)
-
-        # Find student by RFID card
-        try:
-            rfid_card = RFIDCard.objects.get(card_id=card_id, status='active')
-            student = rfid_card.student
-            rfid_scan.student = student
-            rfid_scan.save()
+        scanned_at = timezone.now()
+        card = lookup_card(card_id)
+        if card is None:
+            get_write_behind().log_scan(
+                card_id=card_id, scan_timestamp=scanned_at, is_processed=True, processed_at=scanned_at,
+                error_message=f'No active RFID card found with ID: {card_id}'
+            )
+            return Response({
+                'error': f'No active RFID card found with ID: {card_id}'
+            }, status=status.HTTP_404_NOT_FOUND)
 
-            # Update card last used
-            rfid_card.update_last_used()
+        # Repeat tap of a student already marked today (the local school day)
+        today = timezone.localdate(scanned_at)
+        marked = get_card_cache().get_marked(today, card['student_pk'])
+        if marked:
+            return Response({
+                'message': f'Attendance already recorded for {card["name"]}',
+                'student': card['name'],
+                'status': marked[0],
+                'timestamp': marked[1]
+            }, status=status.HTTP_200_OK)
 
-            # Check if attendance already recorded for today
-            today = timezone.now().date()
-            existing_record = AttendanceRecord.objects.filter(
-                student=student, date=today
-            ).first()
-
-            if existing_record:
-                return Response({
-                    'message': f'Attendance already recorded for {student.user.get_full_name()}',
-                    'student': student.user.get_full_name(),
-                    'status': existing_record.status,
-                    'timestamp': existing_record.timestamp
-                }, status=status.HTTP_200_OK)
-
-            # Create attendance record
-            with transaction.atomic():
+        # Create attendance record; the (student, date) unique constraint replaces an existence check
+        try:
+            with transaction.atomic(), defer_summaries():
                 attendance_record = AttendanceRecord.objects.create(
-                    student=student,
+                    student_id=card['student_pk'],
                     date=today,
+                    timestamp=scanned_at,
                     status='present',
                     recorded_by=request.user
                 )
-                
-                # Update daily summary
-                update_daily_summary(today)
-
-                rfid_scan.mark_as_processed()
-
-                return Response({
-                    'message': f'Attendance recorded for {student.user.get_full_name()}',
-                    'student': student.user.get_full_name(),
-                    'grade': student.grade,
-                    'status': 'present',
-                    'timestamp': attendance_record.timestamp
-                }, status=status.HTTP_201_CREATED)
-
-        except RFIDCard.DoesNotExist:
-            rfid_scan.error_message = f'No active RFID card found with ID: {card_id}'
-            rfid_scan.mark_as_processed()
+        except IntegrityError:
+            existing_record = AttendanceRecord.objects.filter(
+                student_id=card['student_pk'], date=today
+            ).only('status', 'timestamp').first()
+            if existing_record is None:
+                raise
+            get_card_cache().mark(today, card['student_pk'], existing_record.status, existing_record.timestamp)
+            transaction.on_commit(lambda: _log_rfid_scan(card_id, card, scanned_at))
             return Response({
-                'error': f'No active RFID card found with ID: {card_id}'
-            }, status=status.HTTP_404_NOT_FOUND)
+                'message': f'Attendance already recorded for {card["name"]}',
+                'student': card['name'],
+                'status': existing_record.status,
+                'timestamp': existing_record.timestamp
+            }, status=status.HTTP_200_OK)
+
+        transaction.on_commit(lambda: _log_rfid_scan(card_id, card, scanned_at))
+        return Response({
+            'message': f'Attendance recorded for {card["name"]}',
+            'student': card['name'],
+            'grade': card['grade'],
+            'status': attendance_record.status,
+            'timestamp': attendance_record.timestamp
+        }, status=status.HTTP_201_CREATED)
+
+    except Exception as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def record_attendance_batch_from_rfid(request):
+    """
+    Record attendance from a batch of RFID scans, e.g. a reader flushing its offline backlog.
+    Body: {"scans": [{"card_id": ..., "scanned_at": ISO 8601, "device_id": ...}, ...]} (or the bare list).
+    Each scan's own time sets the record's date and lateness; the response has one outcome per scan.
+    """
+    scans = request.data.get('scans') if isinstance(request.data, dict) else request.data
+    if not isinstance(scans, list) or not scans:
+        return Response({'error': 'A non-empty list of scans is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    max_scans = getattr(settings, 'RFID_BATCH_MAX_SCANS', 5000)
+    if len(scans) > max_scans:
+        return Response({
+            'error': f'Too many scans in one batch ({len(scans)}); the limit is {max_scans}'
+        }, status=status.HTTP_400_BAD_REQUEST)
 
+    try:
+        return Response(ingest_scans(scans, recorded_by=request.user), status=status.HTTP_200_OK)
     except Exception as e:
         return Response({
             'error': str(e)
@@ -164,10 +211,10 @@ def daily_attendance(request):
         except ValueError:
             return Response({'error': 'Invalid date format. Use YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
     else:
-        date = timezone.now().date()
+        date = timezone.localdate()
 
     # Get attendance records for the date
-    attendance_records = AttendanceRecord.objects.filter(date=date)
+    attendance_records = AttendanceRecord.objects.filter(date=date).select_related('student__user', 'recorded_by')
 
     # If the user is a student, they should only see their own attendance
     is_student = request.user.role == 'student'
@@ -181,30 +228,18 @@ def daily_attendance(request):
             # Handle if user is student but has no profile
             return Response({'error': 'Student profile not found'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Calculate summary
-    if is_student:
-        total_students = 1
-    else:
-        total_students = Student.objects.filter(is_active=True).count()
-        
-    present_count = attendance_records.filter(status='present').count()
-    absent_count = attendance_records.filter(status='absent').count()
-    late_count = attendance_records.filter(status='late').count()
-    excused_count = attendance_records.filter(status='excused').count()
-    
-    attendance_percentage = 0
-    if total_students > 0:
-        present_total = present_count + late_count + excused_count
-        attendance_percentage = (present_total / total_students) * 100
+    # Calculate summary (all status counts and the active student count in one query)
+    counts = attendance_counts(Student.objects.filter(pk=student_obj.pk) if is_student else None, date=date)
+    total_students = 1 if is_student else counts['total_students']
 
     data = {
         'date': date,
         'total_students': total_students,
-        'present_count': present_count,
-        'absent_count': absent_count,
-        'late_count': late_count,
-        'excused_count': excused_count,
-        'attendance_percentage': round(attendance_percentage, 2),
+        'present_count': counts['present'],
+        'absent_count': counts['absent'],
+        'late_count': counts['late'],
+        'excused_count': counts['excused'],
+        'attendance_percentage': percentage(counts['attended'], total_students),
         'students': AttendanceRecordSerializer(attendance_records, many=True, context={'request': request}).data
     }
 
@@ -218,16 +253,14 @@ def attendance_stats(request):
     period = request.query_params.get('period', 'week')  # week, month, year
     
     if period == 'week':
-        start_date = timezone.now().date() - timedelta(days=7)
+        start_date = timezone.localdate() - timedelta(days=7)
     elif period == 'month':
-        start_date = timezone.now().date() - timedelta(days=30)
+        start_date = timezone.localdate() - timedelta(days=30)
     elif period == 'year':
-        start_date = timezone.now().date() - timedelta(days=365)
+        start_date = timezone.localdate() - timedelta(days=365)
     else:
-        start_date = timezone.now().date() - timedelta(days=7)
+        start_date = timezone.localdate() - timedelta(days=7)
 
-    # Get attendance records for the period
-    attendance_records = AttendanceRecord.objects.filter(date__gte=start_date)
     summaries = AttendanceSummary.objects.filter(date__gte=start_date)
 
     # If the user is a student, calculate their personal stats
@@ -238,29 +271,18 @@ def attendance_stats(request):
             # Dennominator should be total school days tracked
             total_days = summaries.count()
             
-            # Student records for this period
-            student_records = attendance_records.filter(student=student_obj)
-            
-            present_total = student_records.filter(Q(status='present') | Q(status='late') | Q(status='excused')).count()
-            avg_attendance = (present_total / total_days * 100) if total_days > 0 else 0
+            # Student's status counts for this period
+            counts = attendance_counts(Student.objects.filter(pk=student_obj.pk), date__gte=start_date)
+            avg_attendance = percentage(counts['attended'], total_days)
             
             best_day = None
             worst_day = None
             
-            # Personal trends: group their records by date
-            # Since a student has at most one record per day, we can just use the status
-            trends = student_records.values('date').annotate(
-                rate=Case(
-                    When(status='present', then=Value(100.0)),
-                    When(status='late', then=Value(100.0)),
-                    When(status='excused', then=Value(100.0)),
-                    default=Value(0.0),
-                    output_field=FloatField(),
-                )
-            ).order_by('date')
-            
-            # Re-filter attendance_records for the rest of calculations
-            attendance_records = student_records
+            # Personal trends: a student has at most one record per day, so the rate is 100 or 0
+            trends = [
+                {'date': day['date'], 'rate': day['rate']}
+                for day in attendance_trend(AttendanceRecord.objects.filter(student=student_obj, date__gte=start_date))
+            ]
             
         except Exception as e:
             import logging
@@ -268,27 +290,22 @@ def attendance_stats(request):
             logger.error(f"Error calculating student stats: {e}")
             return Response({'error': 'Student profile not found or error calculating stats'}, status=status.HTTP_404_NOT_FOUND)
     else:
-        # Calculate global statistics
-        total_days = summaries.count()
+        # Calculate global statistics from the daily summaries (one query)
+        trends = [
+            {'date': day['date'], 'rate': day['attendance_percentage']}
+            for day in summaries.order_by('date').values('date', 'attendance_percentage')
+        ]
+        total_days = len(trends)
         if total_days > 0:
-            avg_attendance = summaries.aggregate(avg=Avg('attendance_percentage'))['avg'] or 0
-            best_day = summaries.order_by('-attendance_percentage').first()
-            worst_day = summaries.order_by('attendance_percentage').first()
-            best_day = best_day.date if best_day else None
-            worst_day = worst_day.date if worst_day else None
+            avg_attendance = sum(day['rate'] for day in trends) / total_days
+            best_day = max(trends, key=lambda day: day['rate'])['date']
+            worst_day = min(trends, key=lambda day: day['rate'])['date']
         else:
             avg_attendance = 0
             best_day = None
             worst_day = None
-            
-        trends = summaries.values('date').annotate(
-            rate=Avg('attendance_percentage')
-        ).order_by('date')
 
-    total_present = attendance_records.filter(status='present').count()
-    total_absent = attendance_records.filter(status='absent').count()
-    total_late = attendance_records.filter(status='late').count()
-    total_excused = attendance_records.filter(status='excused').count()
+        counts = attendance_counts(date__gte=start_date)
 
     data = {
         'period': period,
@@ -296,10 +313,10 @@ def attendance_stats(request):
         'average_attendance': round(avg_attendance or 0, 2),
         'best_day': best_day,
         'worst_day': worst_day,
-        'total_present': total_present,
-        'total_absent': total_absent,
-        'total_late': total_late,
-        'total_excused': total_excused,
+        'total_present': counts['present'],
+        'total_absent': counts['absent'],
+        'total_late': counts['late'],
+        'total_excused': counts['excused'],
         'trends': list(trends)
     }
 
@@ -318,29 +335,20 @@ def student_attendance_history(request, student_id):
     # Get recent attendance records (last 30 days)
     recent_records = AttendanceRecord.objects.filter(
         student=student,
-        date__gte=timezone.now().date() - timedelta(days=30)
-    ).order_by('-date')[:10]
+        date__gte=timezone.localdate() - timedelta(days=30)
+    ).select_related('student__user', 'recorded_by').order_by('-date')[:10]
 
-    # Calculate totals
-    total_days = AttendanceRecord.objects.filter(student=student).count()
-    present_days = AttendanceRecord.objects.filter(student=student, status='present').count()
-    absent_days = AttendanceRecord.objects.filter(student=student, status='absent').count()
-    late_days = AttendanceRecord.objects.filter(student=student, status='late').count()
-    excused_days = AttendanceRecord.objects.filter(student=student, status='excused').count()
-
-    attendance_percentage = 0
-    if total_days > 0:
-        present_total = present_days + late_days + excused_days
-        attendance_percentage = (present_total / total_days) * 100
+    # Calculate totals (one query)
+    counts = attendance_counts(Student.objects.filter(pk=student.pk))
 
     data = {
         'student': student,
-        'total_days': total_days,
-        'present_days': present_days,
-        'absent_days': absent_days,
-        'late_days': late_days,
-        'excused_days': excused_days,
-        'attendance_percentage': round(attendance_percentage, 2),
+        'total_days': counts['total_records'],
+        'present_days': counts['present'],
+        'absent_days': counts['absent'],
+        'late_days': counts['late'],
+        'excused_days': counts['excused'],
+        'attendance_percentage': counts['record_percentage'],
         'recent_records': recent_records
     }
 
@@ -349,30 +357,9 @@ def student_attendance_history(request, student_id):
 
 
 def update_daily_summary(date):
-    """Update or create daily attendance summary."""
-    attendance_records = AttendanceRecord.objects.filter(date=date)
-    total_students = Student.objects.filter(is_active=True).count()
-    
-    present_count = attendance_records.filter(status='present').count()
-    absent_count = attendance_records.filter(status='absent').count()
-    late_count = attendance_records.filter(status='late').count()
-    excused_count = attendance_records.filter(status='excused').count()
-
-    summary, created = AttendanceSummary.objects.get_or_create(
-        date=date,
-        defaults={
-            'total_students': total_students,
-            'present_count': present_count,
-            'absent_count': absent_count,
-            'late_count': late_count,
-            'excused_count': excused_count,
-        }
-    )
-
-    if not created:
-        summary.total_students = total_students
-        summary.present_count = present_count
-        summary.absent_count = absent_count
-        summary.late_count = late_count
-        summary.excused_count = excused_count
-        summary.save()
+    """
+    Recount the daily attendance summary from scratch.
+    Single records keep it current through signals (see attendance.summaries); this
+    is for bulk_create paths, which send no signals.
+    """
+    return rebuild_summary(date)
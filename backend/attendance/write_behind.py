@@ -0,0 +1,208 @@
+"""
+Write-behind buffer for RFID scan bookkeeping.
+
+A tap's response only waits for the attendance insert. The bookkeeping around
+it (the scan log row, the card's last_used and the day's summary) is queued
+here and written by a background thread every WRITE_BEHIND_INTERVAL seconds,
+or sooner once WRITE_BEHIND_MAX_PENDING writes are queued:
+
+- scan log rows are inserted with one bulk_create, already flagged processed
+- last_used updates are coalesced per card into one UPDATE
+- summary changes are queued as per-status deltas, summed per day and
+  applied with one F() UPDATE per touched day (attendance.summaries)
+
+The buffer is per process and in memory: a crash loses at most one interval
+of scan log rows, last_used values and summary deltas. Lost deltas are
+recounted by the 'reconcile_summaries' job, which every job poll queues once
+per SUMMARY_RECONCILE_INTERVAL. WRITE_BEHIND_INTERVAL = 0 writes everything
+immediately.
+"""
+import atexit
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import RFIDScan
+from .rfid_scans import BULK_BATCH_SIZE, touch_cards
+from .summaries import apply_day_deltas, as_date, record_changed
+
+logger = logging.getLogger('attendance')
+
+_deferring = threading.local()
+
+
+class WriteBehindBuffer:
+    """Thread-safe queue of scan bookkeeping writes, flushed in batches by a daemon thread."""
+
+    def __init__(self, interval: float = None, max_pending: int = None):
+        """
+        Initialize the buffer.
+
+        Args:
+            interval: Seconds between flushes (0 writes synchronously); WRITE_BEHIND_INTERVAL if None
+            max_pending: Queued writes that trigger an early flush; WRITE_BEHIND_MAX_PENDING if None
+        """
+        self._interval = interval
+        self._max_pending = max_pending
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._reset()
+
+    def _reset(self):
+        self._scans = []
+        self._last_used = {}  # card pk -> latest use
+        self._summary_deltas = {}  # date -> {status: delta}
+
+    @property
+    def interval(self) -> float:
+        return self._interval if self._interval is not None else getattr(settings, 'WRITE_BEHIND_INTERVAL', 1.0)
+
+    @property
+    def max_pending(self) -> int:
+        return self._max_pending if self._max_pending is not None else getattr(settings, 'WRITE_BEHIND_MAX_PENDING', 1000)
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._scans) + len(self._last_used) + len(self._summary_deltas)
+
+    def log_scan(self, **fields):
+        """Queue an RFIDScan row (fields as for RFIDScan(...))."""
+        if not self.enabled:
+            RFIDScan.objects.create(**fields)
+            return
+        self._ensure_flusher()
+        with self._lock:
+            self._scans.append(RFIDScan(**fields))
+        self._queued()
+
+    def touch_card(self, card_pk: int, used_at):
+        """Queue a card's last_used; only the latest per card is written."""
+        if not self.enabled:
+            touch_cards({card_pk: used_at})
+            return
+        self._ensure_flusher()
+        with self._lock:
+            current = self._last_used.get(card_pk)
+            if current is None or used_at > current:
+                self._last_used[card_pk] = used_at
+        self._queued()
+
+    def count_record(self, date, status: str, delta: int):
+        """Queue a record counted in (delta=1) or out of (delta=-1) a day's AttendanceSummary."""
+        if not self.enabled:
+            record_changed(date, status, delta)
+            return
+        date = as_date(date)
+        if date is None:
+            return
+        self._ensure_flusher()
+        with self._lock:
+            self._add_deltas(date, {status: delta})
+        self._queued()
+
+    def _add_deltas(self, date, deltas):
+        day = self._summary_deltas.setdefault(date, {})
+        for status, delta in deltas.items():
+            day[status] = day.get(status, 0) + delta
+
+    def _queued(self):
+        if self.pending >= self.max_pending:
+            self._wakeup.set()
+
+    def _ensure_flusher(self):
+        """Start the flusher thread (again in a forked worker, whose copy of the queue belongs to the parent)."""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._reset()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='attendance-write-behind', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flusher error: {e}")
+
+    def flush(self) -> int:
+        """
+        Write everything queued in one transaction.
+
+        Returns:
+            Number of queued writes flushed; on failure they are re-queued for the next flush
+        """
+        with self._lock:
+            scans, last_used, summary_deltas = self._scans, self._last_used, self._summary_deltas
+            self._reset()
+        if not (scans or last_used or summary_deltas):
+            return 0
+
+        try:
+            with transaction.atomic():
+                # Retried flushes hit the (card_id, device_id, scan_timestamp) constraint
+                RFIDScan.objects.bulk_create(scans, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+                touch_cards(last_used)
+                apply_day_deltas(summary_deltas)
+        except Exception as e:
+            logger.error(f"Write-behind flush failed, retrying on the next flush: {e}")
+            with self._lock:
+                self._scans[:0] = scans
+                for card_pk, used_at in last_used.items():
+                    if card_pk not in self._last_used or used_at > self._last_used[card_pk]:
+                        self._last_used[card_pk] = used_at
+                for date, deltas in summary_deltas.items():
+                    self._add_deltas(date, deltas)
+                # Keep memory bounded if the database stays unavailable
+                overflow = len(self._scans) - self.max_pending * 10
+                if overflow > 0:
+                    logger.warning(f"Write-behind queue full, dropping {overflow} scan log rows")
+                    del self._scans[:overflow]
+            return 0
+        return len(scans) + len(last_used) + len(summary_deltas)
+
+
+_write_behind = None
+_write_behind_lock = threading.Lock()
+
+
+def get_write_behind() -> WriteBehindBuffer:
+    """Process-wide buffer configured from WRITE_BEHIND_INTERVAL / WRITE_BEHIND_MAX_PENDING (flushed at exit)."""
+    global _write_behind
+    if _write_behind is None:
+        with _write_behind_lock:
+            if _write_behind is None:
+                _write_behind = WriteBehindBuffer()
+                atexit.register(_write_behind.flush)
+    return _write_behind
+
+
+@contextmanager
+def defer_summaries():
+    """Within this block, saved AttendanceRecords queue their summary deltas instead of applying them inline."""
+    previous = getattr(_deferring, 'active', False)
+    _deferring.active = True
+    try:
+        yield
+    finally:
+        _deferring.active = previous
+
+
+def summaries_deferred() -> bool:
+    return getattr(_deferring, 'active', False) and get_write_behind().enabled
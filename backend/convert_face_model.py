@@ -0,0 +1,27 @@
+import os
+import sys
+import django
+
+# Setup Django environment
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'edurfid.settings')
+django.setup()
+
+from utils.face_model_store import convert_pickle_model
+from utils.face_recognition_utils import FaceRecognitionEngine
+
+def convert_face_model(model_dir=None):
+    """Convert models/face_recognition_model.pkl to the memory-mapped binary gallery format."""
+    engine = FaceRecognitionEngine(model_dir)
+
+    if not os.path.exists(engine.legacy_model_path):
+        print(f"No legacy model found at {engine.legacy_model_path}")
+        return False
+
+    header = convert_pickle_model(engine.legacy_model_path, engine.model_path)
+    print(f"Converted {header['count']} encodings for {len(header['student_ids'])} students")
+    print(f"Header: {engine.model_path}")
+    print(f"Gallery: {os.path.join(engine.model_dir, header['gallery_file'])}")
+    return True
+
+if __name__ == "__main__":
+    convert_face_model(sys.argv[1] if len(sys.argv) > 1 else None)
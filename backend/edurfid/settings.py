@@ -178,6 +178,105 @@ CORS_ALLOWED_ORIGINS = [
 OFFLINE_SYNC_ENABLED = True
 OFFLINE_DB_PATH = BASE_DIR / 'offline_db.sqlite3'
 
+# Face recognition gallery index ('flat' = exact scan, 'ivf' = approximate k-means cells)
+FACE_INDEX_TYPE = os.environ.get('FACE_INDEX_TYPE', 'flat')
+FACE_INDEX_NLIST = int(os.environ.get('FACE_INDEX_NLIST', 0))  # 0 = sqrt(gallery size)
+FACE_INDEX_NPROBE = int(os.environ.get('FACE_INDEX_NPROBE', 8))
+
+# Per-student centroid prefilter: shortlist this many students, then re-rank their images
+# (0 = off: the gallery index (FACE_INDEX_TYPE) is searched directly)
+FACE_PREFILTER_TOP_K = int(os.environ.get('FACE_PREFILTER_TOP_K', 0))
+FACE_CENTROID_MODE = os.environ.get('FACE_CENTROID_MODE', 'mean')  # mean, medoid or kmeans
+FACE_CENTROIDS_PER_STUDENT = int(os.environ.get('FACE_CENTROIDS_PER_STUDENT', 3))
+
+# Training: encoding worker processes (0 = one per CPU core) and images per worker chunk
+FACE_TRAINING_WORKERS = int(os.environ.get('FACE_TRAINING_WORKERS', 0))
+FACE_TRAINING_CHUNK_SIZE = int(os.environ.get('FACE_TRAINING_CHUNK_SIZE', 8))
+
+# Dataset ZIP uploads are streamed, never extracted: member count, total uncompressed size and size per image
+DATASET_MAX_MEMBERS = int(os.environ.get('DATASET_MAX_MEMBERS', 5000))
+DATASET_MAX_UNCOMPRESSED_BYTES = int(os.environ.get('DATASET_MAX_UNCOMPRESSED_BYTES', 512 * 1024 * 1024))
+DATASET_MAX_IMAGE_BYTES = int(os.environ.get('DATASET_MAX_IMAGE_BYTES', 10 * 1024 * 1024))
+# Images whose bytes are already stored are always skipped; additionally skip images whose face crop
+# dHash is within this Hamming distance of one the student already has (0 = off)
+DATASET_NEAR_DUPLICATE_DISTANCE = int(os.environ.get('DATASET_NEAR_DUPLICATE_DISTANCE', 0))
+
+# Image preprocessing shared by training and recognition: longest side after resize, and
+# CLAHE contrast enhancement on the whole frame ('full'), only the detected face ('face') or 'off'
+FACE_PREPROCESS_MAX_DIMENSION = int(os.environ.get('FACE_PREPROCESS_MAX_DIMENSION', 800))
+FACE_CLAHE_MODE = os.environ.get('FACE_CLAHE_MODE', 'full')
+FACE_CLAHE_CLIP_LIMIT = float(os.environ.get('FACE_CLAHE_CLIP_LIMIT', 2.0))
+
+# Face detection: 'cascade' proposes regions cheaply (Haar cascade, or 'hog' on a 4x-downscaled
+# frame) and runs dlib HOG only inside them; 'hog' runs dlib HOG over the whole frame
+FACE_DETECTOR = os.environ.get('FACE_DETECTOR', 'cascade')
+FACE_CASCADE_PROPOSER = os.environ.get('FACE_CASCADE_PROPOSER', 'haar')
+FACE_CASCADE_MAX_DIMENSION = int(os.environ.get('FACE_CASCADE_MAX_DIMENSION', 320))
+FACE_HAAR_CASCADE_PATH = os.environ.get('FACE_HAAR_CASCADE_PATH', '')  # default: OpenCV's frontal-face cascade
+
+# Batch recognition endpoint: frames per request, bytes per frame and decode/encode threads (0 = one per CPU core)
+FACE_BATCH_MAX_IMAGES = int(os.environ.get('FACE_BATCH_MAX_IMAGES', 50))
+FACE_BATCH_MAX_IMAGE_BYTES = int(os.environ.get('FACE_BATCH_MAX_IMAGE_BYTES', 10 * 1024 * 1024))
+FACE_BATCH_WORKERS = int(os.environ.get('FACE_BATCH_WORKERS', 4))
+
+# Per-device recognition sessions (camera loops): votes needed before marking, box overlap (IoU)
+# that continues a face track, and seconds before an idle track / session is forgotten
+FACE_SESSION_MIN_VOTES = int(os.environ.get('FACE_SESSION_MIN_VOTES', 2))
+FACE_SESSION_IOU = float(os.environ.get('FACE_SESSION_IOU', 0.3))
+FACE_SESSION_TRACK_TTL = int(os.environ.get('FACE_SESSION_TRACK_TTL', 10))
+FACE_SESSION_TTL = int(os.environ.get('FACE_SESSION_TTL', 60))
+# A resolved track answers later frames for at most FACE_SESSION_RESOLVED_TTL seconds, and only while the
+# face crop's dHash stays within FACE_SESSION_MAX_HASH_DISTANCE bits (of 64) of the crop that resolved it
+FACE_SESSION_RESOLVED_TTL = int(os.environ.get('FACE_SESSION_RESOLVED_TTL', 30))
+FACE_SESSION_MAX_HASH_DISTANCE = int(os.environ.get('FACE_SESSION_MAX_HASH_DISTANCE', 8))
+
+# Recognition result cache keyed by camera device and a perceptual hash (dHash) of the face crop: entries
+# (0 = off), seconds an entry lives, and Hamming distance between hashes of the same crop in consecutive
+# frames (0 = exact matches only)
+FACE_RESULT_CACHE_SIZE = int(os.environ.get('FACE_RESULT_CACHE_SIZE', 256))
+FACE_RESULT_CACHE_TTL = float(os.environ.get('FACE_RESULT_CACHE_TTL', 10))
+FACE_RESULT_CACHE_MAX_DISTANCE = int(os.environ.get('FACE_RESULT_CACHE_MAX_DISTANCE', 5))
+
+# Unrecognized frames kept for review: at most one per camera device or user per this many seconds (0 = none)
+FACE_UNRECOGNIZED_CAPTURE_INTERVAL = int(os.environ.get('FACE_UNRECOGNIZED_CAPTURE_INTERVAL', 60))
+
+# Seconds between checks for a model published by another process (training job, other workers)
+FACE_MODEL_CHECK_INTERVAL = float(os.environ.get('FACE_MODEL_CHECK_INTERVAL', 2))
+
+# Database storage for cached face encodings: float32 (512 B, lossless), float16 (256 B) or int8 (132 B)
+FACE_ENCODING_STORAGE = os.environ.get('FACE_ENCODING_STORAGE', 'float32')
+
+# Background jobs (dataset processing, training). 'thread' = every web process polls the queue from a
+# thread and runs due jobs itself (no worker needed, e.g. the single Render web service); 'worker' = leave
+# them for a separate `manage.py run_jobs` process (docker-compose and the Procfile run one and set
+# JOB_RUNNER=worker). Either way the queue is polled every JOB_POLL_INTERVAL seconds when idle
+JOB_RUNNER = os.environ.get('JOB_RUNNER', 'thread')
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 600))  # re-queue running jobs without a heartbeat
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_BACKOFF = float(os.environ.get('JOB_RETRY_BACKOFF', 30))  # seconds before the 2nd attempt, doubled after each
+
+# Daily attendance summaries are kept current by per-record F() deltas; a queued job recounts the last
+# SUMMARY_RECONCILE_DAYS days every SUMMARY_RECONCILE_INTERVAL seconds to fix any drift (0 = never)
+SUMMARY_RECONCILE_INTERVAL = int(os.environ.get('SUMMARY_RECONCILE_INTERVAL', 3600))
+SUMMARY_RECONCILE_DAYS = int(os.environ.get('SUMMARY_RECONCILE_DAYS', 7))
+
+# In-process RFID card cache (card -> student, plus students already marked today): cards kept (0 = off)
+# and seconds before an entry is re-read, which bounds staleness across web workers
+RFID_CARD_CACHE_SIZE = int(os.environ.get('RFID_CARD_CACHE_SIZE', 10000))
+RFID_CARD_CACHE_TTL = float(os.environ.get('RFID_CARD_CACHE_TTL', 60))
+
+# Attendance taken after this local time (HH:MM) is marked late; empty = every scan is 'present'
+ATTENDANCE_LATE_AFTER = os.environ.get('ATTENDANCE_LATE_AFTER', '')
+
+# Most scans accepted by one batch request (attendance/record/batch/)
+RFID_BATCH_MAX_SCANS = int(os.environ.get('RFID_BATCH_MAX_SCANS', 5000))
+
+# Write-behind buffer for RFID tap bookkeeping (scan log, card last_used, daily summary): seconds
+# between background flushes (0 = write during the request) and queued writes forcing an early flush
+WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', 1.0))
+WRITE_BEHIND_MAX_PENDING = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 1000))
+
 # Email settings (for notifications)
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
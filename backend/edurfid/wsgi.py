@@ -4,8 +4,14 @@ WSGI config for edurfid project.
 
 import os
 
+from django.core.signals import request_started
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'edurfid.settings')
 
 application = get_wsgi_application()
+
+# JOB_RUNNER=thread: every process serving requests also polls the job queue
+from attendance.jobs import start_job_poller  # noqa: E402
+
+request_started.connect(start_job_poller)
@@ -1,5 +1,10 @@
 #!/bin/bash
 
+# Run a different process (e.g. the job worker: python manage.py run_jobs) if one was given
+if [ "$#" -gt 0 ]; then
+    exec "$@"
+fi
+
 # Run migrations
 echo "Running migrations..."
 python manage.py migrate
@@ -4,6 +4,7 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.http import HttpResponse
 from django.db.models import Count, Q
+from attendance.aggregates import attendance_counts, attendance_counts_by
 from attendance.models import AttendanceRecord
 from users.models import Student, User, School
 from datetime import datetime, date
@@ -49,11 +50,12 @@ def generate_daily_report(request, date):
         # Get attendance records
         records = AttendanceRecord.objects.filter(date=report_date).select_related('student', 'student__user')
         
-        # Calculate stats
-        total_students = Student.objects.filter(is_active=True).count()
-        present_count = records.filter(status='present').count()
-        absent_count = records.filter(status='absent').count()
-        late_count = records.filter(status='late').count()
+        # Calculate stats (one query)
+        counts = attendance_counts(date=report_date)
+        total_students = counts['total_students']
+        present_count = counts['present']
+        absent_count = counts['absent']
+        late_count = counts['late']
         
         # Create PDF
         buffer = BytesIO()
@@ -149,11 +151,6 @@ def generate_monthly_report(request, year, month):
             end_date = date(year + 1, 1, 1)
         else:
             end_date = date(year, month_num + 1, 1)
-            
-        records = AttendanceRecord.objects.filter(
-            date__gte=start_date,
-            date__lt=end_date
-        ).select_related('student', 'student__user')
         
         buffer = BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=landscape(letter))
@@ -163,24 +160,25 @@ def generate_monthly_report(request, year, month):
         elements.append(Paragraph(f"Monthly Attendance Report: {month} {year}", styles['Title']))
         elements.append(Spacer(1, 20))
         
-        # Aggregate by student
+        # Aggregate by student: per-status counts of every active student in one query
         student_stats = {}
-        all_students = Student.objects.filter(is_active=True).select_related('user')
-        
-        for student in all_students:
-            student_stats[student.id] = {
-                'name': student.user.get_full_name(),
-                'id': student.student_id,
-                'grade': student.grade,
-                'present': 0,
-                'absent': 0,
-                'late': 0,
-                'excused': 0
+        rows = attendance_counts_by(
+            ['id', 'student_id', 'grade', 'user__first_name', 'user__last_name'],
+            Student.objects.filter(is_active=True),
+            date__gte=start_date,
+            date__lt=end_date
+        )
+        
+        for row in rows:
+            student_stats[row['id']] = {
+                'name': f"{row['user__first_name']} {row['user__last_name']}".strip(),
+                'id': row['student_id'],
+                'grade': row['grade'],
+                'present': row['present'],
+                'absent': row['absent'],
+                'late': row['late'],
+                'excused': row['excused']
             }
-            
-        for record in records:
-            if record.student.id in student_stats:
-                student_stats[record.student.id][record.status] += 1
                 
         # Table
         data = [['Student ID', 'Name', 'Grade', 'Present', 'Absent', 'Late', 'Excused', 'Attendance %']]
@@ -0,0 +1,82 @@
+# Generated by Django 4.2.7 on 2026-10-17 09:00
+
+import json
+
+import numpy as np
+from django.conf import settings
+from django.db import migrations, models
+
+# Frozen copy of utils.encoding_codec as of this migration, so later codec
+# changes cannot alter what the migration writes or reads. Formats are told
+# apart by blob length: float32 (512 bytes), float16 (256), int8 (4-byte
+# float32 scale + 128 int8 values).
+ENCODING_DIM = 128
+
+
+def pack_encoding(encoding, fmt='float32'):
+    vector = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+    if fmt == 'float16':
+        return vector.astype('<f2').tobytes()
+    if fmt == 'int8':
+        scale = float(np.abs(vector).max()) / 127.0 or 1.0
+        quantized = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return np.float32(scale).astype('<f4').tobytes() + quantized.tobytes()
+    return vector.astype('<f4').tobytes()
+
+
+def unpack_encoding(blob):
+    if not blob:
+        return None
+    blob = bytes(blob)
+    if len(blob) == ENCODING_DIM * 4:
+        return np.frombuffer(blob, dtype='<f4').astype(np.float32)
+    if len(blob) == ENCODING_DIM * 2:
+        return np.frombuffer(blob, dtype='<f2').astype(np.float32)
+    if len(blob) == ENCODING_DIM + 4:
+        scale = np.frombuffer(blob, dtype='<f4', count=1)[0]
+        return np.frombuffer(blob, dtype=np.int8, offset=4).astype(np.float32) * scale
+    return None
+
+
+def json_to_binary(apps, schema_editor):
+    Student = apps.get_model('users', 'Student')
+    storage = getattr(settings, 'FACE_ENCODING_STORAGE', 'float32')
+    students = []
+    for student in Student.objects.exclude(face_encoding__isnull=True).exclude(face_encoding='').only('id', 'face_encoding'):
+        try:
+            student.face_encoding_data = pack_encoding(json.loads(student.face_encoding), storage)
+        except (ValueError, TypeError):
+            continue
+        students.append(student)
+    Student.objects.bulk_update(students, ['face_encoding_data'], batch_size=500)
+
+
+def binary_to_json(apps, schema_editor):
+    Student = apps.get_model('users', 'Student')
+    students = []
+    for student in Student.objects.exclude(face_encoding_data__isnull=True).only('id', 'face_encoding_data'):
+        encoding = unpack_encoding(student.face_encoding_data)
+        if encoding is not None:
+            student.face_encoding = json.dumps(encoding.tolist())
+            students.append(student)
+    Student.objects.bulk_update(students, ['face_encoding'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_student_face_encoding_student_face_enrolled_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='face_encoding_data',
+            field=models.BinaryField(blank=True, help_text='Packed face encoding (see utils.encoding_codec)', null=True),
+        ),
+        migrations.RunPython(json_to_binary, binary_to_json),
+        migrations.RemoveField(
+            model_name='student',
+            name='face_encoding',
+        ),
+    ]
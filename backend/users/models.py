@@ -1,10 +1,13 @@
 """
 User models for EDURFID system.
 """
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.utils import timezone
 
+from utils.encoding_codec import pack_encoding, unpack_encoding
+
 
 class School(models.Model):
     """School model for managing school information."""
@@ -89,7 +92,7 @@ class Student(models.Model):
     is_active = models.BooleanField(default=True)
 
     # Face Recognition Fields
-    face_encoding = models.TextField(blank=True, null=True, help_text="Stored face encoding (JSON)")
+    face_encoding_data = models.BinaryField(blank=True, null=True, help_text="Packed face encoding (see utils.encoding_codec)")
     face_image = models.ImageField(upload_to='student_faces/', blank=True, null=True, help_text="Primary face image for recognition")
     face_images_count = models.IntegerField(default=0, help_text="Number of face images in dataset")
     is_face_enrolled = models.BooleanField(default=False, help_text="Whether face data is enrolled")
@@ -101,6 +104,14 @@ class Student(models.Model):
     def __str__(self):
         return f"{self.user.get_full_name()} - Grade {self.grade}"
 
+    def get_face_encoding(self):
+        """Decode the stored face encoding (float32 array) or return None."""
+        return unpack_encoding(self.face_encoding_data)
+
+    def set_face_encoding(self, encoding):
+        """Pack and store a face encoding (does not save)."""
+        self.face_encoding_data = pack_encoding(encoding, getattr(settings, 'FACE_ENCODING_STORAGE', 'float32'))
+
 
 class RFIDCard(models.Model):
     """RFID Card model for managing student cards."""
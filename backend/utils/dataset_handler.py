@@ -1,13 +1,22 @@
 """
-Dataset handler for processing ZIP file uploads and extracting face images.
+Dataset handler for processing ZIP file uploads of student face images.
+
+Uploads are streamed: ZIP members are read into memory one at a time
+(within member-count and size limits), validated and encoded in a process
+pool, and only accepted images are written, once, by the caller. Nothing
+is extracted to disk.
 """
 import os
+import hashlib
 import zipfile
-import shutil
 import logging
-from typing import List, Dict, Tuple
-from pathlib import Path
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from pathlib import Path, PurePosixPath
 from PIL import Image
+from django.conf import settings
+
+from utils.face_recognition_utils import inspect_for_training, training_pool
 
 # Try to import face_recognition, but make it optional
 try:
@@ -19,86 +28,132 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp'}
+
+
+class DatasetError(ValueError):
+    """The uploaded dataset cannot be processed (bad ZIP, limits exceeded)."""
+
 
 class DatasetHandler:
-    """Handle dataset ZIP file uploads and extraction."""
+    """Handle dataset ZIP file uploads."""
+    
+    def __init__(self):
+        """Initialize Dataset Handler with the DATASET_* limits."""
+        self.max_members = getattr(settings, 'DATASET_MAX_MEMBERS', 5000)
+        self.max_total_bytes = getattr(settings, 'DATASET_MAX_UNCOMPRESSED_BYTES', 512 * 1024 * 1024)
+        self.max_image_bytes = getattr(settings, 'DATASET_MAX_IMAGE_BYTES', 10 * 1024 * 1024)
     
-    def __init__(self, upload_dir: str = None, extract_dir: str = None):
+    def list_image_members(self, archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
         """
-        Initialize Dataset Handler.
+        Select the image members of a ZIP and check them against the dataset limits
+        before anything is decompressed.
         
         Args:
-            upload_dir: Directory to store uploaded ZIP files
-            extract_dir: Directory to extract datasets
+            archive: Open ZIP file
+            
+        Returns:
+            Image members in archive order (directories, macOS metadata and other files skipped)
+            
+        Raises:
+            DatasetError: Too many images, or declared sizes over the limits
         """
-        base_dir = os.path.dirname(os.path.dirname(__file__))
-        self.upload_dir = upload_dir or os.path.join(base_dir, 'media', 'dataset_uploads')
-        self.extract_dir = extract_dir or os.path.join(base_dir, 'media', 'datasets')
+        members = []
+        for member in archive.infolist():
+            path = Path(member.filename)
+            if member.is_dir() or path.suffix.lower() not in IMAGE_EXTENSIONS:
+                continue
+            if '__MACOSX' in path.parts or path.name.startswith('._'):
+                continue
+            members.append(member)
         
-        os.makedirs(self.upload_dir, exist_ok=True)
-        os.makedirs(self.extract_dir, exist_ok=True)
+        if len(members) > self.max_members:
+            raise DatasetError(f"Dataset has {len(members)} images; the limit is {self.max_members}")
+        total = sum(member.file_size for member in members)
+        if total > self.max_total_bytes:
+            raise DatasetError(f"Dataset expands to {total} bytes; the limit is {self.max_total_bytes}")
+        return members
     
-    def extract_zip(self, zip_path: str, extract_to: str = None) -> Tuple[bool, str, List[str], str]:
+    def _student_paths(self, members: List[zipfile.ZipInfo],
+                       accept_student: Callable[[str], bool] = None) -> List[str]:
         """
-        Extract ZIP file and return list of image files.
-        Handles nested folder structures automatically.
+        Member paths to parse student IDs from, without a single top-level folder
+        that wraps the whole dataset (a ZIP made from 'dataset/STU001/...'), which
+        would otherwise be taken for the student ID of every image.
+        
+        The common folder is kept when it names an accepted student (the ZIP holds
+        one student's folder) or, without accept_student, when images sit directly
+        in it (STU001/photo.jpg).
         
         Args:
-            zip_path: Path to ZIP file
-            extract_to: Directory to extract to (optional)
+            members: Image members of the archive
+            accept_student: Optional callable(student_id) -> bool
             
         Returns:
-            Tuple of (success, message, list of extracted image paths)
+            One path per member, relative to the wrapping folder if there is one
         """
-        try:
-            extract_to = extract_to or self.extract_dir
-            
-            # Create unique extraction directory
-            zip_name = Path(zip_path).stem
-            extract_path = os.path.join(extract_to, zip_name)
-            
-            # Remove existing extraction if exists
-            if os.path.exists(extract_path):
-                shutil.rmtree(extract_path)
-            
-            os.makedirs(extract_path, exist_ok=True)
-            
-            # Extract ZIP
-            logger.info(f"Extracting ZIP file: {zip_path}")
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_path)
-            
-            logger.info(f"ZIP extracted to: {extract_path}")
-            
-            # Find all image files (handles nested folders automatically)
-            image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp'}
-            image_files = []
-            
-            for root, dirs, files in os.walk(extract_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if Path(file).suffix.lower() in image_extensions:
-                        image_files.append(file_path)
-                        logger.debug(f"Found image: {file_path}")
-            
-            logger.info(f"Extracted {len(image_files)} images from {zip_path} (including nested folders)")
-            if len(image_files) == 0:
-                logger.warning(f"No images found in ZIP file. Check folder structure.")
-            return True, f"Extracted {len(image_files)} images", image_files, extract_path
+        parts = [PurePosixPath(member.filename).parts for member in members]
+        names = [member.filename for member in members]
+        if not parts or any(len(p) < 2 for p in parts) or len({p[0] for p in parts}) != 1:
+            return names
+        root = parts[0][0]
+        if accept_student is not None:
+            if accept_student(root.strip().upper().replace(' ', '_')):
+                return names
+        elif all(len(p) == 2 for p in parts):
+            return names
+        return ['/'.join(p[1:]) for p in parts]
+    
+    def read_member(self, archive: zipfile.ZipFile, member: zipfile.ZipInfo) -> Optional[bytes]:
+        """
+        Read one member into memory, never more than max_image_bytes
+        (the declared size in the ZIP header is not trusted).
+        
+        Returns:
+            The member's bytes, or None if it is too large
+        """
+        if member.file_size > self.max_image_bytes:
+            return None
+        with archive.open(member) as stream:
+            data = stream.read(self.max_image_bytes + 1)
+        return data if len(data) <= self.max_image_bytes else None
+    
+    def inspect_image(self, image_path: str) -> Dict[str, any]:
+        """
+        Validate that an image file contains exactly one usable face, keeping
+        the face box and the training encoding computed along the way.
+        
+        Args:
+            image_path: Path to image file
             
-        except zipfile.BadZipFile:
-            error_msg = "Invalid ZIP file format"
-            logger.error(error_msg)
-            return False, error_msg, [], None
-        except Exception as e:
-            error_msg = f"Error extracting ZIP: {str(e)}"
-            logger.error(error_msg, exc_info=True)
-            return False, error_msg, [], None
+        Returns:
+            Dict with 'valid', 'message', 'encoding' and 'location'
+        """
+        if not os.path.exists(image_path):
+            return {'valid': False, 'message': "File not found", 'encoding': None, 'location': None}
+        return self._verdict(inspect_for_training(image_path))
+    
+    @staticmethod
+    def _verdict(inspection: Dict[str, any]) -> Dict[str, any]:
+        """Turn a FaceRecognitionEngine.inspect_training_image result into a validation verdict."""
+        verdict = {'valid': False, 'encoding': None, 'location': None, 'face_hash': None}
+        if inspection['error']:
+            verdict['message'] = f"Error validating image: {inspection['error']}"
+        elif inspection['face_count'] == 0:
+            verdict['message'] = "No face detected in image"
+        elif inspection['face_count'] > 1:
+            verdict['message'] = "Multiple faces detected (expected single face)"
+        elif inspection['encoding'] is None:
+            verdict['message'] = "Face detected but cannot be encoded"
+        else:
+            verdict.update(valid=True, message="Valid image with single face",
+                           encoding=inspection['encoding'], location=inspection['location'],
+                           face_hash=inspection.get('face_hash'))
+        return verdict
     
     def validate_image(self, image_path: str) -> Tuple[bool, str]:
         """
         Validate that an image file contains a face.
-        Uses CNN model for better face detection accuracy.
         
         Args:
             image_path: Path to image file
@@ -106,41 +161,8 @@ class DatasetHandler:
         Returns:
             Tuple of (is_valid, message)
         """
-        try:
-            # Check if file exists
-            if not os.path.exists(image_path):
-                return False, "File not found"
-            
-            # Try to load image
-            try:
-                image = face_recognition.load_image_file(image_path)
-            except Exception as e:
-                return False, f"Cannot load image: {str(e)}"
-            
-            if not FACE_RECOGNITION_AVAILABLE:
-                return False, "face_recognition module not available"
-            
-            # Check for faces using CNN model for better accuracy
-            # Try CNN first, fallback to HOG if needed
-            face_locations = face_recognition.face_locations(image, model='cnn')
-            if len(face_locations) == 0:
-                # Fallback to HOG model
-                face_locations = face_recognition.face_locations(image, model='hog')
-            
-            if len(face_locations) == 0:
-                return False, "No face detected in image"
-            elif len(face_locations) > 1:
-                return False, "Multiple faces detected (expected single face)"
-            
-            # Additional validation: Try to encode the face to ensure it's usable
-            face_encodings = face_recognition.face_encodings(image, face_locations, model='large')
-            if len(face_encodings) == 0:
-                return False, "Face detected but cannot be encoded"
-            
-            return True, "Valid image with single face"
-            
-        except Exception as e:
-            return False, f"Error validating image: {str(e)}"
+        verdict = self.inspect_image(image_path)
+        return verdict['valid'], verdict['message']
     
     def parse_student_id_from_path(self, file_path: str, extract_base_path: str = None) -> str:
         """
@@ -266,63 +288,108 @@ class DatasetHandler:
         
         return student_images
     
-    def process_dataset(self, zip_path: str) -> Dict[str, any]:
+    def _inspect_stream(self, items: Iterator[Tuple[dict, Optional[bytes]]]) -> Iterator[Tuple[dict, Optional[bytes], Dict[str, any]]]:
+        """
+        Inspect in-memory images in a process pool of FACE_TRAINING_WORKERS processes,
+        keeping at most workers * FACE_TRAINING_CHUNK_SIZE images in flight.
+        Items without data are passed through uninspected.
+        
+        Yields:
+            (entry, data, verdict or None) in input order
         """
-        Process a dataset ZIP file: extract, validate, and organize images.
+        workers = getattr(settings, 'FACE_TRAINING_WORKERS', 0) or os.cpu_count() or 1
+        window = workers * max(1, getattr(settings, 'FACE_TRAINING_CHUNK_SIZE', 8))
+        
+        if workers <= 1:
+            for entry, data in items:
+                yield entry, data, self._verdict(inspect_for_training(image_bytes=data)) if data is not None else None
+            return
+        
+        pending = deque()
+        executor = training_pool(workers)
+        try:
+            for entry, data in items:
+                future = executor.submit(inspect_for_training, None, data) if data is not None else None
+                pending.append((entry, data, future))
+                while len(pending) > window or (pending and pending[0][2] is None):
+                    entry, data, future = pending.popleft()
+                    yield entry, data, self._verdict(future.result()) if future is not None else None
+            while pending:
+                entry, data, future = pending.popleft()
+                yield entry, data, self._verdict(future.result()) if future is not None else None
+        finally:
+            # Drop queued images if processing is abandoned (e.g. the job was cancelled)
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    def iter_dataset(self, zip_path: str, accept_student: Callable[[str], bool] = None,
+                     is_known: Callable[[str], bool] = None,
+                     progress_callback=None) -> Iterator[Dict[str, any]]:
+        """
+        Stream a dataset ZIP: read each image member into memory, parse its student ID
+        and validate/encode it, without extracting anything to disk.
         
         Args:
             zip_path: Path to uploaded ZIP file
-            
-        Returns:
-            Dict with processing results
+            accept_student: Optional callable(student_id) -> bool; images of rejected
+                students are reported as 'unmapped' without being validated
+            is_known: Optional callable(content_hash) -> bool; images already stored
+                are reported as 'duplicate' without being validated
+            progress_callback: Optional callable(done, total)
+            
+        Yields:
+            Dict per image member with 'name', 'student_id' and 'status' ('valid',
+            'invalid', 'duplicate', 'unmapped' or 'no_student_id'). Read members
+            carry 'content_hash' (SHA-256 of the bytes); valid entries also carry
+            'data', 'encoding', 'location' and 'face_hash', invalid ones 'error'.
+            A repeat of an earlier member of the same archive is a 'duplicate'.
+            
+        Raises:
+            DatasetError: Invalid ZIP or dataset limits exceeded
         """
         try:
-            # Extract ZIP
-            success, message, image_files, extract_path = self.extract_zip(zip_path)
-            if not success:
-                return {
-                    'success': False,
-                    'error': message,
-                    'valid_images': [],
-                    'invalid_images': [],
-                    'student_images': {},
-                    'extract_path': None
-                }
-            
-            # Validate and organize images
-            valid_images = []
-            invalid_images = []
-            
-            for image_path in image_files:
-                is_valid, msg = self.validate_image(image_path)
-                if is_valid:
-                    valid_images.append(image_path)
-                else:
-                    invalid_images.append({
-                        'path': os.path.basename(image_path),
-                        'error': msg
-                    })
-            
-            # Organize by student ID (pass extract_path for folder structure awareness)
-            student_images = self.organize_images_by_student(valid_images, extract_base_path=extract_path)
-            
-            return {
-                'success': True,
-                'message': f"Processed {len(valid_images)} valid images for {len(student_images)} students",
-                'total_images': len(image_files),
-                'valid_images': valid_images,
-                'invalid_images': invalid_images,
-                'student_images': student_images,
-                'extract_path': extract_path
-            }
-            
-        except Exception as e:
-            logger.error(f"Error processing dataset: {e}")
-            return {
-                'success': False,
-                'error': str(e),
-                'valid_images': [],
-                'invalid_images': [],
-                'student_images': {}
-            }
-
+            archive = zipfile.ZipFile(zip_path, 'r')
+        except zipfile.BadZipFile:
+            raise DatasetError("Invalid ZIP file format")
+        
+        with archive:
+            members = self.list_image_members(archive)
+            logger.info(f"Streaming {len(members)} images from {zip_path}")
+            if len(members) == 0:
+                logger.warning("No images found in ZIP file. Check folder structure.")
+            
+            seen_hashes = set()
+            student_paths = self._student_paths(members, accept_student)
+            
+            def read_members():
+                for member, student_path in zip(members, student_paths):
+                    student_id = self.parse_student_id_from_path(student_path, extract_base_path='.')
+                    student_id = student_id.strip().upper() if student_id else None
+                    entry = {'name': member.filename, 'student_id': student_id}
+                    if student_id is None:
+                        entry['status'] = 'no_student_id'
+                        yield entry, None
+                    elif accept_student is not None and not accept_student(student_id):
+                        entry['status'] = 'unmapped'
+                        yield entry, None
+                    else:
+                        data = self.read_member(archive, member)
+                        if data is None:
+                            entry.update(status='invalid', error=f"Image larger than {self.max_image_bytes} bytes")
+                        else:
+                            entry['content_hash'] = content_hash = hashlib.sha256(data).hexdigest()
+                            if content_hash in seen_hashes or (is_known is not None and is_known(content_hash)):
+                                entry['status'] = 'duplicate'
+                                data = None
+                            seen_hashes.add(content_hash)
+                        yield entry, data
+            
+            for done, (entry, data, verdict) in enumerate(self._inspect_stream(read_members()), start=1):
+                if verdict is not None:
+                    if verdict['valid']:
+                        entry.update(status='valid', data=data, encoding=verdict['encoding'],
+                                     location=verdict['location'], face_hash=verdict['face_hash'])
+                    else:
+                        entry.update(status='invalid', error=verdict['message'])
+                if progress_callback:
+                    progress_callback(done, len(members))
+                yield entry
@@ -0,0 +1,95 @@
+"""
+Compact binary codec for 128-d face encodings stored in the database.
+
+Formats are identified by blob length, so no extra column is needed:
+- float32: 512 bytes, lossless
+- float16: 256 bytes
+- int8:    132 bytes (little-endian float32 scale followed by 128 int8 values)
+"""
+from typing import Iterable, Optional
+
+import numpy as np
+
+ENCODING_DIM = 128
+
+FORMAT_SIZES = {
+    'float32': ENCODING_DIM * 4,
+    'float16': ENCODING_DIM * 2,
+    'int8': 4 + ENCODING_DIM,
+}
+_FORMATS_BY_SIZE = {size: fmt for fmt, size in FORMAT_SIZES.items()}
+
+
+def pack_encoding(encoding, fmt: str = 'float32') -> bytes:
+    """
+    Pack a face encoding into bytes.
+
+    Args:
+        encoding: 128-d vector (array or list)
+        fmt: 'float32', 'float16' or 'int8'
+
+    Returns:
+        Packed bytes
+    """
+    vector = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+    if fmt == 'float32':
+        return vector.astype('<f4').tobytes()
+    if fmt == 'float16':
+        return vector.astype('<f2').tobytes()
+    if fmt == 'int8':
+        scale = float(np.abs(vector).max()) / 127.0 or 1.0
+        quantized = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return np.float32(scale).astype('<f4').tobytes() + quantized.tobytes()
+    raise ValueError(f"Unknown encoding format: {fmt}")
+
+
+def unpack_encoding(blob: Optional[bytes], out: np.ndarray = None) -> Optional[np.ndarray]:
+    """
+    Decode a packed encoding with np.frombuffer.
+
+    Args:
+        blob: Packed bytes (bytes, bytearray or memoryview)
+        out: Optional float32 row to decode into (e.g. a gallery matrix row)
+
+    Returns:
+        float32 vector (or `out`), or None for empty/unknown blobs
+    """
+    if not blob:
+        return None
+    fmt = _FORMATS_BY_SIZE.get(len(blob))
+    if fmt is None:
+        return None
+    if out is None:
+        out = np.empty(ENCODING_DIM, dtype=np.float32)
+    if fmt == 'float32':
+        out[:] = np.frombuffer(blob, dtype='<f4')
+    elif fmt == 'float16':
+        out[:] = np.frombuffer(blob, dtype='<f2')
+    else:
+        scale = np.frombuffer(blob, dtype='<f4', count=1)[0]
+        np.multiply(np.frombuffer(blob, dtype=np.int8, offset=4), scale, out=out)
+    return out
+
+
+def unpack_many(blobs: Iterable[bytes]) -> np.ndarray:
+    """
+    Decode many packed encodings into one (N, 128) float32 matrix.
+    Uniform float32/float16 batches are decoded with a single np.frombuffer.
+
+    Args:
+        blobs: Packed encodings (all must be valid)
+
+    Returns:
+        (N, 128) float32 matrix
+    """
+    blobs = [bytes(blob) for blob in blobs]
+    sizes = {len(blob) for blob in blobs}
+    if len(sizes) == 1 and sizes <= {FORMAT_SIZES['float32'], FORMAT_SIZES['float16']}:
+        dtype = '<f4' if sizes == {FORMAT_SIZES['float32']} else '<f2'
+        return np.frombuffer(b''.join(blobs), dtype=dtype).reshape(len(blobs), ENCODING_DIM).astype(np.float32)
+
+    matrix = np.empty((len(blobs), ENCODING_DIM), dtype=np.float32)
+    for row, blob in enumerate(blobs):
+        if unpack_encoding(blob, out=matrix[row]) is None:
+            raise ValueError(f"Invalid packed encoding of {len(blob)} bytes at row {row}")
+    return matrix
@@ -0,0 +1,187 @@
+"""
+Two-stage face detection.
+
+Stage 1 proposes face regions cheaply: an OpenCV Haar cascade on a small
+grayscale copy of the frame ('haar'), or dlib HOG on a 4x-downscaled copy
+('hog'). Stage 2 runs dlib HOG at full resolution only inside the proposed
+regions. Frames without a proposal are rejected without running dlib at all.
+"""
+import os
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    import face_recognition
+except ImportError:
+    face_recognition = None
+
+logger = logging.getLogger('attendance')
+
+PROPOSERS = ('haar', 'hog')
+
+# Downscale factor of the frame the 'hog' proposer runs on
+HOG_PROPOSAL_DOWNSCALE = 4
+
+Location = Tuple[int, int, int, int]  # (top, right, bottom, left), face_recognition order
+
+
+class CascadeFaceDetector:
+    """Cheap region proposals refined by dlib HOG inside each region."""
+
+    def __init__(self, proposer: str = 'haar', proposal_max_dimension: int = 320,
+                 roi_margin: float = 0.3, cascade_path: str = None):
+        """
+        Initialize the detector.
+
+        Args:
+            proposer: 'haar' (OpenCV Haar cascade) or 'hog' (dlib HOG on a downscaled frame)
+            proposal_max_dimension: Longest side of the frame the Haar cascade runs on
+            roi_margin: Fraction of the proposal size added on each side before refining
+            cascade_path: Haar cascade XML (default: the frontal-face cascade shipped with OpenCV)
+        """
+        if proposer not in PROPOSERS:
+            raise ValueError(f"Unknown face proposer '{proposer}' (expected one of {', '.join(PROPOSERS)})")
+        self.proposer = proposer
+        self.proposal_max_dimension = proposal_max_dimension
+        self.roi_margin = roi_margin
+        if cascade_path is None and cv2 is not None:
+            cascade_path = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+        self.cascade_path = cascade_path
+        self._local = threading.local()
+
+    def _cascade(self):
+        """This thread's CascadeClassifier (instances are not thread-safe)."""
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(self.cascade_path)
+            if cascade.empty():
+                raise RuntimeError(f"Could not load Haar cascade from {self.cascade_path}")
+            self._local.cascade = cascade
+        return cascade
+
+    def propose(self, rgb: np.ndarray) -> List[Location]:
+        """
+        Propose face regions in full-frame coordinates.
+
+        Args:
+            rgb: RGB image array
+
+        Returns:
+            List of (top, right, bottom, left) boxes
+        """
+        height, width = rgb.shape[:2]
+        if self.proposer == 'hog':
+            small = rgb[::HOG_PROPOSAL_DOWNSCALE, ::HOG_PROPOSAL_DOWNSCALE]
+            return [
+                (top * HOG_PROPOSAL_DOWNSCALE, right * HOG_PROPOSAL_DOWNSCALE,
+                 bottom * HOG_PROPOSAL_DOWNSCALE, left * HOG_PROPOSAL_DOWNSCALE)
+                for top, right, bottom, left in face_recognition.face_locations(np.ascontiguousarray(small), model='hog')
+            ]
+
+        scale = min(1.0, self.proposal_max_dimension / max(height, width))
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        if scale < 1.0:
+            gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        gray = cv2.equalizeHist(gray)
+        boxes = self._cascade().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(20, 20))
+        return [
+            (int(y / scale), int((x + w) / scale), int((y + h) / scale), int(x / scale))
+            for x, y, w, h in boxes
+        ]
+
+    def refine(self, rgb: np.ndarray, proposals: List[Location]) -> List[Location]:
+        """
+        Run dlib HOG inside each (padded) proposal.
+
+        Args:
+            rgb: RGB image array
+            proposals: Boxes from propose()
+
+        Returns:
+            Confirmed face boxes in full-frame coordinates, largest first
+        """
+        height, width = rgb.shape[:2]
+        faces = []
+        for top, right, bottom, left in proposals:
+            margin_y = int((bottom - top) * self.roi_margin)
+            margin_x = int((right - left) * self.roi_margin)
+            y0, y1 = max(0, top - margin_y), min(height, bottom + margin_y)
+            x0, x1 = max(0, left - margin_x), min(width, right + margin_x)
+            if y1 <= y0 or x1 <= x0:
+                continue
+            for t, r, b, l in face_recognition.face_locations(np.ascontiguousarray(rgb[y0:y1, x0:x1]), model='hog'):
+                face = (t + y0, r + x0, b + y0, l + x0)
+                if not any(_contains(kept, face) for kept in faces):
+                    faces.append(face)
+        faces.sort(key=lambda f: (f[2] - f[0]) * (f[1] - f[3]), reverse=True)
+        return faces
+
+    def locate(self, rgb: np.ndarray, fallback: bool = False) -> List[Location]:
+        """
+        Find faces: proposals first, dlib only inside them.
+
+        Args:
+            rgb: RGB image array
+            fallback: Run full-frame dlib HOG if the cascade finds nothing
+                (for enrolment images, where a miss costs more than the time)
+
+        Returns:
+            List of (top, right, bottom, left) boxes, largest first
+        """
+        faces = self.refine(rgb, self.propose(rgb))
+        if not faces and fallback:
+            faces = face_recognition.face_locations(rgb, model='hog')
+        return faces
+
+
+def _contains(box: Location, other: Location) -> bool:
+    """Whether the centre of `other` lies inside `box` (duplicate detection from overlapping ROIs)."""
+    top, right, bottom, left = box
+    cy, cx = (other[0] + other[2]) / 2, (other[1] + other[3]) / 2
+    return top <= cy <= bottom and left <= cx <= right
+
+
+_detector = None
+_detector_lock = threading.Lock()
+
+
+def get_face_detector() -> Optional[CascadeFaceDetector]:
+    """The process-wide cascade detector, or None when FACE_DETECTOR is 'hog'."""
+    global _detector
+    from django.conf import settings
+    if getattr(settings, 'FACE_DETECTOR', 'cascade') != 'cascade':
+        return None
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = CascadeFaceDetector(
+                    proposer=getattr(settings, 'FACE_CASCADE_PROPOSER', 'haar'),
+                    proposal_max_dimension=getattr(settings, 'FACE_CASCADE_MAX_DIMENSION', 320),
+                    cascade_path=getattr(settings, 'FACE_HAAR_CASCADE_PATH', None) or None,
+                )
+    return _detector
+
+
+def locate_faces(rgb: np.ndarray, fallback: bool = False) -> List[Location]:
+    """
+    Locate faces with the configured detector (FACE_DETECTOR setting).
+
+    Args:
+        rgb: RGB image array
+        fallback: With the cascade detector, fall back to full-frame HOG when nothing is proposed
+
+    Returns:
+        List of (top, right, bottom, left) boxes
+    """
+    detector = get_face_detector()
+    if detector is None:
+        return face_recognition.face_locations(rgb, model='hog')
+    return detector.locate(rgb, fallback=fallback)
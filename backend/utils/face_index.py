@@ -0,0 +1,523 @@
+"""
+Gallery index structures for face encoding lookups.
+Provides an exact flat index and an IVF (k-means coarse quantizer) index
+for approximate nearest-neighbour search over large galleries.
+"""
+import copy
+import os
+import logging
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger('attendance')
+
+# Rows processed per block when assigning large matrices to centroids
+ASSIGN_CHUNK_SIZE = 4096
+
+
+def squared_norms(matrix: np.ndarray) -> np.ndarray:
+    """Row-wise squared L2 norms of a 2-d matrix."""
+    return np.einsum('ij,ij->i', matrix, matrix)
+
+
+def pairwise_distances(probes: np.ndarray, gallery: np.ndarray, gallery_sq_norms: np.ndarray = None) -> np.ndarray:
+    """
+    Euclidean distances between probe rows and gallery rows.
+    Uses |g|^2 - 2 g.p + |p|^2 so the heavy lifting is one BLAS call.
+
+    Args:
+        probes: (M, D) or (D,) array of probe vectors
+        gallery: (N, D) float32 gallery matrix
+        gallery_sq_norms: Optional precomputed squared norms of gallery rows
+
+    Returns:
+        (M, N) float32 distance matrix
+    """
+    probes = np.ascontiguousarray(probes, dtype=np.float32).reshape(-1, gallery.shape[1])
+    if gallery_sq_norms is None:
+        gallery_sq_norms = squared_norms(gallery)
+    sq_dist = probes @ gallery.T
+    sq_dist *= -2.0
+    sq_dist += gallery_sq_norms[np.newaxis, :]
+    sq_dist += squared_norms(probes)[:, np.newaxis]
+    np.maximum(sq_dist, 0.0, out=sq_dist)
+    return np.sqrt(sq_dist, out=sq_dist)
+
+
+def top_k(distances: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k smallest distances, sorted ascending.
+
+    Args:
+        distances: 1-d distance array
+        k: Number of indices to return
+
+    Returns:
+        Array of indices
+    """
+    if k == 1 and len(distances) > 0:
+        return np.array([np.argmin(distances)])
+    if k >= len(distances):
+        return np.argsort(distances)
+    indices = np.argpartition(distances, k)[:k]
+    return indices[np.argsort(distances[indices])]
+
+
+def _assign(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Assign each row of data to its nearest centroid."""
+    centroid_norms = squared_norms(centroids)
+    assignments = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), ASSIGN_CHUNK_SIZE):
+        block = pairwise_distances(data[start:start + ASSIGN_CHUNK_SIZE], centroids, centroid_norms)
+        assignments[start:start + len(block)] = np.argmin(block, axis=1)
+    return assignments
+
+
+def kmeans(data: np.ndarray, k: int, n_iter: int = 20, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lloyd's k-means in NumPy.
+
+    Args:
+        data: (N, D) float32 matrix
+        k: Number of clusters (must be <= N)
+        n_iter: Maximum number of iterations
+        seed: Random seed for centroid initialisation
+
+    Returns:
+        Tuple of ((k, D) centroids, (N,) assignments)
+    """
+    rng = np.random.default_rng(seed)
+    centroids = np.array(data[rng.choice(len(data), k, replace=False)], dtype=np.float32)
+    assignments = _assign(data, centroids)
+    for _ in range(n_iter):
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=k)
+        non_empty = counts > 0
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[non_empty]
+        sums = np.add.reduceat(data[order], starts, axis=0)
+        centroids[non_empty] = sums / counts[non_empty, np.newaxis]
+        new_assignments = _assign(data, centroids)
+        if np.array_equal(new_assignments, assignments):
+            break
+        assignments = new_assignments
+    return centroids, assignments
+
+
+class FlatIndex:
+    """Exact brute-force index over the gallery matrix."""
+
+    index_type = 'flat'
+
+    def __init__(self):
+        self.gallery = np.empty((0, 0), dtype=np.float32)
+        self.sq_norms = np.empty(0, dtype=np.float32)
+        self.recall = None
+
+    def __len__(self) -> int:
+        return len(self.gallery)
+
+    def build(self, gallery: np.ndarray, sq_norms: np.ndarray = None):
+        """
+        Build the index over a gallery matrix.
+
+        Args:
+            gallery: (N, D) float32 gallery matrix (referenced, not copied)
+            sq_norms: Optional precomputed squared row norms
+        """
+        self.gallery = gallery
+        self.sq_norms = squared_norms(gallery) if sq_norms is None else sq_norms
+
+    def search(self, probe: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k gallery rows closest to a probe.
+
+        Args:
+            probe: 1-d probe vector
+            k: Number of neighbours to return
+
+        Returns:
+            Tuple of (gallery indices, distances), sorted by distance
+        """
+        distances = pairwise_distances(probe, self.gallery, self.sq_norms)[0]
+        indices = top_k(distances, k)
+        return indices, distances[indices]
+
+    def add(self, gallery: np.ndarray, sq_norms: np.ndarray):
+        """
+        Extend the index after rows were appended to the gallery.
+
+        Args:
+            gallery: The grown gallery matrix (existing rows unchanged)
+            sq_norms: Squared norms of all gallery rows
+        """
+        self.build(gallery, sq_norms)
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """Arrays needed to restore the index without rebuilding it."""
+        return {}
+
+    def set_state(self, gallery: np.ndarray, sq_norms: np.ndarray, state: Dict[str, np.ndarray]):
+        """Restore the index from persisted state."""
+        self.build(gallery, sq_norms)
+
+    def get_info(self) -> Dict[str, object]:
+        """Summary of the index configuration."""
+        return {'type': self.index_type, 'size': len(self), 'recall': self.recall}
+
+
+class IVFIndex(FlatIndex):
+    """
+    Inverted-file index with a k-means coarse quantizer.
+    Each gallery row is filed under its nearest centroid; a search only scans
+    the rows filed under the `nprobe` centroids closest to the probe.
+    """
+
+    index_type = 'ivf'
+
+    def __init__(self, nlist: int = 0, nprobe: int = 8, n_iter: int = 20, seed: int = 0):
+        """
+        Initialize IVF index.
+
+        Args:
+            nlist: Number of coarse cells (0 = sqrt of gallery size)
+            nprobe: Number of cells scanned per search
+            n_iter: k-means iterations used when building
+            seed: Random seed for k-means initialisation
+        """
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.seed = seed
+        self.centroids = np.empty((0, 0), dtype=np.float32)
+        self.list_offsets = np.zeros(1, dtype=np.int64)
+        self.list_members = np.empty(0, dtype=np.int64)
+        self.assignments = np.empty(0, dtype=np.int64)
+
+    def build(self, gallery: np.ndarray, sq_norms: np.ndarray = None):
+        super().build(gallery, sq_norms)
+        if len(gallery) == 0:
+            self.centroids = np.empty((0, gallery.shape[1]), dtype=np.float32)
+            self.list_offsets = np.zeros(1, dtype=np.int64)
+            self.list_members = np.empty(0, dtype=np.int64)
+            self.assignments = np.empty(0, dtype=np.int64)
+            return
+
+        nlist = self.nlist or int(round(np.sqrt(len(gallery))))
+        nlist = max(1, min(nlist, len(gallery)))
+        self.centroids, assignments = kmeans(gallery, nlist, n_iter=self.n_iter, seed=self.seed)
+        self._set_lists(assignments)
+        logger.info(f"Built IVF index: {len(gallery)} encodings in {nlist} cells (nprobe={self.nprobe})")
+
+    def add(self, gallery: np.ndarray, sq_norms: np.ndarray):
+        """
+        File appended rows under their nearest existing centroid: no re-clustering,
+        and the inverted lists are extended rather than re-sorted. Existing arrays
+        are replaced, not modified, so a shallow copy of the index is unaffected.
+        """
+        start = len(self.gallery)
+        if len(self.centroids) == 0:
+            self.build(gallery, sq_norms)
+            return
+        FlatIndex.build(self, gallery, sq_norms)
+        new_assignments = _assign(gallery[start:], self.centroids)
+        order = np.argsort(new_assignments, kind='stable')
+        # Each new row goes at the end of its cell's run
+        self.list_members = np.insert(self.list_members, self.list_offsets[new_assignments[order] + 1], start + order)
+        counts = np.bincount(new_assignments, minlength=len(self.centroids))
+        self.list_offsets = self.list_offsets + np.concatenate(([0], np.cumsum(counts)))
+        self.assignments = np.concatenate([self.assignments, new_assignments])
+
+    def _set_lists(self, assignments: np.ndarray):
+        """Store inverted lists as a CSR-style (offsets, members) pair."""
+        self.assignments = assignments
+        counts = np.bincount(assignments, minlength=len(self.centroids))
+        self.list_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.list_members = np.argsort(assignments, kind='stable').astype(np.int64)
+
+    def search(self, probe: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        centroid_distances = pairwise_distances(probe, self.centroids)[0]
+        cells = top_k(centroid_distances, min(self.nprobe, len(self.centroids)))
+        candidates = np.concatenate(
+            [self.list_members[self.list_offsets[c]:self.list_offsets[c + 1]] for c in cells]
+        ) if len(cells) else np.empty(0, dtype=np.int64)
+
+        if len(candidates) == 0:
+            # Probed cells are empty (degenerate clustering) - fall back to exact scan
+            return super().search(probe, k)
+
+        distances = pairwise_distances(probe, self.gallery[candidates], self.sq_norms[candidates])[0]
+        best = top_k(distances, k)
+        return candidates[best], distances[best]
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        return {
+            'centroids': self.centroids,
+            'list_offsets': self.list_offsets,
+            'list_members': self.list_members,
+        }
+
+    def set_state(self, gallery: np.ndarray, sq_norms: np.ndarray, state: Dict[str, np.ndarray]):
+        FlatIndex.build(self, gallery, sq_norms)
+        self.centroids = np.ascontiguousarray(state['centroids'], dtype=np.float32)
+        self.list_offsets = np.asarray(state['list_offsets'], dtype=np.int64)
+        self.list_members = np.asarray(state['list_members'], dtype=np.int64)
+        self.assignments = np.empty(len(self.list_members), dtype=np.int64)
+        self.assignments[self.list_members] = np.repeat(np.arange(len(self.centroids)), np.diff(self.list_offsets))
+
+    def get_info(self) -> Dict[str, object]:
+        info = super().get_info()
+        info.update({'nlist': len(self.centroids), 'nprobe': self.nprobe})
+        return info
+
+
+class StudentCentroids:
+    """
+    Per-student representative vectors used to shortlist students before
+    exact re-ranking against their individual encodings.
+    Modes: 'mean' (one centroid), 'medoid' (most central real encoding) or
+    'kmeans' (up to `per_student` sub-centroids per student).
+    """
+
+    MODES = ('mean', 'medoid', 'kmeans')
+
+    def __init__(self, mode: str = 'mean', per_student: int = 3, seed: int = 0):
+        """
+        Initialize student centroid table.
+
+        Args:
+            mode: One of MODES (unknown modes fall back to 'mean')
+            per_student: Sub-centroids per student in 'kmeans' mode
+            seed: Random seed for k-means initialisation
+        """
+        if mode not in self.MODES:
+            logger.warning(f"Unknown face centroid mode '{mode}', using 'mean'")
+            mode = 'mean'
+        self.mode = mode
+        self.per_student = max(1, per_student)
+        self.seed = seed
+        self.centroids = np.empty((0, 0), dtype=np.float32)
+        self.sq_norms = np.empty(0, dtype=np.float32)
+        self.owners = np.empty(0, dtype=np.int64)
+        self.row_offsets = np.zeros(1, dtype=np.int64)
+        self.row_members = np.empty(0, dtype=np.int64)
+        self.student_count = 0
+
+    def build(self, gallery: np.ndarray, row_labels: np.ndarray):
+        """
+        Compute representatives for every student.
+
+        Args:
+            gallery: (N, D) float32 gallery matrix
+            row_labels: (N,) student index (0..S-1) of each gallery row
+        """
+        self.student_count = int(row_labels.max()) + 1 if len(row_labels) else 0
+        counts = np.bincount(row_labels, minlength=self.student_count)
+        self.row_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.row_members = np.argsort(row_labels, kind='stable').astype(np.int64)
+
+        if self.student_count == 0:
+            self.centroids = np.empty((0, gallery.shape[1]), dtype=np.float32)
+            self.owners = np.empty(0, dtype=np.int64)
+        elif self.mode == 'mean':
+            sums = np.add.reduceat(gallery[self.row_members], self.row_offsets[:-1], axis=0)
+            self.centroids = sums / counts[:, np.newaxis]
+            self.owners = np.arange(self.student_count, dtype=np.int64)
+        else:
+            representatives = []
+            owners = []
+            for student in range(self.student_count):
+                rep = self._representatives(gallery[self.rows_for([student])])
+                representatives.append(rep)
+                owners.extend([student] * len(rep))
+            self.centroids = np.concatenate(representatives)
+            self.owners = np.asarray(owners, dtype=np.int64)
+
+        self.centroids = np.ascontiguousarray(self.centroids, dtype=np.float32)
+        self.sq_norms = squared_norms(self.centroids)
+
+    def _representatives(self, rows: np.ndarray) -> np.ndarray:
+        """Representative vectors of one student's (R, D) encodings."""
+        if self.mode == 'mean':
+            return rows.mean(axis=0, keepdims=True)
+        if self.mode == 'medoid':
+            within = pairwise_distances(rows, rows)
+            return rows[[np.argmin(within.sum(axis=1))]]
+        rep, _ = kmeans(rows, min(self.per_student, len(rows)), seed=self.seed)
+        return rep
+
+    def with_rows(self, gallery: np.ndarray, student: int, rows: np.ndarray) -> 'StudentCentroids':
+        """
+        Copy of the table with gallery rows appended for one student, who may be
+        new. Only that student's representatives are recomputed; this table is
+        left unchanged, as the engine serving it may still be reading it.
+
+        Args:
+            gallery: (N, D) float32 gallery matrix including the appended rows
+            student: Student index of the appended rows
+            rows: Indices of the appended rows
+
+        Returns:
+            Updated StudentCentroids
+        """
+        updated = copy.copy(self)
+        student_count = max(self.student_count, student + 1)
+        offsets = np.concatenate([
+            self.row_offsets, np.full(student_count - self.student_count, self.row_offsets[-1], dtype=np.int64)
+        ])
+        updated.row_members = np.insert(self.row_members, offsets[student + 1], rows)
+        offsets[student + 1:] += len(rows)
+        updated.row_offsets = offsets
+        updated.student_count = student_count
+
+        rep = np.ascontiguousarray(
+            self._representatives(gallery[updated.rows_for([student])]), dtype=np.float32
+        )
+        # Representatives are stored grouped by student in ascending order
+        first, last = np.searchsorted(self.owners, [student, student + 1])
+        updated.centroids = np.concatenate([self.centroids[:first], rep, self.centroids[last:]])
+        updated.sq_norms = np.concatenate([self.sq_norms[:first], squared_norms(rep), self.sq_norms[last:]])
+        updated.owners = np.concatenate([
+            self.owners[:first], np.full(len(rep), student, dtype=np.int64), self.owners[last:]
+        ])
+        return updated
+
+    def shortlist(self, probe: np.ndarray, k: int) -> np.ndarray:
+        """
+        Rank students by distance from the probe to their nearest representative.
+
+        Args:
+            probe: 1-d probe vector
+            k: Number of students to return
+
+        Returns:
+            Array of student indices, closest first
+        """
+        distances = pairwise_distances(probe, self.centroids, self.sq_norms)[0]
+        if self.mode == 'mean':
+            per_student = distances
+        else:
+            # Representatives are stored grouped by student, so reduce each run
+            starts = np.flatnonzero(np.diff(self.owners, prepend=-1))
+            per_student = np.minimum.reduceat(distances, starts)
+        return top_k(per_student, k)
+
+    def rows_for(self, students) -> np.ndarray:
+        """Gallery row indices belonging to the given students."""
+        return np.concatenate(
+            [self.row_members[self.row_offsets[s]:self.row_offsets[s + 1]] for s in students]
+        ) if len(students) else np.empty(0, dtype=np.int64)
+
+
+INDEX_TYPES = {
+    FlatIndex.index_type: FlatIndex,
+    IVFIndex.index_type: IVFIndex,
+}
+
+
+def create_index(index_type: str = 'flat', **options) -> FlatIndex:
+    """
+    Create an empty index of the requested type.
+
+    Args:
+        index_type: One of INDEX_TYPES ('flat' or 'ivf')
+        **options: Extra constructor arguments (e.g. nlist, nprobe for 'ivf')
+
+    Returns:
+        Index instance (unknown types fall back to 'flat')
+    """
+    index_cls = INDEX_TYPES.get(index_type)
+    if index_cls is None:
+        logger.warning(f"Unknown face index type '{index_type}', using exact flat index")
+        return FlatIndex()
+    if index_cls is FlatIndex:
+        return FlatIndex()
+    return index_cls(**options)
+
+
+def save_index(index: FlatIndex, path: str, generation: str = ''):
+    """
+    Persist an index next to the model file.
+
+    Args:
+        index: Built index
+        path: Destination .npz path
+        generation: Gallery generation the index was built from
+    """
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, index_type=np.array(index.index_type), size=np.array(len(index)),
+                 generation=np.array(generation), recall=np.array(-1.0 if index.recall is None else index.recall),
+                 **index.get_state())
+    os.replace(tmp_path, path)
+
+
+def load_index(path: str, gallery: np.ndarray, sq_norms: np.ndarray, index_type: str,
+               generation: str = '', **options) -> Optional[FlatIndex]:
+    """
+    Load a persisted index if it matches the gallery and configured type.
+    An index saved for the same generation before rows were appended is
+    extended with the new rows instead of being rebuilt.
+
+    Args:
+        path: Path to .npz index file
+        gallery: Gallery matrix the index refers to
+        sq_norms: Squared norms of gallery rows
+        index_type: Expected index type
+        generation: Expected gallery generation
+        **options: Constructor arguments for the index
+
+    Returns:
+        Restored index, or None if missing or stale
+    """
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            size = int(data['size'])
+            if (str(data['index_type']) != index_type or size > len(gallery)
+                    or str(data['generation']) != generation):
+                return None
+            index = create_index(index_type, **options)
+            index.set_state(gallery[:size], sq_norms[:size], {key: data[key] for key in data.files})
+            if size < len(gallery):
+                index.add(gallery, sq_norms)
+            if 'recall' in data.files and float(data['recall']) >= 0:
+                index.recall = float(data['recall'])
+            return index
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Could not load face index from {path}: {e}")
+        return None
+
+
+def measure_recall(index: FlatIndex, sample_size: int = 200, k: int = 1, seed: int = 0) -> float:
+    """
+    Recall@k of an index against the exact scan, leave-one-out style:
+    sampled gallery rows are used as probes and their own row is excluded
+    from both result lists.
+
+    Args:
+        index: Built index to evaluate
+        sample_size: Number of gallery rows used as probes
+        k: Number of neighbours compared
+        seed: Random seed for sampling
+
+    Returns:
+        Fraction of exact neighbours also returned by the index (1.0 = exact)
+    """
+    gallery = index.gallery
+    if len(gallery) <= k:
+        return 1.0
+
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(gallery), min(sample_size, len(gallery)), replace=False)
+    exact = FlatIndex()
+    exact.build(gallery, index.sq_norms)
+
+    hits = 0
+    for row in sample:
+        expected = [i for i in exact.search(gallery[row], k + 1)[0] if i != row][:k]
+        found = set(i for i in index.search(gallery[row], k + 1)[0] if i != row)
+        hits += sum(1 for i in expected if i in found)
+    return hits / (len(sample) * k)
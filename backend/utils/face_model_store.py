@@ -0,0 +1,289 @@
+"""
+On-disk storage for trained face galleries.
+
+A gallery generation is stored as:
+- <name>.json             header (format version, counts, student-id table, file names)
+- <name>_<gen>.npy        (capacity, 128) float32 encoding matrix
+- <name>_<gen>_rows.npy   (capacity,) int32 row -> student-id-table index
+
+Only the first `count` rows are valid. The spare capacity lets enrolments
+append rows in place (readers never look past the `count` they loaded);
+removals and full retrains write a new, compacted generation.
+
+The matrices are opened with np.load(mmap_mode='r'), so every gunicorn
+worker shares the same page-cache pages instead of holding its own copy.
+Rows below a published `count` are never rewritten: each full save writes a
+new generation and then atomically replaces the header, so readers always
+see a complete set.
+"""
+import os
+import glob
+import json
+import pickle
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: model updates are only serialised within a process
+    fcntl = None
+
+logger = logging.getLogger('attendance')
+
+FORMAT_NAME = 'edurfid-face-gallery'
+FORMAT_VERSION = 1
+
+# Spare rows allocated on each full save so enrolments can append in place
+MIN_HEADROOM_ROWS = 64
+HEADROOM_FRACTION = 0.25
+
+
+def capacity_for(count: int) -> int:
+    """On-disk row capacity for a gallery of `count` rows."""
+    return count + max(MIN_HEADROOM_ROWS, int(count * HEADROOM_FRACTION))
+
+
+@contextmanager
+def model_lock(header_path: str):
+    """
+    Exclusive cross-process lock for modifying a gallery (advisory flock
+    on a sidecar .lock file).
+    """
+    with open(f"{header_path}.lock", 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _atomic_write_json(path: str, data: Dict[str, Any]):
+    """Write JSON to a temp file and move it into place."""
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _save_npy(path: str, array: np.ndarray):
+    """Write a .npy file and flush it to disk."""
+    with open(path, 'wb') as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def new_generation() -> str:
+    """Unique, sortable generation token for a gallery save."""
+    return f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{os.getpid()}"
+
+
+def header_stamp(header_path: str) -> Optional[Tuple[int, int, int]]:
+    """
+    Cheap change detector for a gallery header: (mtime_ns, inode, size).
+    Every save and append replaces the header file, so the stamp changes
+    whenever a new generation or revision is published.
+
+    Returns:
+        The stamp, or None if the header does not exist
+    """
+    try:
+        st = os.stat(header_path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_ino, st.st_size
+
+
+def write_gallery(header_path: str, gallery: np.ndarray, row_labels: np.ndarray,
+                  student_labels: List[str], extra: Dict[str, Any] = None,
+                  generation: str = None) -> Dict[str, Any]:
+    """
+    Write a new gallery generation and point the header at it.
+
+    Args:
+        header_path: Path to the JSON header (e.g. models/face_recognition_model.json)
+        gallery: (N, D) float32 encoding matrix
+        row_labels: (N,) index into student_labels for each row
+        student_labels: Distinct student IDs
+        extra: Additional header fields
+        generation: Generation token to use (default: a new one), so files
+            derived from the gallery can be written before it is published
+
+    Returns:
+        The header that was written
+    """
+    model_dir = os.path.dirname(header_path)
+    stem = os.path.splitext(os.path.basename(header_path))[0]
+    generation = generation or new_generation()
+    gallery_file = f"{stem}_{generation}.npy"
+    rows_file = f"{stem}_{generation}_rows.npy"
+    count = len(gallery)
+    capacity = capacity_for(count)
+
+    padded_gallery = np.zeros((capacity, gallery.shape[1]), dtype=np.float32)
+    padded_gallery[:count] = gallery
+    padded_rows = np.zeros(capacity, dtype=np.int32)
+    padded_rows[:count] = row_labels
+    _save_npy(os.path.join(model_dir, gallery_file), padded_gallery)
+    _save_npy(os.path.join(model_dir, rows_file), padded_rows)
+
+    header = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'generation': generation,
+        'revision': 0,
+        'dtype': 'float32',
+        'count': int(count),
+        'capacity': int(capacity),
+        'dim': int(gallery.shape[1]),
+        'gallery_file': gallery_file,
+        'rows_file': rows_file,
+        'student_ids': list(student_labels),
+        'trained_at': datetime.now().isoformat(),
+    }
+    header.update(extra or {})
+    _atomic_write_json(header_path, header)
+    remove_stale_generations(header_path, keep=generation)
+    return header
+
+
+def append_rows(header_path: str, header: Dict[str, Any], rows: np.ndarray, row_labels: np.ndarray,
+                student_labels: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Append rows to the current generation in place, if capacity allows.
+    Must be called under model_lock with the header currently on disk.
+
+    Args:
+        header_path: Path to the JSON header
+        header: Current header
+        rows: (K, D) float32 encodings to append
+        row_labels: (K,) student-id-table indices of the new rows
+        student_labels: Full (possibly extended) student-id table
+
+    Returns:
+        The updated header, or None if the generation has no room left
+    """
+    count = header['count']
+    if count + len(rows) > header.get('capacity', count):
+        return None
+
+    model_dir = os.path.dirname(header_path)
+    gallery = np.load(os.path.join(model_dir, header['gallery_file']), mmap_mode='r+')
+    gallery[count:count + len(rows)] = rows
+    gallery.flush()
+    labels = np.load(os.path.join(model_dir, header['rows_file']), mmap_mode='r+')
+    labels[count:count + len(rows)] = row_labels
+    labels.flush()
+    del gallery, labels
+
+    new_header = dict(header)
+    new_header.update({
+        'count': int(count + len(rows)),
+        'revision': header.get('revision', 0) + 1,
+        'student_ids': list(student_labels),
+        'updated_at': datetime.now().isoformat(),
+    })
+    _atomic_write_json(header_path, new_header)
+    return new_header
+
+
+def read_header(header_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Read and validate a gallery header.
+
+    Returns:
+        Header dict, or None if the file does not exist
+    """
+    if not os.path.exists(header_path):
+        return None
+    with open(header_path) as f:
+        header = json.load(f)
+    if header.get('format') != FORMAT_NAME:
+        raise ValueError(f"Not a face gallery header: {header_path}")
+    if header.get('version', 0) > FORMAT_VERSION:
+        raise ValueError(f"Unsupported face gallery version {header.get('version')} (max {FORMAT_VERSION})")
+    return header
+
+
+def read_gallery(header_path: str, mmap: bool = True) -> Optional[Tuple[Dict[str, Any], np.ndarray, np.ndarray]]:
+    """
+    Open the gallery generation referenced by a header.
+
+    Args:
+        header_path: Path to the JSON header
+        mmap: Memory-map the matrices read-only instead of reading them into memory
+
+    Returns:
+        Tuple of (header, gallery matrix, row labels) limited to the valid
+        `count` rows, or None if no header exists
+    """
+    header = read_header(header_path)
+    if header is None:
+        return None
+    model_dir = os.path.dirname(header_path)
+    mmap_mode = 'r' if mmap else None
+    if header.get('capacity', header['count']) == 0:
+        gallery = np.empty((0, header['dim']), dtype=np.float32)
+        row_labels = np.empty(0, dtype=np.int32)
+    else:
+        gallery = np.load(os.path.join(model_dir, header['gallery_file']), mmap_mode=mmap_mode)
+        row_labels = np.load(os.path.join(model_dir, header['rows_file']), mmap_mode=mmap_mode)
+    capacity = header.get('capacity', header['count'])
+    if gallery.shape != (capacity, header['dim']) or len(row_labels) != capacity:
+        raise ValueError(f"Face gallery files do not match header {header_path}")
+    return header, gallery[:header['count']], row_labels[:header['count']]
+
+
+def remove_stale_generations(header_path: str, keep: str):
+    """
+    Best-effort removal of data files from older generations.
+    Workers that still have an old generation mapped keep their pages
+    (POSIX); on platforms that refuse to delete mapped files the file is
+    left for the next save to clean up.
+    """
+    model_dir = os.path.dirname(header_path)
+    stem = os.path.splitext(os.path.basename(header_path))[0]
+    for path in glob.glob(os.path.join(model_dir, f"{stem}_*.npy")):
+        if keep in os.path.basename(path):
+            continue
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.debug(f"Could not remove stale gallery file {path}: {e}")
+
+
+def convert_pickle_model(pickle_path: str, header_path: str) -> Dict[str, Any]:
+    """
+    Convert a legacy pickled model ({'encodings': [...], 'student_ids': [...]})
+    into the binary gallery format.
+
+    Args:
+        pickle_path: Path to face_recognition_model.pkl
+        header_path: Destination JSON header path
+
+    Returns:
+        The header that was written
+    """
+    with open(pickle_path, 'rb') as f:
+        model_data = pickle.load(f)
+    encodings = model_data.get('encodings', [])
+    student_ids = [str(sid) for sid in model_data.get('student_ids', [])]
+    if len(encodings) != len(student_ids):
+        raise ValueError(f"Legacy model has {len(encodings)} encodings but {len(student_ids)} student IDs")
+
+    gallery = np.asarray(encodings, dtype=np.float32).reshape(len(encodings), -1) if encodings else np.empty((0, 128), dtype=np.float32)
+    labels, row_labels = np.unique(np.asarray(student_ids, dtype=str), return_inverse=True)
+    header = write_gallery(header_path, gallery, row_labels, labels.tolist(), extra={
+        'trained_at': model_data.get('trained_at', datetime.now().isoformat()),
+        'converted_from': os.path.basename(pickle_path),
+    })
+    logger.info(f"Converted legacy face model {pickle_path} ({len(gallery)} encodings) to {header_path}")
+    return header
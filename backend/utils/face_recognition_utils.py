@@ -2,18 +2,35 @@
 Face Recognition utilities for automated attendance system.
 Handles face detection, recognition, encoding, and model training.
 """
+import copy
+import multiprocessing
 import os
 import numpy as np
 from PIL import Image
 from typing import List, Dict, Tuple, Optional, Any
 import logging
-import pickle
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-import json
 from django.apps import apps
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 
+from utils.encoding_codec import FORMAT_SIZES, pack_encoding, unpack_many
+from utils.face_index import (
+    StudentCentroids, create_index, save_index, load_index, measure_recall, pairwise_distances, squared_norms
+)
+from utils.face_model_store import (
+    append_rows, convert_pickle_model, header_stamp, model_lock, new_generation, read_gallery, read_header,
+    write_gallery
+)
+from utils.face_detection import locate_faces
+from utils.image_preprocessing import ImagePreprocessor
+from utils.recognition_cache import RecognitionCache, face_hash
+
 try:
     import cv2
     import face_recognition
@@ -26,9 +43,29 @@ except ImportError:
 
 logger = logging.getLogger('attendance')
 
+# Dimensionality of dlib face encodings
+ENCODING_DIM = 128
+
+# Closest encodings of the matched student averaged into its confidence score
+CONFIDENCE_TOP_N = 3
+
+# Distance under which an encoding counts as already in the gallery; covers the
+# rounding of float16/int8 stored encodings, far below any two distinct images
+GALLERY_DUPLICATE_DISTANCE = 0.02
+
+# Encodings written back to StudentFaceImage per bulk_update during training
+CACHE_WRITE_BATCH_SIZE = 200
+
 
 class FaceRecognitionEngine:
-    """Face Recognition Engine for student attendance."""
+    """
+    Face Recognition Engine for student attendance.
+
+    An engine is not modified once get_face_engine serves it: gallery updates
+    (save_model, add_encodings, remove_student, replace_student, train_model)
+    are applied to a successor engine, which is then published with a single
+    reference swap. Requests holding the old engine finish on it unchanged.
+    """
     
     def __init__(self, model_dir: str = None):
         """
@@ -46,36 +83,415 @@ class FaceRecognitionEngine:
         
         os.makedirs(self.model_dir, exist_ok=True)
         
-        self.model_path = os.path.join(self.model_dir, 'face_recognition_model.pkl')
+        self.model_path = os.path.join(self.model_dir, 'face_recognition_model.json')
+        self.legacy_model_path = os.path.join(self.model_dir, 'face_recognition_model.pkl')
+        self.index_path = os.path.join(self.model_dir, 'face_recognition_index.npz')
         logger.info(f"Face Recognition Engine initialized. Model path: {self.model_path}")
-        self.known_face_encodings = []
-        self.known_face_student_ids = []
+        self.index = None
+        self.centroids = None
+        self.model_header = None
+        self.model_stamp = None
+        self.preprocessor = ImagePreprocessor(
+            max_dimension=getattr(settings, 'FACE_PREPROCESS_MAX_DIMENSION', 800),
+            clahe_mode=getattr(settings, 'FACE_CLAHE_MODE', 'full'),
+            clip_limit=getattr(settings, 'FACE_CLAHE_CLIP_LIMIT', 2.0),
+        )
+        self.result_cache = RecognitionCache(
+            max_entries=getattr(settings, 'FACE_RESULT_CACHE_SIZE', 256),
+            ttl=getattr(settings, 'FACE_RESULT_CACHE_TTL', 10),
+            max_distance=getattr(settings, 'FACE_RESULT_CACHE_MAX_DISTANCE', 5),
+        )
+        self._set_gallery([], [])
         self.is_loaded = False
+
+    @property
+    def known_face_encodings(self) -> np.ndarray:
+        """(N, 128) float32 view of the gallery matrix."""
+        return self._gallery[:self._gallery_size]
+
+    @property
+    def _gallery_sq_norms(self) -> np.ndarray:
+        """(N,) squared norms of the gallery rows."""
+        return self._sq_norms_buffer[:self._gallery_size]
+
+    @property
+    def _row_labels(self) -> np.ndarray:
+        """(N,) student-label index of each gallery row."""
+        return self._row_labels_buffer[:self._gallery_size]
+
+    @property
+    def known_face_student_ids(self) -> List[str]:
+        """Student ID of each gallery row."""
+        return [self._student_labels[i] for i in self._row_labels]
+
+    def _set_gallery(self, encodings: List, student_ids: List):
+        """
+        Pack encodings into one C-contiguous float32 gallery matrix.
+        
+        Args:
+            encodings: List (or array) of 128-d face encodings
+            student_ids: List of corresponding student IDs
+        """
+        count = len(encodings)
+        gallery = np.empty((count, ENCODING_DIM), dtype=np.float32)
+        if count:
+            gallery[:] = np.asarray(encodings, dtype=np.float32).reshape(count, ENCODING_DIM)
+        labels, row_labels = np.unique(np.asarray(list(student_ids), dtype=str), return_inverse=True)
+        self._set_gallery_arrays(gallery, row_labels, labels.tolist())
+
+    def _set_gallery_arrays(self, gallery: np.ndarray, row_labels: np.ndarray, student_labels: List[str]):
+        """
+        Install a packed gallery, which may be a read-only memory map.
+        Squared row norms are precomputed so matching is a single matrix product.
+        
+        Args:
+            gallery: (N, 128) float32 matrix
+            row_labels: (N,) index into student_labels for each row
+            student_labels: Distinct student IDs
+        """
+        self._gallery = gallery
+        self._gallery_size = len(gallery)
+        self._sq_norms_buffer = squared_norms(gallery)
+        self._row_labels_buffer = np.asarray(row_labels)
+        # Rows written into the buffers so far, shared with successors that reuse them
+        self._buffer_tail = [self._gallery_size]
+        self._student_labels = list(student_labels)
+        self._student_label_index = {sid: i for i, sid in enumerate(self._student_labels)}
+        self._group_rows()
+        self.index = None
+        self.centroids = None
+
+    def _group_rows(self):
+        """
+        Precompute how gallery rows group by student for _student_distances:
+        the stable sort order of the rows by label, the start of each
+        student's run in that order, and the label of each run.
+        """
+        row_labels = self._row_labels
+        if len(row_labels) == 0:
+            self._row_groups = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), row_labels)
+            return
+        order = np.argsort(row_labels, kind='stable')
+        sorted_labels = row_labels[order]
+        starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+        self._row_groups = (order, starts, sorted_labels[starts])
+
+    def _group_appended(self, label: int, start: int, count: int):
+        """
+        Add `count` rows appended at `start` for one student to the row grouping
+        without re-sorting the gallery. New arrays are built, since the engine
+        this one succeeded may still be reading the old ones.
+        """
+        order, starts, labels = self._row_groups
+        new_rows = np.arange(start, start + count, dtype=order.dtype)
+        group = int(np.searchsorted(labels, label))
+        if group < len(labels) and labels[group] == label:
+            end = starts[group + 1] if group + 1 < len(starts) else len(order)
+            order = np.insert(order, end, new_rows)
+            starts = starts.copy()
+            starts[group + 1:] += count
+        else:
+            # New students get the next label, so their run goes last
+            starts = np.append(starts, len(order))
+            order = np.concatenate([order, new_rows])
+            labels = np.append(labels, label)
+        self._row_groups = (order, starts, labels)
+
+    def _student_rows(self, label: int) -> np.ndarray:
+        """Gallery rows of one student (label index), from the _group_rows grouping."""
+        order, starts, labels = self._row_groups
+        group = int(np.searchsorted(labels, label))
+        end = starts[group + 1] if group + 1 < len(starts) else len(order)
+        return order[starts[group]:end]
+
+    def _reserve_rows(self, extra: int):
+        """
+        Make room for `extra` more rows in writable in-memory buffers.
+        Capacity doubles, so appends are amortised O(rows added). A
+        memory-mapped gallery is copied into private memory on first append.
+        Spare capacity is shared with the engine this one succeeded, which
+        only reads rows below its own size; it is reused only if no other
+        successor has written past that size already.
+        """
+        needed = self._gallery_size + extra
+        if (needed <= len(self._gallery) and self._gallery.flags.writeable
+                and self._buffer_tail[0] == self._gallery_size):
+            return
+        capacity = max(needed, 2 * len(self._gallery), 64)
+        size = self._gallery_size
+        
+        gallery = np.empty((capacity, ENCODING_DIM), dtype=np.float32)
+        gallery[:size] = self.known_face_encodings
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        sq_norms[:size] = self._gallery_sq_norms
+        row_labels = np.empty(capacity, dtype=np.int32)
+        row_labels[:size] = self._row_labels
+        self._gallery = gallery
+        self._sq_norms_buffer = sq_norms
+        self._row_labels_buffer = row_labels
+        self._buffer_tail = [size]
+
+    def _index_settings(self) -> Tuple[str, Dict[str, Any]]:
+        """Configured index type and constructor options (FACE_INDEX_* settings)."""
+        index_type = getattr(settings, 'FACE_INDEX_TYPE', 'flat')
+        options = {}
+        if index_type == 'ivf':
+            options = {
+                'nlist': getattr(settings, 'FACE_INDEX_NLIST', 0),
+                'nprobe': getattr(settings, 'FACE_INDEX_NPROBE', 8),
+            }
+        return index_type, options
+
+    def _build_index(self):
+        """Build the configured gallery index and report its recall against the exact scan."""
+        index_type, options = self._index_settings()
+        # Built to the side: a request racing a lazy build never sees a half-built index
+        index = create_index(index_type, **options)
+        index.build(self.known_face_encodings, self._gallery_sq_norms)
+        index.recall = 1.0 if index.index_type == 'flat' else measure_recall(index)
+        self.index = index
+        logger.info(f"Face index built: {index.get_info()} (recall@1 vs exact: {index.recall:.3f})")
+
+    def _build_centroids(self):
+        """Compute per-student centroids used by the prefilter (FACE_CENTROID_* settings)."""
+        centroids = StudentCentroids(
+            mode=getattr(settings, 'FACE_CENTROID_MODE', 'mean'),
+            per_student=getattr(settings, 'FACE_CENTROIDS_PER_STUDENT', 3),
+        )
+        centroids.build(self.known_face_encodings, self._row_labels)
+        self.centroids = centroids
+
+    def _load_index(self, persist: bool = True):
+        """
+        Load the persisted gallery index, rebuilding it if missing or stale.
+        A rebuilt index is saved under the model locks and only while this
+        gallery is still the published one, so a slow loader never replaces
+        the index of a newer generation or revision.
+
+        Args:
+            persist: Save a rebuilt index (False when the caller already holds the model locks)
+        """
+        index_type, options = self._index_settings()
+        self.index = load_index(
+            self.index_path, self.known_face_encodings, self._gallery_sq_norms, index_type,
+            generation=self._generation(), **options
+        )
+        if self.index is None:
+            self._build_index()
+            if persist:
+                with self._updating():
+                    if self._holds(read_header(self.model_path)):
+                        save_index(self.index, self.index_path, self._generation())
+
+    @contextmanager
+    def _updating(self):
+        """Serialize changes to the on-disk model across threads and processes."""
+        with _model_update_lock, model_lock(self.model_path):
+            yield
+
+    def _holds(self, header: Optional[Dict[str, Any]]) -> bool:
+        """Whether an on-disk header describes the gallery generation/revision held in memory."""
+        current = self.model_header or {}
+        return header is not None and (
+            (header.get('generation'), header.get('revision')) == (current.get('generation'), current.get('revision'))
+        )
+
+    def _generation(self) -> str:
+        """Generation token of the gallery currently held in memory."""
+        return self.model_header.get('generation', '') if self.model_header else ''
+
+    def model_version_key(self) -> str:
+        """'<generation>:<revision>' of the gallery held in memory ('' if none)."""
+        if not self.model_header:
+            return ''
+        return f"{self.model_header.get('generation', '')}:{self.model_header.get('revision', 0)}"
+
+    def is_stale(self) -> bool:
+        """
+        Whether a different gallery generation/revision has been published on disk.
+        Costs one stat() unless the header file changed.
+        """
+        stamp = header_stamp(self.model_path)
+        if stamp == self.model_stamp:
+            return False
+        header = read_header(self.model_path)
+        if self._holds(header):
+            # Our own write (or a no-op replace): remember the stamp
+            self.model_stamp = stamp
+            return False
+        return header is not None or os.path.exists(self.legacy_model_path)
+
+    def _gallery_distances(self, probes: np.ndarray) -> np.ndarray:
+        """
+        Exact Euclidean distances between probe encodings and every gallery encoding.
+        
+        Args:
+            probes: (M, 128) or (128,) array of probe encodings
+            
+        Returns:
+            (M, N) float32 distance matrix
+        """
+        return pairwise_distances(probes, self.known_face_encodings, self._gallery_sq_norms)
+
+    def _nearest_encodings(self, encoding: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k gallery rows closest to a probe encoding.
+        
+        Args:
+            encoding: 128-d probe encoding
+            k: Number of neighbours to return
+            
+        Returns:
+            Tuple of (gallery indices, distances), sorted by distance
+        """
+        if self.index is None:
+            self._build_index()
+        return self.index.search(encoding, k)
+
+    def _match_encoding(self, encoding: np.ndarray, tolerance: float) -> Dict[str, Any]:
+        """
+        Match a probe encoding against the gallery.
+        With FACE_PREFILTER_TOP_K set, students are shortlisted by centroid
+        distance first; otherwise the gallery index is searched directly.
+        
+        Args:
+            encoding: 128-d probe encoding
+            tolerance: Distance tolerance for face matching
+            
+        Returns:
+            Dict with 'student_id', 'distance', 'confidence', 'matched'
+        """
+        prefilter_top_k = getattr(settings, 'FACE_PREFILTER_TOP_K', 0)
+        if prefilter_top_k > 0:
+            label, best_distance = self._match_with_prefilter(encoding, prefilter_top_k)
+        else:
+            indices, distances = self._nearest_encodings(encoding, k=1)
+            label = int(self._row_labels[int(indices[0])])
+            best_distance = float(distances[0])
+        if best_distance > tolerance:
+            return {'student_id': None, 'distance': best_distance, 'confidence': 0.0, 'matched': False}
+
+        rows = self._student_rows(label)
+        student_distances = pairwise_distances(encoding, self.known_face_encodings[rows], self._gallery_sq_norms[rows])[0]
+        return self._match_result(student_distances, label, best_distance, tolerance)
+
+    def _match_with_prefilter(self, encoding: np.ndarray, top_k_students: int) -> Tuple[int, float]:
+        """
+        Shortlist students by centroid distance, then re-rank only their encodings.
+        
+        Args:
+            encoding: 128-d probe encoding
+            top_k_students: Number of students re-ranked exactly
+            
+        Returns:
+            Tuple of (student label index, best image distance)
+        """
+        if self.centroids is None:
+            self._build_centroids()
+        students = self.centroids.shortlist(encoding, top_k_students)
+        rows = self.centroids.rows_for(students)
+        distances = pairwise_distances(encoding, self.known_face_encodings[rows], self._gallery_sq_norms[rows])[0]
+        row_labels = self._row_labels[rows]
         
-    def load_model(self) -> bool:
+        best = int(np.argmin(distances))
+        return int(row_labels[best]), float(distances[best])
+
+    def load_model(self, persist_index: bool = True) -> bool:
         """
-        Load trained face recognition model from disk.
+        Load trained face recognition model from disk into this engine.
+        The gallery matrix is memory-mapped read-only so worker processes
+        share it. A legacy pickled model is converted on first load.
+        Only called on engines that are not being served yet (see get_face_engine).
         
+        Args:
+            persist_index: Save the index if it has to be rebuilt (see _load_index)
+            
         Returns:
             bool: True if model loaded successfully, False otherwise
         """
         try:
-            if os.path.exists(self.model_path):
-                with open(self.model_path, 'rb') as f:
-                    model_data = pickle.load(f)
-                    self.known_face_encodings = model_data.get('encodings', [])
-                    self.known_face_student_ids = model_data.get('student_ids', [])
-                    self.is_loaded = True
-                    logger.info(f"Loaded face recognition model with {len(self.known_face_encodings)} face encodings")
-                    return True
-            else:
+            if not os.path.exists(self.model_path) and os.path.exists(self.legacy_model_path):
+                logger.info(f"Converting legacy model {self.legacy_model_path} to binary gallery format")
+                convert_pickle_model(self.legacy_model_path, self.model_path)
+            
+            # Stamp before reading: a save racing with this load changes it again
+            self.model_stamp = header_stamp(self.model_path)
+            loaded = read_gallery(self.model_path, mmap=True)
+            if loaded is None:
                 logger.warning(f"Model file not found at {self.model_path}")
                 self.is_loaded = False
                 return False
+            
+            header, gallery, row_labels = loaded
+            self.model_header = header
+            self._set_gallery_arrays(gallery, row_labels, header['student_ids'])
+            self._load_index(persist=persist_index)
+            self.is_loaded = True
+            logger.info(f"Loaded face recognition model with {len(self.known_face_encodings)} face encodings (generation {header['generation']})")
+            return True
         except Exception as e:
             logger.error(f"Error loading face recognition model: {e}")
             self.is_loaded = False
             return False
+
+    def _successor(self) -> 'FaceRecognitionEngine':
+        """
+        New engine holding the current on-disk gallery, for an update to build on.
+        If this engine holds the published revision the successor shares its
+        arrays and index state (appends go into spare capacity, see
+        _reserve_rows); otherwise the published gallery is loaded.
+        Caller holds the model locks.
+        """
+        engine = FaceRecognitionEngine(self.model_dir)
+        header = read_header(self.model_path)
+        if header is None and not os.path.exists(self.legacy_model_path):
+            return engine
+        if not (self.is_loaded and self._holds(header)):
+            engine.load_model(persist_index=False)
+            return engine
+        
+        engine.model_header = self.model_header
+        engine.model_stamp = self.model_stamp
+        engine._gallery = self._gallery
+        engine._gallery_size = self._gallery_size
+        engine._sq_norms_buffer = self._sq_norms_buffer
+        engine._row_labels_buffer = self._row_labels_buffer
+        engine._buffer_tail = self._buffer_tail
+        engine._student_labels = list(self._student_labels)
+        engine._student_label_index = dict(self._student_label_index)
+        engine._row_groups = self._row_groups
+        # Index and centroid updates build new arrays, so sharing or shallow-copying leaves ours untouched
+        engine.index = copy.copy(self.index)
+        engine.centroids = self.centroids
+        engine.is_loaded = True
+        return engine
+
+    def _apply_update(self, update, action: str, from_scratch: bool = False) -> Optional['FaceRecognitionEngine']:
+        """
+        Apply `update(engine)` to a successor of this engine and publish the result.
+        
+        Args:
+            update: Callable modifying the successor in memory and on disk; returning False aborts
+            action: Description for error messages
+            from_scratch: Start from an empty engine instead of the current gallery
+            
+        Returns:
+            The published engine, or None if the update was aborted or failed
+        """
+        try:
+            with self._updating():
+                engine = FaceRecognitionEngine(self.model_dir) if from_scratch else self._successor()
+                if update(engine) is False:
+                    return None
+                engine.is_loaded = True
+                if getattr(settings, 'FACE_PREFILTER_TOP_K', 0) > 0 and engine.centroids is None:
+                    engine._build_centroids()
+                # Published while the locks are held, so updates go live in the order they were written
+                _publish_face_engine(engine)
+            return engine
+        except Exception as e:
+            logger.error(f"Error {action}: {e}")
+            return None
     
     def save_model(self, encodings: List, student_ids: List) -> bool:
         """
@@ -88,23 +504,156 @@ class FaceRecognitionEngine:
         Returns:
             bool: True if model saved successfully
         """
-        try:
-            model_data = {
-                'encodings': encodings,
-                'student_ids': student_ids,
-                'trained_at': datetime.now().isoformat(),
-                'count': len(encodings)
-            }
-            with open(self.model_path, 'wb') as f:
-                pickle.dump(model_data, f)
-            self.known_face_encodings = encodings
-            self.known_face_student_ids = student_ids
-            self.is_loaded = True
+        return self._save_gallery(encodings, student_ids) is not None
+
+    def _save_gallery(self, encodings: List, student_ids: List) -> Optional['FaceRecognitionEngine']:
+        """save_model, returning the published engine (None on failure)."""
+        def update(engine):
+            engine._set_gallery(encodings, student_ids)
+            engine._write_model()
+        
+        engine = self._apply_update(update, 'saving face recognition model', from_scratch=True)
+        if engine is not None:
             logger.info(f"Saved face recognition model with {len(encodings)} face encodings")
-            return True
-        except Exception as e:
-            logger.error(f"Error saving face recognition model: {e}")
+        return engine
+
+    def _write_model(self):
+        """
+        Write the in-memory gallery as a new generation and rebuild its index.
+        The index is saved before the header is published, so workers that
+        pick up the new generation load the index instead of rebuilding it.
+        """
+        generation = new_generation()
+        self._build_index()
+        save_index(self.index, self.index_path, generation)
+        self.model_header = write_gallery(
+            self.model_path, self.known_face_encodings, self._row_labels, self._student_labels,
+            generation=generation
+        )
+
+    def add_encodings(self, student_id: str, encodings: List[np.ndarray]) -> bool:
+        """
+        Append encodings for one student to the gallery and the on-disk model.
+        Rows are appended in place into the spare capacity of the current
+        generation; a new generation is written only when that capacity runs
+        out. Only the student's row group and centroids are updated, and the
+        index is extended with the new rows (see _append_rows).
+        
+        Args:
+            student_id: Student ID the encodings belong to
+            encodings: List of 128-d face encodings
+            
+        Returns:
+            bool: True if the model was updated (get_face_engine() returns the updated engine)
+        """
+        rows = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        if len(rows) == 0:
+            return False
+        engine = self._apply_update(lambda engine: engine._append_rows(student_id, rows), f"adding encodings for {student_id}")
+        if engine is None:
+            return False
+        logger.info(f"Added {len(rows)} encoding(s) for {student_id} (gallery size: {engine._gallery_size})")
+        return True
+
+    def _append_rows(self, student_id: str, rows: np.ndarray):
+        """Append rows in memory and on disk. Caller holds the model locks."""
+        label = self._student_label_index.get(student_id)
+        if label is None:
+            label = len(self._student_labels)
+            self._student_labels.append(student_id)
+            self._student_label_index[student_id] = label
+        row_labels = np.full(len(rows), label, dtype=np.int32)
+        
+        start = self._gallery_size
+        self._reserve_rows(len(rows))
+        self._gallery[start:start + len(rows)] = rows
+        self._sq_norms_buffer[start:start + len(rows)] = squared_norms(rows)
+        self._row_labels_buffer[start:start + len(rows)] = row_labels
+        self._gallery_size += len(rows)
+        self._buffer_tail[0] = self._gallery_size
+        self._group_appended(label, start, len(rows))
+        if self.centroids is not None:
+            self.centroids = self.centroids.with_rows(
+                self.known_face_encodings, label, np.arange(start, self._gallery_size)
+            )
+        
+        header = None
+        if self.model_header is not None:
+            header = append_rows(self.model_path, self.model_header, rows, row_labels, self._student_labels)
+        if header is None:
+            self._write_model()
+        else:
+            self.model_header = header
+            # An index not built yet is built on first search
+            if self.index is not None:
+                self.index.add(self.known_face_encodings, self._gallery_sq_norms)
+            # The saved index is not rewritten: it still matches this generation,
+            # and load_index files the appended rows into it on load
+
+    def remove_student(self, student_id: str) -> bool:
+        """
+        Remove all encodings of a student and compact the on-disk model
+        into a new generation.
+        
+        Args:
+            student_id: Student ID to remove
+            
+        Returns:
+            bool: True if the student was in the gallery and has been removed
+        """
+        def update(engine):
+            if not engine._remove_rows(student_id):
+                return False
+            engine._write_model()
+        
+        engine = self._apply_update(update, f"removing {student_id} from face gallery")
+        if engine is None:
+            return False
+        logger.info(f"Removed {student_id} from face gallery (gallery size: {engine._gallery_size})")
+        return True
+
+    def replace_student(self, student_id: str, encodings: List[np.ndarray]) -> bool:
+        """
+        Replace all encodings of a student in one compaction.
+        
+        Args:
+            student_id: Student ID to update
+            encodings: New list of 128-d face encodings (empty removes the student)
+            
+        Returns:
+            bool: True if the model was updated
+        """
+        rows = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        
+        def update(engine):
+            if student_id not in engine._student_label_index:
+                if len(rows) == 0:
+                    return False
+                engine._append_rows(student_id, rows)
+                return True
+            engine._remove_rows(student_id)
+            if len(rows):
+                encodings_all = np.concatenate([engine.known_face_encodings, rows])
+                student_ids = engine.known_face_student_ids + [student_id] * len(rows)
+                engine._set_gallery(encodings_all, student_ids)
+            engine._write_model()
+        
+        if self._apply_update(update, f"replacing encodings for {student_id}") is None:
             return False
+        logger.info(f"Replaced encodings for {student_id} with {len(rows)} new encoding(s)")
+        return True
+
+    def _remove_rows(self, student_id: str) -> bool:
+        """Drop a student's rows and label from the in-memory gallery."""
+        label = self._student_label_index.get(student_id)
+        if label is None:
+            return False
+        keep = self._row_labels != label
+        row_labels = self._row_labels[keep].astype(np.int32)
+        row_labels[row_labels > label] -= 1
+        student_labels = self._student_labels[:label] + self._student_labels[label + 1:]
+        self._set_gallery_arrays(np.ascontiguousarray(self.known_face_encodings[keep]), row_labels, student_labels)
+        return True
     
     def detect_faces(self, image_path: str) -> List[Tuple[int, int, int, int]]:
         """
@@ -121,7 +670,7 @@ class FaceRecognitionEngine:
             return []
         try:
             image = face_recognition.load_image_file(image_path)
-            face_locations = face_recognition.face_locations(image)
+            face_locations = locate_faces(image, fallback=True)
             logger.debug(f"Detected {len(face_locations)} face(s) in {image_path}")
             return face_locations
         except Exception as e:
@@ -130,50 +679,20 @@ class FaceRecognitionEngine:
     
     def _preprocess_image(self, image_path: str) -> Optional[np.ndarray]:
         """
-        Preprocess image for better face recognition accuracy.
-        - Resize if too large
-        - Enhance contrast
-        - Convert to RGB
+        Load and preprocess an image file for face recognition
+        (see ImagePreprocessor: resize, then contrast enhancement).
         
         Args:
             image_path: Path to image file
             
         Returns:
-            Preprocessed image array or None
+            Preprocessed RGB image array or None
         """
         try:
-            # Load image using OpenCV for better control
-            img = cv2.imread(image_path)
+            img = self.preprocessor.load(image_path)
             if img is None:
-                # Try loading with PIL if OpenCV fails
-                img = np.array(Image.open(image_path))
-                img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-            
-            # Convert BGR to RGB (face_recognition uses RGB)
-            rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            
-            # Resize if image is too large (improves speed and accuracy)
-            height, width = rgb_img.shape[:2]
-            max_dimension = 800
-            if width > max_dimension or height > max_dimension:
-                if width > height:
-                    new_width = max_dimension
-                    new_height = int((height * max_dimension) / width)
-                else:
-                    new_height = max_dimension
-                    new_width = int((width * max_dimension) / height)
-                rgb_img = cv2.resize(rgb_img, (new_width, new_height), interpolation=cv2.INTER_AREA)
-            
-            # Enhance contrast using CLAHE (Contrast Limited Adaptive Histogram Equalization)
-            # This improves face recognition accuracy in varying lighting conditions
-            lab = cv2.cvtColor(rgb_img, cv2.COLOR_RGB2LAB)
-            l, a, b = cv2.split(lab)
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            l = clahe.apply(l)
-            enhanced = cv2.merge([l, a, b])
-            rgb_img = cv2.cvtColor(enhanced, cv2.COLOR_LAB2RGB)
-            
-            return rgb_img
+                return None
+            return self.preprocessor.preprocess(img)
         except Exception as e:
             logger.error(f"Error preprocessing image {image_path}: {e}")
             # Fallback to simple loading
@@ -210,25 +729,23 @@ class FaceRecognitionEngine:
             # Use CNN model for better accuracy (slower but more accurate)
             # For training, we want highest accuracy
             if face_location:
+                self.preprocessor.enhance_face(image, face_location)
                 face_encodings = face_recognition.face_encodings(
                     image, 
                     [face_location],
                     model='large'  # Use large model for better accuracy
                 )
             else:
-                # Use HOG for faster training, CNN for better accuracy during recognition
-                if use_hog_for_training:
-                    # Fast training mode - use HOG
-                    face_locations = face_recognition.face_locations(image, model='hog')
-                else:
-                    # Recognition mode - try CNN first for better accuracy
+                # Cascade detection, falling back to a full-frame HOG pass so enrolment
+                # images are never lost to a missed proposal
+                face_locations = locate_faces(image, fallback=True)
+                if len(face_locations) == 0 and not use_hog_for_training:
+                    # Accuracy mode - last resort CNN
                     face_locations = face_recognition.face_locations(image, model='cnn')
-                    if len(face_locations) == 0:
-                        # Fallback to HOG if CNN fails
-                        face_locations = face_recognition.face_locations(image, model='hog')
                 
                 if len(face_locations) > 0:
                     # Use the first (largest) face
+                    self.preprocessor.enhance_face(image, face_locations[0])
                     face_encodings = face_recognition.face_encodings(
                         image, 
                         [face_locations[0]],
@@ -246,28 +763,181 @@ class FaceRecognitionEngine:
             logger.error(f"Error encoding face in {image_path}: {e}")
             return None
     
-    def recognize_face(self, image_path: str, tolerance: float = 0.45) -> Optional[Dict[str, Any]]:
+    def inspect_training_image(self, image_path: str = None, image_bytes: bytes = None) -> Dict[str, Any]:
         """
-        Recognize a face in an image against known faces.
+        Detect every face in a dataset image and, if there is exactly one, encode it
+        exactly as training does (encode_face with use_hog_for_training), so the
+        result can be cached on StudentFaceImage and training can skip the image.
         
         Args:
             image_path: Path to image file
-            tolerance: Distance tolerance for face matching (lower = stricter)
+            image_bytes: Encoded image held in memory (instead of image_path)
             
         Returns:
-            Dict with 'student_id', 'distance', 'confidence' or None if no match
+            Dict with 'face_count', 'location', 'encoding' and 'face_hash' (dHash of the
+            face crop as 16 hex digits), all None unless exactly one face was found,
+            and 'error' (None or a message)
         """
+        inspection = {'face_count': 0, 'location': None, 'encoding': None, 'face_hash': None, 'error': None}
+        if not FACE_RECOGNITION_AVAILABLE:
+            inspection['error'] = 'face_recognition module not available'
+            return inspection
+        try:
+            if image_bytes is not None:
+                image = self.preprocessor.decode(image_bytes)
+                image = self.preprocessor.preprocess(image) if image is not None else None
+            else:
+                image = self._preprocess_image(image_path)
+            if image is None:
+                inspection['error'] = 'Cannot load image'
+                return inspection
+            face_locations = locate_faces(image, fallback=True)
+            inspection['face_count'] = len(face_locations)
+            if len(face_locations) != 1:
+                return inspection
+            
+            location = tuple(int(v) for v in face_locations[0])
+            crop_hash = face_hash(image, location)
+            inspection['face_hash'] = f"{crop_hash:016x}" if crop_hash is not None else None
+            self.preprocessor.enhance_face(image, location)
+            face_encodings = face_recognition.face_encodings(image, [location], model='large')
+            inspection['location'] = list(location)
+            if len(face_encodings) > 0:
+                inspection['encoding'] = np.asarray(face_encodings[0], dtype=np.float32)
+        except Exception as e:
+            logger.error(f"Error inspecting {image_path or 'image bytes'}: {e}")
+            inspection['error'] = str(e)
+        return inspection
+
+    def _ready_for_recognition(self) -> bool:
+        """False if there is nothing to match against (a model saved later is picked up by get_face_engine)."""
         if not self.is_loaded:
-            if not self.load_model():
-                logger.error("Cannot recognize face: model not loaded")
-                return None
+            logger.error("Cannot recognize face: model not loaded")
+            return False
         
         if len(self.known_face_encodings) == 0:
             logger.warning("No known faces in model")
-            return None
+            return False
         
         if not FACE_RECOGNITION_AVAILABLE:
             logger.error("face_recognition module not available. Please install dlib and face_recognition.")
+            return False
+        return True
+    
+    def _encode_at(self, rgb_image: np.ndarray, location: Tuple[int, int, int, int], source: str) -> Optional[np.ndarray]:
+        """Encode the face at a known location of a preprocessed RGB image (None if it cannot be encoded)."""
+        self.preprocessor.enhance_face(rgb_image, location)
+        unknown_encodings = face_recognition.face_encodings(
+            rgb_image,
+            [location]
+        )
+        
+        if len(unknown_encodings) == 0:
+            logger.warning(f"Failed to encode face in {source}")
+            return None
+        return unknown_encodings[0]
+
+    def _encode_first_face(self, rgb_image: np.ndarray, source: str) -> Tuple[Optional[np.ndarray], Optional[Tuple[int, int, int, int]]]:
+        """
+        Detect and encode the first (largest) face in a preprocessed RGB image.
+        
+        Args:
+            rgb_image: Preprocessed RGB image array
+            source: Description of the image for log messages
+            
+        Returns:
+            Tuple of (encoding, face location), or (None, None) if no usable face
+        """
+        # Cascade detection: frames without a proposed face are rejected before dlib runs
+        face_locations = locate_faces(rgb_image)
+        
+        if len(face_locations) == 0:
+            logger.warning(f"No face found in {source}")
+            return None, None
+        
+        # Use the first (largest) face
+        encoding = self._encode_at(rgb_image, face_locations[0], source)
+        if encoding is None:
+            return None, None
+        return encoding, face_locations[0]
+
+    def _recognize_at(self, rgb_image: np.ndarray, location: Tuple[int, int, int, int], tolerance: float, source: str,
+                      scope: str = None) -> Optional[Dict[str, Any]]:
+        """
+        Encode and match the face at a known location, through the result cache:
+        the same face crop seen recently in the same scope is answered without dlib encoding.
+        
+        Args:
+            rgb_image: Preprocessed RGB image array
+            location: (top, right, bottom, left) face box
+            tolerance: Distance tolerance for face matching
+            source: Description of the image for log messages
+            scope: Result cache scope (e.g. the camera device); None bypasses the cache
+            
+        Returns:
+            Dict with 'student_id', 'distance', 'confidence', 'matched' (plus 'cached': True
+            when answered from the cache) or None if the face cannot be encoded
+        """
+        image_hash = None
+        if scope is not None and self.result_cache.enabled:
+            image_hash = face_hash(rgb_image, location)
+            if image_hash is not None:
+                cached = self.result_cache.get(image_hash, tolerance, self.model_version_key(), scope)
+                if cached is not None:
+                    logger.debug(f"Recognition cache hit for {source}: {cached['student_id']}")
+                    cached['cached'] = True
+                    return cached
+        
+        encoding = self._encode_at(rgb_image, location, source)
+        if encoding is None:
+            return None
+        
+        # Compare with known faces
+        result = self._match_encoding(encoding, tolerance)
+        if result['matched']:
+            logger.info(f"Face recognized: {result['student_id']} (confidence: {result['confidence']:.2f}, distance: {result['distance']:.4f})")
+        else:
+            logger.info(f"No match found (best distance: {result['distance']:.4f} > tolerance: {tolerance})")
+        if image_hash is not None:
+            self.result_cache.put(image_hash, tolerance, self.model_version_key(), result, scope)
+        return result
+
+    def _recognize_array(self, rgb_image: np.ndarray, tolerance: float, source: str,
+                         scope: str = None) -> Optional[Dict[str, Any]]:
+        """
+        Detect, encode and match the first face in a preprocessed RGB image.
+        
+        Args:
+            rgb_image: Preprocessed RGB image array
+            tolerance: Distance tolerance for face matching
+            source: Description of the image for log messages
+            scope: Result cache scope; None bypasses the cache
+            
+        Returns:
+            Dict with 'student_id', 'distance', 'confidence', 'matched' or None if no face
+        """
+        # Cascade detection: frames without a proposed face are rejected before dlib runs
+        face_locations = locate_faces(rgb_image)
+        
+        if len(face_locations) == 0:
+            logger.warning(f"No face found in {source}")
+            return None
+        
+        # Use the first (largest) face
+        return self._recognize_at(rgb_image, face_locations[0], tolerance, source, scope)
+    
+    def recognize_face(self, image_path: str, tolerance: float = 0.45) -> Optional[Dict[str, Any]]:
+        """
+        Recognize a face in an image against known faces.
+        
+        Args:
+            image_path: Path to image file
+            tolerance: Distance tolerance for face matching (lower = stricter)
+            
+        Returns:
+            Dict with 'student_id', 'distance', 'confidence' or None if no match
+        """
+        if not self._ready_for_recognition():
             return None
         try:
             # Preprocess and encode the unknown face
@@ -275,162 +945,365 @@ class FaceRecognitionEngine:
             if unknown_image is None:
                 logger.warning(f"Failed to load image: {image_path}")
                 return None
-            
-            # Use HOG for speed (CNN is too slow for real-time CPU)
-            face_locations = face_recognition.face_locations(unknown_image, model='hog')
-            
-            if len(face_locations) == 0:
-                logger.warning(f"No face found in {image_path}")
-                return None
-            
-            # Use the first (largest) face
-            unknown_encodings = face_recognition.face_encodings(
-                unknown_image,
-                [face_locations[0]]
-            )
-            
-            if len(unknown_encodings) == 0:
-                logger.warning(f"Failed to encode face in {image_path}")
-                return None
-            
-            unknown_encoding = unknown_encodings[0]
-            
-            # Compare with known faces
-            face_distances = face_recognition.face_distance(
-                self.known_face_encodings, 
-                unknown_encoding
-            )
-            
-            # Find the best match
-            best_match_index = np.argmin(face_distances)
-            best_distance = face_distances[best_match_index]
-            
-            # Calculate confidence (1 - normalized distance, clamped to 0-1)
-            confidence = max(0.0, 1.0 - (best_distance / tolerance))
-            
-            # Check if distance is within tolerance
-            if best_distance <= tolerance:
-                student_id = self.known_face_student_ids[best_match_index]
-                logger.info(f"Face recognized: {student_id} (confidence: {confidence:.2f}, distance: {best_distance:.4f})")
-                return {
-                    'student_id': student_id,
-                    'distance': float(best_distance),
-                    'confidence': float(confidence),
-                    'matched': True
-                }
-            else:
-                logger.info(f"No match found (best distance: {best_distance:.4f} > tolerance: {tolerance})")
-                return {
-                    'student_id': None,
-                    'distance': float(best_distance),
-                    'confidence': float(confidence),
-                    'matched': False
-                }
+            return self._recognize_array(unknown_image, tolerance, image_path)
         except Exception as e:
             logger.error(f"Error recognizing face in {image_path}: {e}")
             return None
     
-    def recognize_face_from_bytes(self, image_bytes: bytes, tolerance: float = 0.45) -> Optional[Dict[str, Any]]:
+    def recognize_face_from_bytes(self, image_bytes: bytes, tolerance: float = 0.45,
+                                  scope: Optional[str] = '') -> Optional[Dict[str, Any]]:
         """
         Recognize a face from image bytes (for API use).
+        The image is decoded once in memory; nothing is written to disk.
         
         Args:
             image_bytes: Image data as bytes
             tolerance: Distance tolerance for face matching
+            scope: Result cache scope, e.g. the calling user or device
+                (default: one shared scope; None bypasses the cache)
             
         Returns:
             Dict with recognition results or None
         """
-        if not self.is_loaded:
-            if not self.load_model():
-                logger.error("Cannot recognize face: model not loaded")
-                return None
-        
-        if len(self.known_face_encodings) == 0:
-            logger.warning("No known faces in model")
+        if not self._ready_for_recognition():
             return None
-        
         try:
-            # Convert bytes to numpy array
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            image = self.preprocessor.decode(image_bytes)
             if image is None:
                 logger.error("Failed to decode image from bytes")
                 return None
+            return self._recognize_array(self.preprocessor.preprocess(image), tolerance, 'uploaded image', scope)
+        except Exception as e:
+            logger.error(f"Error recognizing face from bytes: {e}")
+            return None
+
+    def locate_face_from_bytes(self, image_bytes: bytes) -> Tuple[Optional[np.ndarray], Optional[Tuple[int, int, int, int]]]:
+        """
+        Decode an image and locate its main face with cascade detection only
+        (no encoding or matching), e.g. to track a face across camera frames.
+        
+        Args:
+            image_bytes: Image data as bytes
             
-            # Convert BGR to RGB
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            
-            # Enhance contrast for better recognition (same as preprocessing)
-            lab = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2LAB)
-            l, a, b = cv2.split(lab)
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            l = clahe.apply(l)
-            enhanced = cv2.merge([l, a, b])
-            rgb_image = cv2.cvtColor(enhanced, cv2.COLOR_LAB2RGB)
-            
-            # Resize if too large (Optimize to 600px for speed)
-            height, width = rgb_image.shape[:2]
-            max_dimension = 600
-            if width > max_dimension or height > max_dimension:
-                if width > height:
-                    new_width = max_dimension
-                    new_height = int((height * max_dimension) / width)
-                else:
-                    new_height = max_dimension
-                    new_width = int((width * max_dimension) / height)
-                rgb_image = cv2.resize(rgb_image, (new_width, new_height), interpolation=cv2.INTER_AREA)
-            
-            # Use HOG for speed in real-time recognition
-            face_locations = face_recognition.face_locations(rgb_image, model='hog')
-            
-            if len(face_locations) == 0:
-                logger.warning("No face found in image bytes")
-                return None
+        Returns:
+            Tuple of (preprocessed RGB image or None if undecodable, largest face location or None)
+        """
+        if not FACE_RECOGNITION_AVAILABLE:
+            logger.error("face_recognition module not available. Please install dlib and face_recognition.")
+            return None, None
+        try:
+            image = self.preprocessor.decode(image_bytes)
+            if image is None:
+                logger.error("Failed to decode image from bytes")
+                return None, None
+            rgb_image = self.preprocessor.preprocess(image)
+            face_locations = locate_faces(rgb_image)
+            return rgb_image, (tuple(int(v) for v in face_locations[0]) if face_locations else None)
+        except Exception as e:
+            logger.error(f"Error locating face in image bytes: {e}")
+            return None, None
+
+    def recognize_located_face(self, rgb_image: np.ndarray, location: Tuple[int, int, int, int],
+                               tolerance: float = 0.45, scope: str = None) -> Optional[Dict[str, Any]]:
+        """
+        Encode and match a face already found by locate_face_from_bytes.
+        
+        Args:
+            rgb_image: Preprocessed RGB image from locate_face_from_bytes
+            location: (top, right, bottom, left) face box
+            tolerance: Distance tolerance for face matching
+            scope: Result cache scope, e.g. the camera device id (None: no caching)
             
-            # Encode the face
-            face_encodings = face_recognition.face_encodings(
-                rgb_image,
-                [face_locations[0]]
+        Returns:
+            Dict with 'student_id', 'distance', 'confidence', 'matched' or None
+        """
+        if not self._ready_for_recognition():
+            return None
+        try:
+            return self._recognize_at(rgb_image, location, tolerance, 'uploaded image', scope)
+        except Exception as e:
+            logger.error(f"Error recognizing located face: {e}")
+            return None
+
+    def has_encoding(self, student_id: str, encoding: np.ndarray) -> bool:
+        """
+        Whether the gallery already holds `encoding` for a student (up to the
+        rounding of the stored encoding formats, see GALLERY_DUPLICATE_DISTANCE).
+        """
+        label = self._student_label_index.get(student_id)
+        if label is None:
+            return False
+        rows = self._student_rows(label)
+        if len(rows) == 0:
+            return False
+        distances = pairwise_distances(encoding, self.known_face_encodings[rows], self._gallery_sq_norms[rows])[0]
+        return bool(distances.min() <= GALLERY_DUPLICATE_DISTANCE)
+
+    def _student_distances(self, distances: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reduce a probe-by-gallery distance matrix to each probe's closest image per student.
+        Gallery columns are grouped by student (grouping precomputed by _group_rows)
+        and reduced with one np.minimum.reduceat.
+
+        Args:
+            distances: (M, N) distances from _gallery_distances
+
+        Returns:
+            Tuple of ((M, S) distance matrix, (S,) student label index of each column)
+        """
+        order, starts, labels = self._row_groups
+        return np.minimum.reduceat(distances[:, order], starts, axis=1), labels
+
+    def _match_result(self, student_distances: np.ndarray, label: int, best_distance: float,
+                      tolerance: float) -> Dict[str, Any]:
+        """
+        Match dict for a probe matched to a student, shared by every matching path.
+        Confidence is 1 - score / tolerance, clamped to 0-1, where the score is the
+        mean distance to the student's CONFIDENCE_TOP_N closest encodings, which is
+        steadier than a single closest image.
+
+        Args:
+            student_distances: Distances from the probe to the student's gallery rows
+            label: Student label index
+            best_distance: Distance to the closest gallery encoding
+            tolerance: Distance tolerance for face matching
+        """
+        score = float(np.sort(student_distances)[:CONFIDENCE_TOP_N].mean())
+        return {
+            'student_id': self._student_labels[label],
+            'distance': best_distance,
+            'confidence': max(0.0, 1.0 - (score / tolerance)),
+            'matched': True
+        }
+
+    def _match_encodings(self, encodings: np.ndarray, tolerance: float) -> List[Dict[str, Any]]:
+        """
+        Match independent probes (e.g. frames of a batch) in one vectorized pass.
+        Unlike _assign_encodings, several probes may match the same student.
+
+        Args:
+            encodings: (M, 128) probe encodings
+            tolerance: Distance tolerance for face matching
+
+        Returns:
+            One dict per probe with 'student_id', 'distance', 'confidence', 'matched'
+        """
+        distances = self._gallery_distances(encodings)
+        student_distances, student_labels = self._student_distances(distances)
+        best_columns = np.argmin(student_distances, axis=1)
+        results = []
+        for probe, column in enumerate(best_columns):
+            best_distance = float(student_distances[probe, column])
+            if best_distance <= tolerance:
+                label = student_labels[column]
+                results.append(self._match_result(
+                    distances[probe, self._student_rows(label)], label, best_distance, tolerance
+                ))
+            else:
+                results.append({'student_id': None, 'distance': best_distance, 'confidence': 0.0, 'matched': False})
+        return results
+
+    def _assign_encodings(self, encodings: np.ndarray, tolerance: float) -> List[Dict[str, Any]]:
+        """
+        Match several faces of one photo at once, one student per face at most.
+        All probes are scored against the whole gallery in one matrix product;
+        (probe, student) pairs are then taken in order of increasing distance,
+        skipping probes and students that are already assigned.
+
+        Args:
+            encodings: (M, 128) probe encodings
+            tolerance: Distance tolerance for face matching
+
+        Returns:
+            One dict per probe with 'student_id', 'distance', 'confidence', 'matched'
+        """
+        distances = self._gallery_distances(encodings)
+        student_distances, student_labels = self._student_distances(distances)
+
+        results = [{'student_id': None, 'distance': float(row.min()), 'confidence': 0.0, 'matched': False}
+                   for row in student_distances]
+        taken_probes, taken_students = set(), set()
+        for flat in np.argsort(student_distances, axis=None):
+            probe, column = divmod(int(flat), student_distances.shape[1])
+            best_distance = float(student_distances[probe, column])
+            if best_distance > tolerance or len(taken_probes) == len(results):
+                break
+            if probe in taken_probes or column in taken_students:
+                continue
+            taken_probes.add(probe)
+            taken_students.add(column)
+            label = student_labels[column]
+            results[probe] = self._match_result(
+                distances[probe, self._student_rows(label)], label, best_distance, tolerance
             )
-            
-            if len(face_encodings) == 0:
-                logger.warning("Failed to encode face from image bytes")
+        return results
+
+    def recognize_faces_from_bytes(self, image_bytes: bytes, tolerance: float = 0.45) -> Optional[List[Dict[str, Any]]]:
+        """
+        Recognize every face in a group photo (e.g. a whole classroom).
+        All faces are encoded in one face_encodings call and assigned one-to-one,
+        so two faces never claim the same student.
+
+        Args:
+            image_bytes: Image data as bytes
+            tolerance: Distance tolerance for face matching
+
+        Returns:
+            List of dicts with 'location' (top, right, bottom, left), 'student_id',
+            'distance', 'confidence', 'matched' (largest face first), or None if the
+            image could not be processed
+        """
+        if not self._ready_for_recognition():
+            return None
+        try:
+            image = self.preprocessor.decode(image_bytes)
+            if image is None:
+                logger.error("Failed to decode image from bytes")
                 return None
+            rgb_image = self.preprocessor.preprocess(image)
+
+            face_locations = locate_faces(rgb_image, fallback=True)
+            if len(face_locations) == 0:
+                logger.warning("No faces found in group photo")
+                return []
+            for location in face_locations:
+                self.preprocessor.enhance_face(rgb_image, location)
+            encodings = face_recognition.face_encodings(rgb_image, face_locations)
+
+            results = self._assign_encodings(np.asarray(encodings, dtype=np.float32), tolerance)
+            for location, result in zip(face_locations, results):
+                result['location'] = [int(v) for v in location]
+            logger.info(f"Group photo: {len(results)} face(s), {sum(r['matched'] for r in results)} recognized")
+            return results
+        except Exception as e:
+            logger.error(f"Error recognizing faces from bytes: {e}")
+            return None
+
+    def _encode_frame(self, image_bytes: bytes, source: str) -> Tuple[Optional[np.ndarray], Optional[Tuple[int, int, int, int]], Optional[str]]:
+        """Decode, preprocess and encode one frame of a batch: (encoding, location, error)."""
+        try:
+            image = self.preprocessor.decode(image_bytes)
+            if image is None:
+                return None, None, 'Could not decode image'
+            encoding, location = self._encode_first_face(self.preprocessor.preprocess(image), source)
+            if encoding is None:
+                return None, None, 'No face detected'
+            return encoding, location, None
+        except Exception as e:
+            logger.error(f"Error encoding {source}: {e}")
+            return None, None, str(e)
+
+    def recognize_faces_batch(self, images: List[bytes], tolerance: float = 0.45) -> Optional[List[Dict[str, Any]]]:
+        """
+        Recognize the main face in each of many frames (e.g. frames a kiosk buffered offline).
+        Frames are decoded, preprocessed and encoded on a thread pool of
+        FACE_BATCH_WORKERS threads, then all encodings are matched in one pass.
+        
+        Args:
+            images: Image data of each frame
+            tolerance: Distance tolerance for face matching
             
-            unknown_encoding = face_encodings[0]
-            
-            # Compare with known faces
-            face_distances = face_recognition.face_distance(
-                self.known_face_encodings,
-                unknown_encoding
-            )
+        Returns:
+            One dict per frame with 'face_detected', 'location', 'student_id', 'distance',
+            'confidence', 'matched' and 'error', or None if the model is not ready
+        """
+        if not self._ready_for_recognition():
+            return None
+        if not images:
+            return []
+        workers = getattr(settings, 'FACE_BATCH_WORKERS', 0) or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=min(workers, len(images))) as executor:
+            frames = list(executor.map(self._encode_frame, images, [f'batch frame {i}' for i in range(len(images))]))
+        
+        results = [
+            {'face_detected': encoding is not None, 'location': [int(v) for v in location] if location else None,
+             'student_id': None, 'distance': None, 'confidence': 0.0, 'matched': False, 'error': error}
+            for encoding, location, error in frames
+        ]
+        encoded = [i for i, (encoding, _, _) in enumerate(frames) if encoding is not None]
+        if encoded:
+            matches = self._match_encodings(np.stack([frames[i][0] for i in encoded]).astype(np.float32), tolerance)
+            for i, match in zip(encoded, matches):
+                results[i].update(match)
+        logger.info(f"Batch recognition: {len(images)} frame(s), {len(encoded)} with a face, {sum(r['matched'] for r in results)} recognized")
+        return results
+    
+    def _encode_images(self, image_paths: List[str]):
+        """
+        Encode training images, yielding encodings (or None) in input order.
+        Images are sharded across a process pool of FACE_TRAINING_WORKERS
+        processes in chunks of FACE_TRAINING_CHUNK_SIZE, since dlib HOG
+        detection and the 'large' landmark model are CPU-bound.
+        
+        Args:
+            image_paths: Paths of images to encode
             
-            # Find the best match
-            best_match_index = np.argmin(face_distances)
-            best_distance = face_distances[best_match_index]
-            confidence = max(0.0, 1.0 - (best_distance / tolerance))
+        Yields:
+            Face encoding array or None for each path
+        """
+        workers = getattr(settings, 'FACE_TRAINING_WORKERS', 0) or os.cpu_count() or 1
+        workers = min(workers, len(image_paths))
+        chunk_size = max(1, getattr(settings, 'FACE_TRAINING_CHUNK_SIZE', 8))
+        
+        if workers <= 1:
+            for image_path in image_paths:
+                yield self.encode_face(image_path, use_hog_for_training=True)
+            return
+        
+        logger.info(f"Encoding {len(image_paths)} images with {workers} worker processes (chunk size {chunk_size})")
+        executor = training_pool(workers)
+        try:
+            yield from executor.map(_encode_for_training, image_paths, chunksize=chunk_size)
+        finally:
+            # Drop queued chunks if training is abandoned early (e.g. the job was cancelled)
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    def _fetch_cached_encodings(self, face_image_ids: List[int]) -> Dict[int, np.ndarray]:
+        """
+        Load cached encodings for many StudentFaceImage rows at once.
+        
+        Args:
+            face_image_ids: StudentFaceImage primary keys
             
-            if best_distance <= tolerance:
-                student_id = self.known_face_student_ids[best_match_index]
-                logger.info(f"Face recognized from bytes: {student_id} (confidence: {confidence:.2f})")
-                return {
-                    'student_id': student_id,
-                    'distance': float(best_distance),
-                    'confidence': float(confidence),
-                    'matched': True
-                }
-            else:
-                logger.info(f"No match found from bytes (best distance: {best_distance:.4f} > tolerance: {tolerance})")
-                return {
-                    'student_id': None,
-                    'distance': float(best_distance),
-                    'confidence': float(confidence),
-                    'matched': False
-                }
+        Returns:
+            Dict mapping face image id to its cached encoding (misses are omitted)
+        """
+        if not face_image_ids:
+            return {}
+        cached = {}
+        try:
+            StudentFaceImage = apps.get_model('attendance', 'StudentFaceImage')
+            rows = StudentFaceImage.objects.filter(
+                id__in=face_image_ids, encoding_data__isnull=False
+            ).values_list('id', 'encoding_data')
+            rows = [(face_image_id, blob) for face_image_id, blob in rows if blob and len(blob) in FORMAT_SIZES.values()]
+            # Decode every blob into one matrix; cached entries are row views of it
+            matrix = unpack_many(blob for _, blob in rows)
+            cached = {face_image_id: matrix[i] for i, (face_image_id, _) in enumerate(rows)}
         except Exception as e:
-            logger.error(f"Error recognizing face from bytes: {e}")
-            return None
+            logger.warning(f"Error fetching cached encodings: {e}")
+        logger.info(f"Found {len(cached)}/{len(face_image_ids)} cached encodings")
+        return cached
+    
+    def _cache_encodings(self, pending: List[Tuple[int, np.ndarray]]):
+        """
+        Store freshly computed encodings on their StudentFaceImage rows with bulk_update.
+        
+        Args:
+            pending: List of (face image id, encoding) pairs
+        """
+        if not pending:
+            return
+        try:
+            StudentFaceImage = apps.get_model('attendance', 'StudentFaceImage')
+            storage = getattr(settings, 'FACE_ENCODING_STORAGE', 'float32')
+            objs = [
+                StudentFaceImage(id=face_image_id, encoding_data=pack_encoding(encoding, storage), encoding_cached=True)
+                for face_image_id, encoding in pending
+            ]
+            StudentFaceImage.objects.bulk_update(objs, ['encoding_data', 'encoding_cached'], batch_size=CACHE_WRITE_BATCH_SIZE)
+        except Exception as e:
+            logger.error(f"Failed to cache {len(pending)} encodings: {e}")
     
     def train_model(self, face_images: List[Dict[str, str]], progress_callback=None) -> Dict[str, Any]:
         """
@@ -454,6 +1327,11 @@ class FaceRecognitionEngine:
             if progress_callback:
                 progress_callback(0, f"Starting training with {len(face_images)} images...")
             
+            # Stage 1: validate inputs and prefetch cached encodings in one query
+            cached = self._fetch_cached_encodings(
+                [face_data.get('face_image_id') for face_data in face_images if face_data.get('face_image_id')]
+            )
+            jobs = []
             for idx, face_data in enumerate(face_images):
                 image_path = face_data.get('image_path')
                 student_id = face_data.get('student_id')
@@ -466,6 +1344,34 @@ class FaceRecognitionEngine:
                     errors.append(f"Image {idx}: File not found - {image_path}")
                     continue
                 
+                face_image_id = face_data.get('face_image_id')
+                jobs.append({
+                    'idx': idx,
+                    'image_path': image_path,
+                    'student_id': student_id,
+                    'face_image_id': face_image_id,
+                    'encoding': cached.get(face_image_id) if face_image_id else None,
+                })
+            
+            # Stage 2: encode cache misses in a process pool; results come back in input order
+            misses = [job['image_path'] for job in jobs if job['encoding'] is None]
+            encoded = self._encode_images(misses)
+            pending_cache = []
+            
+            for job in jobs:
+                idx = job['idx']
+                student_id = job['student_id']
+                encoding = job['encoding']
+                
+                if encoding is None:
+                    # Encode the face (use HOG for faster training, CNN is slower)
+                    encoding = next(encoded)
+                    if encoding is not None and job['face_image_id']:
+                        pending_cache.append((job['face_image_id'], encoding))
+                        if len(pending_cache) >= CACHE_WRITE_BATCH_SIZE:
+                            self._cache_encodings(pending_cache)
+                            pending_cache = []
+                
                 # Progress logging
                 progress = ((idx + 1) / len(face_images)) * 100
                 if (idx + 1) % 5 == 0 or idx == 0 or idx == len(face_images) - 1:
@@ -475,41 +1381,14 @@ class FaceRecognitionEngine:
                 if progress_callback:
                     progress_callback(progress, f"Training: Processing {student_id} ({idx+1}/{len(face_images)})")
                 
-                # Try to get cached encoding
-                encoding = None
-                face_image_id = face_data.get('face_image_id')
-                StudentFaceImage = None
-                
-                if face_image_id:
-                    try:
-                        StudentFaceImage = apps.get_model('attendance', 'StudentFaceImage')
-                        face_img_obj = StudentFaceImage.objects.filter(id=face_image_id).first()
-                        if face_img_obj and face_img_obj.encoding:
-                            encoding = np.array(json.loads(face_img_obj.encoding))
-                            # logger.debug(f"Using cached encoding for image {face_image_id}")
-                    except Exception as e:
-                        logger.warning(f"Error fetching cached encoding: {e}")
-
-                if encoding is None:
-                    # Encode the face (use HOG for faster training, CNN is slower)
-                    encoding = self.encode_face(image_path, use_hog_for_training=True)
-                    
-                    # Cache the encoding if successful
-                    if encoding is not None and face_image_id and StudentFaceImage:
-                        try:
-                            if face_img_obj:
-                                face_img_obj.encoding = json.dumps(encoding.tolist())
-                                face_img_obj.encoding_cached = True
-                                face_img_obj.save(update_fields=['encoding', 'encoding_cached'])
-                        except Exception as e:
-                            logger.error(f"Failed to cache encoding for {face_image_id}: {e}")
-
                 if encoding is not None:
                     encodings.append(encoding)
                     student_ids.append(student_id)
                     processed_count += 1
                 else:
-                    errors.append(f"Image {idx}: Could not encode face - {image_path}")
+                    errors.append(f"Image {idx}: Could not encode face - {job['image_path']}")
+            
+            self._cache_encodings(pending_cache)
             
             if len(encodings) == 0:
                 logger.error("No valid face encodings generated during training")
@@ -521,7 +1400,8 @@ class FaceRecognitionEngine:
                 }
             
             # Save the model
-            if self.save_model(encodings, student_ids):
+            engine = self._save_gallery(encodings, student_ids)
+            if engine is not None:
                 logger.info(f"✅ [TRAINING] Model training completed: {processed_count} faces encoded, {len(set(student_ids))} unique students")
                 print(f"✅ [TRAINING] Model training completed: {processed_count} faces encoded, {len(set(student_ids))} unique students")
                 return {
@@ -530,7 +1410,10 @@ class FaceRecognitionEngine:
                     'total_encodings': len(encodings),
                     'unique_students': len(set(student_ids)),
                     'errors': errors,
-                    'model_path': self.model_path
+                    'model_path': engine.model_path,
+                    'gallery_version': engine.model_version_key(),
+                    'index': engine.index.get_info(),
+                    'index_recall': engine.index.recall
                 }
             else:
                 return {
@@ -555,43 +1438,149 @@ class FaceRecognitionEngine:
         Returns:
             Dict with model information
         """
-        # Try to load if not already loaded
-        if not self.is_loaded:
-            self.load_model()
-        
         if not self.is_loaded:
             return {
                 'loaded': False,
                 'encoding_count': 0,
                 'model_path': self.model_path,
-                'model_exists': os.path.exists(self.model_path)
+                'model_exists': os.path.exists(self.model_path) or os.path.exists(self.legacy_model_path)
             }
         
         return {
             'loaded': True,
             'encoding_count': len(self.known_face_encodings),
-            'unique_students': len(set(self.known_face_student_ids)),
+            'unique_students': len(self._student_labels),
             'model_path': self.model_path,
-            'model_exists': True
+            'generation': self._generation(),
+            'model_exists': True,
+            'index': self.index.get_info() if self.index else None,
+            'index_recall': self.index.recall if self.index else None,
+            'result_cache': self.result_cache.stats()
         }
     
     def reload_model(self) -> bool:
         """
-        Reload the model from disk.
-        Useful after training to load the new model.
+        Reload the model from disk into a new engine and publish it.
         
         Returns:
             bool: True if reloaded successfully
         """
-        return self.load_model()
+        with self._updating():
+            engine = _load_engine(self.model_dir, persist_index=False)
+            if not engine.is_loaded:
+                return False
+            _publish_face_engine(engine)
+        return True
+
+
+# Engine used by training pool worker processes (created lazily per process)
+_training_worker_engine = None
+
+
+def training_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool for dataset validation and training encodes.
+    Workers are spawned rather than forked: a fork of a threaded web worker
+    or job runner copies locks other threads held at that moment.
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_training_worker
+    )
+
+
+def _init_training_worker():
+    """Spawned pool workers start from a fresh interpreter: set Django up before any task runs."""
+    import django
+    django.setup()
+
+
+def _worker_engine() -> FaceRecognitionEngine:
+    """Engine used inside process-pool workers (created once per worker process)."""
+    global _training_worker_engine
+    if _training_worker_engine is None:
+        _training_worker_engine = FaceRecognitionEngine()
+    return _training_worker_engine
+
+
+def _encode_for_training(image_path: str) -> Optional[np.ndarray]:
+    """Process-pool entry point: encode one training image."""
+    return _worker_engine().encode_face(image_path, use_hog_for_training=True)
+
+
+def inspect_for_training(image_path: str = None, image_bytes: bytes = None) -> Dict[str, Any]:
+    """Process-pool entry point: FaceRecognitionEngine.inspect_training_image for one dataset image."""
+    return _worker_engine().inspect_training_image(image_path, image_bytes)
 
 
 # Global instance
 _face_engine = None
+_engine_swap_lock = threading.Lock()  # one thread (re)loads the global engine at a time
+_engine_publish_lock = threading.Lock()  # guards the _face_engine reference swap itself
+_model_update_lock = threading.Lock()  # serializes model updates in this process (model_lock spans processes)
+_last_model_check = 0.0
+
+
+def _load_engine(model_dir: str = None, persist_index: bool = True) -> FaceRecognitionEngine:
+    """Create an engine and fully load it (gallery, index, centroids) before it serves requests."""
+    engine = FaceRecognitionEngine(model_dir)
+    if engine.load_model(persist_index=persist_index) and getattr(settings, 'FACE_PREFILTER_TOP_K', 0) > 0:
+        engine._build_centroids()
+    return engine
+
+
+def _publish_face_engine(engine: FaceRecognitionEngine):
+    """
+    Serve an updated engine from get_face_engine, if it holds the same model
+    directory as the global engine. Called with the model locks held.
+    """
+    global _face_engine
+    with _engine_publish_lock:
+        if _face_engine is not None and _face_engine.model_dir == engine.model_dir:
+            _face_engine = engine
+
+
+def _swap_face_engine(current: Optional[FaceRecognitionEngine], engine: FaceRecognitionEngine) -> bool:
+    """Replace `current` with a freshly loaded engine unless an update was published meanwhile."""
+    global _face_engine
+    with _engine_publish_lock:
+        if _face_engine is not current:
+            return False
+        _face_engine = engine
+        return True
+
+
+def _refresh_face_engine():
+    """
+    Swap in a newly published model generation, at most once per
+    FACE_MODEL_CHECK_INTERVAL seconds per process. The new engine is loaded
+    off to the side and published with a single reference assignment:
+    requests already holding the old engine finish on it, and other threads
+    keep serving the old engine while one thread loads (no reload storms).
+    """
+    global _last_model_check
+    now = time.monotonic()
+    if now - _last_model_check < getattr(settings, 'FACE_MODEL_CHECK_INTERVAL', 2.0):
+        return
+    if not _engine_swap_lock.acquire(blocking=False):
+        return
+    try:
+        _last_model_check = now
+        current = _face_engine
+        if current is None or not current.is_stale():
+            return
+        engine = _load_engine()
+        if engine.is_loaded and _swap_face_engine(current, engine):
+            logger.info(f"Swapped in face model {engine.model_version_key()} (was {current.model_version_key() or 'none'})")
+    except Exception as e:
+        logger.error(f"Error refreshing face recognition model: {e}")
+    finally:
+        _engine_swap_lock.release()
+
 
 def get_face_engine(reload: bool = False) -> FaceRecognitionEngine:
     """
     Get or create the global face recognition engine instance.
+    Picks up models published by other processes (see _refresh_face_engine).
     
     Args:
         reload: If True, reload the model even if already loaded
@@ -599,9 +1588,11 @@ def get_face_engine(reload: bool = False) -> FaceRecognitionEngine:
     Returns:
         FaceRecognitionEngine instance
     """
-    global _face_engine
     if _face_engine is None or reload:
-        _face_engine = FaceRecognitionEngine()
-        _face_engine.load_model()
+        with _engine_swap_lock:
+            if _face_engine is None or reload:
+                _swap_face_engine(_face_engine, _load_engine())
+        return _face_engine
+    _refresh_face_engine()
     return _face_engine
 
@@ -0,0 +1,144 @@
+"""
+Shared image preprocessing for face training and recognition.
+
+One pipeline for every caller: decode -> resize (in BGR, before any colour
+work) -> BGR->LAB -> CLAHE on the L channel in place -> LAB->RGB.
+CLAHE objects are created once per thread (cv2.CLAHE is not thread-safe)
+and reused, and only the L channel is touched instead of splitting and
+merging all three.
+"""
+import io
+import logging
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+logger = logging.getLogger('attendance')
+
+CLAHE_MODES = ('full', 'face', 'off')
+
+# Fraction of the face box added on each side when enhancing only the face
+FACE_CROP_MARGIN = 0.25
+
+
+class ImagePreprocessor:
+    """Resize and contrast-enhance images for face detection and encoding."""
+
+    def __init__(self, max_dimension: int = 800, clahe_mode: str = 'full',
+                 clip_limit: float = 2.0, tile_grid_size: Tuple[int, int] = (8, 8)):
+        """
+        Initialize the preprocessing stage.
+
+        Args:
+            max_dimension: Longest image side after resizing (0 = never resize)
+            clahe_mode: 'full' (whole frame), 'face' (only detected face crops, see
+                enhance_face) or 'off' (unknown modes fall back to 'full')
+            clip_limit: CLAHE clip limit
+            tile_grid_size: CLAHE tile grid
+        """
+        if clahe_mode not in CLAHE_MODES:
+            logger.warning(f"Unknown CLAHE mode '{clahe_mode}', using 'full'")
+            clahe_mode = 'full'
+        self.max_dimension = max_dimension
+        self.clahe_mode = clahe_mode
+        self.clip_limit = clip_limit
+        self.tile_grid_size = tuple(tile_grid_size)
+        self._local = threading.local()
+
+    def _clahe(self):
+        """This thread's CLAHE instance."""
+        clahe = getattr(self._local, 'clahe', None)
+        if clahe is None:
+            clahe = cv2.createCLAHE(clipLimit=self.clip_limit, tileGridSize=self.tile_grid_size)
+            self._local.clahe = clahe
+        return clahe
+
+    def load(self, image_path: str) -> Optional[np.ndarray]:
+        """Read an image file as BGR (OpenCV first, PIL for formats it cannot read)."""
+        img = cv2.imread(image_path)
+        if img is None:
+            try:
+                img = cv2.cvtColor(np.asarray(Image.open(image_path).convert('RGB')), cv2.COLOR_RGB2BGR)
+            except Exception:
+                return None
+        return img
+
+    def decode(self, image_bytes: bytes) -> Optional[np.ndarray]:
+        """Decode an encoded image (JPEG, PNG, ...) held in memory as BGR."""
+        img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            try:
+                img = cv2.cvtColor(np.asarray(Image.open(io.BytesIO(image_bytes)).convert('RGB')), cv2.COLOR_RGB2BGR)
+            except Exception:
+                return None
+        return img
+
+    def resize(self, img: np.ndarray) -> np.ndarray:
+        """Downscale so the longest side is at most max_dimension (never upscales)."""
+        height, width = img.shape[:2]
+        longest = max(height, width)
+        if not self.max_dimension or longest <= self.max_dimension:
+            return img
+        if width > height:
+            new_width = self.max_dimension
+            new_height = int((height * self.max_dimension) / width)
+        else:
+            new_height = self.max_dimension
+            new_width = int((width * self.max_dimension) / height)
+        return cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
+
+    def _enhance_to_rgb(self, bgr: np.ndarray) -> np.ndarray:
+        """CLAHE on the L channel of a BGR image, returned as RGB."""
+        lab = cv2.cvtColor(bgr, cv2.COLOR_BGR2LAB)
+        cv2.insertChannel(self._clahe().apply(cv2.extractChannel(lab, 0)), lab, 0)
+        return cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+
+    def preprocess(self, img: np.ndarray) -> np.ndarray:
+        """
+        Preprocess a decoded image.
+
+        Args:
+            img: BGR image array
+
+        Returns:
+            RGB image array (contrast-enhanced unless clahe_mode is 'face' or 'off')
+        """
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        img = self.resize(img)
+        if self.clahe_mode == 'full':
+            return self._enhance_to_rgb(img)
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    def enhance_face(self, rgb: np.ndarray, location: Tuple[int, int, int, int]) -> np.ndarray:
+        """
+        In 'face' mode, contrast-enhance only the region around a detected face
+        (in place). A no-op in the other modes.
+
+        Args:
+            rgb: Preprocessed RGB image array
+            location: (top, right, bottom, left) face box
+
+        Returns:
+            The same array
+        """
+        if self.clahe_mode != 'face':
+            return rgb
+        top, right, bottom, left = location
+        margin_y = int((bottom - top) * FACE_CROP_MARGIN)
+        margin_x = int((right - left) * FACE_CROP_MARGIN)
+        top, bottom = max(0, top - margin_y), min(rgb.shape[0], bottom + margin_y)
+        left, right = max(0, left - margin_x), min(rgb.shape[1], right + margin_x)
+        if bottom <= top or right <= left:
+            return rgb
+        crop = cv2.cvtColor(rgb[top:bottom, left:right], cv2.COLOR_RGB2BGR)
+        rgb[top:bottom, left:right] = self._enhance_to_rgb(crop)
+        return rgb
+
@@ -0,0 +1,165 @@
+"""
+Recognition result cache keyed by a perceptual hash of the face crop.
+
+Kiosks resend near-identical frames while a student stands still. The
+difference hash (dHash) of the downscaled grayscale face crop barely changes
+between such frames, so a cached match result can be returned before dlib
+encodes anything. Entries are scoped (per camera device or user), so a face
+seen by one kiosk never answers for another, and a lookup takes the nearest
+entry of its scope within max_distance bits (0 = identical hashes only). Entries
+expire after a TTL, the least recently used entry is evicted when full, and
+the whole cache is dropped when the gallery version changes.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+logger = logging.getLogger('attendance')
+
+# dHash grid: 8x8 comparisons -> 64-bit hash
+HASH_SIZE = 8
+
+
+def dhash(gray: np.ndarray, hash_size: int = HASH_SIZE) -> int:
+    """
+    Difference hash of a grayscale image.
+
+    Args:
+        gray: 2-D uint8 image (e.g. a face crop)
+        hash_size: Grid size; the hash has hash_size**2 bits
+
+    Returns:
+        Hash as a Python int
+    """
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def face_hash(rgb_image: np.ndarray, location) -> Optional[int]:
+    """dHash of the face box of an RGB image (None for an empty box)."""
+    top, right, bottom, left = location
+    crop = rgb_image[max(0, top):bottom, max(0, left):right]
+    if crop.size == 0:
+        return None
+    return dhash(cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY))
+
+
+class RecognitionCache:
+    """Bounded, thread-safe LRU/TTL cache of match results by face hash."""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 10.0, max_distance: int = 0):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Entries kept before the least recently used is evicted (0 disables the cache)
+            ttl: Seconds an entry stays valid
+            max_distance: Hamming distance between hashes still treated as the same face crop (0 = exact)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.version = None
+        self._entries = OrderedDict()  # (scope, tolerance, hash) -> (stored_at, result)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _check_version(self, version: str):
+        """Drop every entry when the gallery version changed (caller holds the lock)."""
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+                logger.debug(f"Recognition cache invalidated ({self.version} -> {version})")
+            self._entries.clear()
+            self.version = version
+
+    def get(self, image_hash: int, tolerance: float, version: str, scope: str = '') -> Optional[Dict[str, Any]]:
+        """
+        Look up a result for a face hash.
+
+        Args:
+            image_hash: face_hash() of the probe
+            tolerance: Match tolerance the result must have been computed with
+            version: Current gallery version (model_version_key)
+            scope: Only entries stored under the same scope are considered
+
+        Returns:
+            A copy of the cached result, or None on a miss
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            key = (scope, tolerance, image_hash)
+            if key not in self._entries and self.max_distance > 0:
+                key = self._nearest(key)
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def _nearest(self, key: tuple) -> tuple:
+        """Key of the closest entry within max_distance in key's scope and tolerance, else key (caller holds the lock)."""
+        scope, tolerance, image_hash = key
+        best, best_distance = key, self.max_distance + 1
+        for candidate in self._entries:
+            if candidate[0] == scope and candidate[1] == tolerance:
+                distance = bin(candidate[2] ^ image_hash).count('1')
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+        return best
+
+    def put(self, image_hash: int, tolerance: float, version: str, result: Dict[str, Any], scope: str = ''):
+        """Store a result under a scope, evicting the least recently used entry if full."""
+        key = (scope, tolerance, image_hash)
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (time.monotonic(), dict(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
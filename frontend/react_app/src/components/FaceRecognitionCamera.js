@@ -4,6 +4,16 @@ import { Camera, X, CheckCircle, AlertCircle, Loader } from 'lucide-react';
 import { attendanceAPI } from '../services/api';
 import toast from 'react-hot-toast';
 
+// Stable per-browser id so the server can keep a recognition session for this camera
+const getDeviceId = () => {
+  let deviceId = localStorage.getItem('face_device_id');
+  if (!deviceId) {
+    deviceId = `web-${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+    localStorage.setItem('face_device_id', deviceId);
+  }
+  return deviceId;
+};
+
 const FaceRecognitionCamera = ({ onAttendanceRecorded, onClose, onRegisterNew }) => {
   const videoRef = useRef(null);
   const canvasRef = useRef(null);
@@ -454,7 +464,12 @@ const FaceRecognitionCamera = ({ onAttendanceRecorded, onClose, onRegisterNew })
       setIsProcessing(true);
 
       // Mark attendance using face recognition
-      const response = await attendanceAPI.markAttendanceFace(imageBlob);
+      const response = await attendanceAPI.markAttendanceFace(imageBlob, getDeviceId());
+
+      if (response.pending) {
+        // Server is still collecting votes for this face; keep scanning
+        return;
+      }
 
       if (response.success) {
         console.log("DEBUG: Attendance success for", response.student_name);
@@ -100,6 +100,19 @@ export const studentsAPI = {
 };
 
 // Attendance API
+// Poll a queued background job until it finishes; resolves with its result
+const waitForJob = async (job, intervalMs = 1000) => {
+  let current = job;
+  while (!['succeeded', 'failed', 'cancelled'].includes(current.status)) {
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    current = (await api.get(`/attendance/face/dataset/progress/?job_id=${current.job_id}`)).data;
+  }
+  if (current.status !== 'succeeded') {
+    throw new Error(current.error || `Job ${current.status}`);
+  }
+  return current.result;
+};
+
 export const attendanceAPI = {
   getDailyAttendance: (date) =>
     api.get('/attendance/daily/', { params: { date } }).then(res => res.data),
@@ -120,14 +133,32 @@ export const attendanceAPI = {
     api.post('/attendance/record/', { card_id: cardId }).then(res => res.data),
 
   // Face Recognition APIs
-  markAttendanceFace: (imageFile) => {
+  markAttendanceFace: (imageFile, deviceId) => {
     const formData = new FormData();
     formData.append('image', imageFile);
+    if (deviceId) formData.append('device_id', deviceId);
     return api.post('/attendance/face/record/', formData, {
       headers: { 'Content-Type': 'multipart/form-data' }
     }).then(res => res.data);
   },
 
+  markAttendanceGroup: (imageFile) => {
+    const formData = new FormData();
+    formData.append('image', imageFile);
+    return api.post('/attendance/face/record/group/', formData, {
+      headers: { 'Content-Type': 'multipart/form-data' }
+    }).then(res => res.data);
+  },
+
+  // Flush many buffered frames in one request
+  markAttendanceBatch: (imageFiles) => {
+    const formData = new FormData();
+    imageFiles.forEach(file => formData.append('images', file));
+    return api.post('/attendance/face/record/batch/', formData, {
+      headers: { 'Content-Type': 'multipart/form-data' }
+    }).then(res => res.data);
+  },
+
   registerStudentWithFace: (studentData, imageFile) => {
     const formData = new FormData();
     Object.keys(studentData).forEach(key => formData.append(key, studentData[key]));
@@ -151,14 +182,20 @@ export const attendanceAPI = {
           onProgress(percentCompleted);
         }
       }
-    }).then(res => res.data);
+    }).then(res => waitForJob(res.data));
   },
 
   getUploadProgress: (taskId) =>
     api.get(`/attendance/face/dataset/progress/?task_id=${taskId}`).then(res => res.data),
 
   trainModel: () =>
-    api.post('/attendance/face/model/train/').then(res => res.data),
+    api.post('/attendance/face/model/train/').then(res => waitForJob(res.data)),
+
+  cancelJob: (jobId) =>
+    api.post(`/attendance/face/jobs/${jobId}/cancel/`).then(res => res.data),
+
+  retryJob: (jobId) =>
+    api.post(`/attendance/face/jobs/${jobId}/retry/`).then(res => res.data),
 
   getModelStatus: () =>
     api.get('/attendance/face/model/status/').then(res => res.data),
@@ -11,8 +11,9 @@ import time
 import logging
 import sys
 import os
+import socket
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 # Configure logging
 logging.basicConfig(
@@ -29,7 +30,9 @@ class SerialListener:
     """Serial listener for RFID data from Arduino."""
     
     def __init__(self, port: str = '/dev/ttyUSB0', baudrate: int = 9600, 
-                 api_url: str = 'http://localhost:8000/api/attendance/record/'):
+                 api_url: str = 'http://localhost:8000/api/attendance/record/',
+                 batch_api_url: Optional[str] = None, device_id: Optional[str] = None,
+                 sync_batch_size: int = 500):
         """
         Initialize serial listener.
         
@@ -37,10 +40,16 @@ class SerialListener:
             port: Serial port (e.g., '/dev/ttyUSB0', '/dev/ttyACM0')
             baudrate: Baud rate for serial communication
             api_url: Django API endpoint URL
+            batch_api_url: Batch endpoint for offline scans (defaults to api_url + 'batch/')
+            device_id: Reader identifier sent with offline scans (defaults to the hostname)
+            sync_batch_size: Offline scans sent per batch request
         """
         self.port = port
         self.baudrate = baudrate
         self.api_url = api_url
+        self.batch_api_url = batch_api_url or api_url.rstrip('/') + '/batch/'
+        self.device_id = device_id or socket.gethostname()
+        self.sync_batch_size = sync_batch_size
         self.serial_connection = None
         self.is_running = False
         self.last_card_id = None
@@ -145,7 +154,8 @@ class SerialListener:
         """
         try:
             offline_file = '/var/log/edurfid/offline_scans.log'
-            timestamp = datetime.now().isoformat()
+            # Keep the UTC offset so the server dates the scan correctly whatever its timezone
+            timestamp = datetime.now().astimezone().isoformat()
             
             with open(offline_file, 'a') as f:
                 f.write(f"{timestamp},{card_id}\n")
@@ -183,9 +193,43 @@ class SerialListener:
             logger.warning(f"API unavailable, storing card {card_id} offline")
             self.store_offline(card_id)
 
+    def send_batch_to_api(self, scans: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+        """
+        Send a batch of scans to the Django batch API.
+        
+        Args:
+            scans: List of {'card_id', 'scanned_at', 'device_id'} dicts
+            
+        Returns:
+            dict: Batch response (per-scan outcomes) if accepted, None otherwise
+        """
+        try:
+            response = requests.post(
+                self.batch_api_url,
+                json={'scans': scans},
+                headers={'Content-Type': 'application/json'},
+                timeout=30
+            )
+            
+            if response.status_code == 200:
+                return response.json()
+            logger.warning(f"Batch API returned status {response.status_code}: {response.text}")
+            return None
+                
+        except requests.exceptions.ConnectionError:
+            logger.error("Connection error: Unable to reach Django API")
+            return None
+        except requests.exceptions.Timeout:
+            logger.error("Timeout error: Batch API request timed out")
+            return None
+        except Exception as e:
+            logger.error(f"Error sending batch to API: {e}")
+            return None
+
     def sync_offline_scans(self):
         """
-        Sync offline stored scans to API.
+        Sync offline stored scans to API in batches, keeping their original scan times.
+        Scans of a batch that could not be sent stay in the file for the next sync.
         """
         offline_file = '/var/log/edurfid/offline_scans.log'
         if not os.path.exists(offline_file):
@@ -195,29 +239,35 @@ class SerialListener:
             with open(offline_file, 'r') as f:
                 lines = f.readlines()
             
-            synced_count = 0
-            failed_count = 0
-            
+            scans = []
             for line in lines:
                 try:
                     timestamp, card_id = line.strip().split(',', 1)
-                    if self.send_to_api(card_id):
-                        synced_count += 1
-                    else:
-                        failed_count += 1
                 except ValueError:
                     continue
+                scans.append({'card_id': card_id, 'scanned_at': timestamp, 'device_id': self.device_id})
+            
+            synced_count = 0
+            unknown_count = 0
+            while synced_count < len(scans):
+                batch = scans[synced_count:synced_count + self.sync_batch_size]
+                result = self.send_batch_to_api(batch)
+                if result is None:
+                    break
+                synced_count += len(batch)
+                unknown_count += result.get('unknown_card', 0) + result.get('invalid', 0)
+            
+            # Keep only the scans that were not sent
+            with open(offline_file, 'w') as f:
+                for scan in scans[synced_count:]:
+                    f.write(f"{scan['scanned_at']},{scan['card_id']}\n")
             
-            # Remove synced scans from file
             if synced_count > 0:
-                with open(offline_file, 'w') as f:
-                    for line in lines[synced_count:]:
-                        f.write(line)
-                
                 logger.info(f"Synced {synced_count} offline scans to API")
-            
-            if failed_count > 0:
-                logger.warning(f"Failed to sync {failed_count} offline scans")
+            if unknown_count > 0:
+                logger.warning(f"{unknown_count} offline scans were rejected (unknown card or invalid)")
+            if synced_count < len(scans):
+                logger.warning(f"Failed to sync {len(scans) - synced_count} offline scans")
                 
         except Exception as e:
             logger.error(f"Error syncing offline scans: {e}")
@@ -283,9 +333,11 @@ def main():
     # Configuration
     SERIAL_PORT = os.environ.get('SERIAL_PORT', '/dev/ttyUSB0')
     API_URL = os.environ.get('API_URL', 'http://localhost:8000/api/attendance/record/')
+    BATCH_API_URL = os.environ.get('BATCH_API_URL')
+    DEVICE_ID = os.environ.get('DEVICE_ID')
     
     # Create and start listener
-    listener = SerialListener(port=SERIAL_PORT, api_url=API_URL)
+    listener = SerialListener(port=SERIAL_PORT, api_url=API_URL, batch_api_url=BATCH_API_URL, device_id=DEVICE_ID)
     
     try:
         listener.start_listening()